@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+
+#-------------------------------------------------------------------------------
+#
+#      The Magnetic Resonance Scanner Mockup Project
+#
+#
+#      M  R  S  M  _  A 3 1 3 0 1  .  p  y
+#
+#
+#      Last update: 261018
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+#  N O T E S :
+#
+#   Configuration of the A31301 3D Hall sensor, see
+#       A31301 Datasheet, Operation Modes (p.15), Bandwidth Selection (p.16),
+#       Control Registers (p.30)
+#
+#   Only the direct-space control registers are used; they can be written
+#   without the customer access code and are volatile (the EEPROM is not touched).
+#   All registers are 16 bit, MSByte at the even address.
+#
+#       OP_MODE_CONF        0x32:0x33   OP_MODE [3:1], SLEEP_CNT [6:4]
+#       INT_XYZ_CONF_DIR    0x38:0x39   AFE_CHAN_DIS_X/Y/Z_DIR [11], [12], [13]
+#       CIC_CORDIC_CONF_DIR 0x3A:0x3B   CIC_BW_SEL_DIR [6:4], CIC_BW_SEL_LPM_DIR [10:8]
+#
+#   The chip has no separate averaging setting: the CIC filter bandwidth
+#   (CIC_BW_SEL) IS the on-chip averaging. A lower value averages over a longer
+#   conversion, giving less noise at a lower update rate (datasheet Table 5).
+#   So instead of averaging on the host (i.e. more bus reads), the bandwidth is
+#   chosen as low as the field sampling period allows (see bandwidthSelectionForPeriod).
+#
+#   The driver reads the configuration registers once and keeps a shadow copy,
+#   a register is written only if its value changes, and never read back.
+#
+#   The writes are not yet verified on the Raspberry Pi: the datasheet requires
+#   a reset after a change of CIC_BW_SEL, the driver restarts the conversions
+#   by a short Sleep Mode only. So the magnetometer configures the sensors only
+#   on request (MRSM_Demo -a), otherwise they keep their power-on configuration.
+#
+#-------------------------------------------------------------------------------
+
+from enum import Enum
+
+from MRSM_Utilities import debug_message, error_message
+
+
+class A31301_Driver():
+    """
+    Register-level configuration of one A31301 (operating mode, bandwidth, enabled channels)
+    """
+
+    REGISTER = {
+        'OP_MODE_CONF':         0x32,
+        'INT_XYZ_CONF_DIR':     0x38,
+        'CIC_CORDIC_CONF_DIR':  0x3A,
+    }
+
+    # register name -> {field name: (lowest bit, number of bits)}
+    FIELD = {
+        'OP_MODE_CONF':         {'OP_MODE':            (1,3),  'SLEEP_CNT':          (4,3)},
+        'INT_XYZ_CONF_DIR':     {'AFE_CHAN_DIS_X_DIR': (11,1), 'AFE_CHAN_DIS_Y_DIR': (12,1), 'AFE_CHAN_DIS_Z_DIR': (13,1)},
+        'CIC_CORDIC_CONF_DIR':  {'CIC_BW_SEL_DIR':     (4,3),  'CIC_BW_SEL_LPM_DIR': (8,3)},
+    }
+
+    class OperatingMode(Enum):
+        ACTIVE  = 0
+        SLEEP   = 3
+        LPDCM   = 6     # Low Power Duty Cycle Mode
+
+    # CIC_BW_SEL -> (bandwidth [Hz], update period [sec] with 1, 2, 3 channels enabled, Z noise [G], X/Y noise [G])
+    # see A31301 Datasheet, Table 5 (600 G device)
+    BANDWIDTH_SELECTION = {
+        0: (  195.5, (1024e-6, 6156e-6, 9234e-6), 0.052, 0.100),
+        1: (  391.0, ( 512e-6, 3084e-6, 4626e-6), 0.073, 0.141),
+        2: (  782.0, ( 256e-6, 1548e-6, 2322e-6), 0.103, 0.200),
+        3: ( 1564.0, ( 128e-6,  780e-6, 1170e-6), 0.146, 0.283),
+        4: ( 3128.0, (  64e-6,  396e-6,  594e-6), 0.207, 0.400),
+        5: ( 6256.0, (  32e-6,  204e-6,  306e-6), 0.293, 0.566),
+        6: (12512.0, (  16e-6,  108e-6,  162e-6), 0.414, 0.800),
+    }
+
+    def __init__(self,magnetometer,sensorPos) -> None:
+        self.magnetometer       = magnetometer
+        self.sensorPos          = sensorPos
+        self.shadowRegisters    = {}    # register name -> 16bit value, as last read or written
+        self.registerWriteCount = 0
+
+    # ---- register access -------------------------------------------------
+
+    def readRegister(self,registerName) -> int:
+        with self.magnetometer.sensorBus(self.sensorPos) as (smbus, I2C_address):
+            msb, lsb = smbus.read_i2c_block_data(I2C_address,A31301_Driver.REGISTER[registerName],2)
+        return (msb<<8) | lsb
+
+    def writeRegister(self,registerName,value) -> None:
+        """
+        writes the register only if the value differs from the shadow copy
+        """
+        if self.shadowRegisters.get(registerName)==value:
+            return
+        with self.magnetometer.sensorBus(self.sensorPos) as (smbus, I2C_address):
+            smbus.write_i2c_block_data(I2C_address,A31301_Driver.REGISTER[registerName],[value>>8, value & 0xFF])
+        self.shadowRegisters[registerName] = value
+        self.registerWriteCount += 1
+
+    def readConfiguration(self) -> None:
+        """
+        fills the shadow copy, needed once after power-on (or after the sensor has been plugged in)
+        """
+        self.shadowRegisters = {r: self.readRegister(r) for r in A31301_Driver.REGISTER}
+
+    def getField(self,registerName,fieldName) -> int:
+        lowestBit, bitCount = A31301_Driver.FIELD[registerName][fieldName]
+        return (self.shadowRegisters[registerName]>>lowestBit) & ((1<<bitCount)-1)
+
+    def setField(self,registerName,fieldName,value) -> None:
+        lowestBit, bitCount = A31301_Driver.FIELD[registerName][fieldName]
+        mask = ((1<<bitCount)-1)<<lowestBit
+        self.writeRegister(registerName,(self.shadowRegisters[registerName] & ~mask) | ((value<<lowestBit) & mask))
+
+    # ---- configuration ---------------------------------------------------
+
+    def configure(self,bandwidthSelection,enabledChannels=(True,True,True),
+                  operatingMode: OperatingMode=OperatingMode.ACTIVE) -> None:
+        """
+        startup configuration, 'enabledChannels' are the (X,Y,Z) magnetic channels
+        """
+        self.readConfiguration()
+        self.setEnabledChannels(*enabledChannels)
+        self.setBandwidthSelection(bandwidthSelection)
+        self.setOperatingMode(operatingMode)
+        debug_message(f"A31301 {self.sensorPos}: {operatingMode.name}, CIC_BW_SEL={bandwidthSelection}, "
+                      f"update period {self.updatePeriodSec()*1e3:.2f} ms")
+
+    def setOperatingMode(self,operatingMode: OperatingMode) -> None:
+        self.setField('OP_MODE_CONF','OP_MODE',operatingMode.value)
+
+    def operatingMode(self) -> OperatingMode:
+        return A31301_Driver.OperatingMode(self.getField('OP_MODE_CONF','OP_MODE'))
+
+    def setEnabledChannels(self,isXEnabled,isYEnabled,isZEnabled) -> None:
+        self.setField('INT_XYZ_CONF_DIR','AFE_CHAN_DIS_X_DIR',0 if isXEnabled else 1)
+        self.setField('INT_XYZ_CONF_DIR','AFE_CHAN_DIS_Y_DIR',0 if isYEnabled else 1)
+        self.setField('INT_XYZ_CONF_DIR','AFE_CHAN_DIS_Z_DIR',0 if isZEnabled else 1)
+
+    def enabledChannelCount(self) -> int:
+        return sum(1-self.getField('INT_XYZ_CONF_DIR',f) for f in ('AFE_CHAN_DIS_X_DIR','AFE_CHAN_DIS_Y_DIR','AFE_CHAN_DIS_Z_DIR'))
+
+    def setBandwidthSelection(self,bandwidthSelection) -> None:
+        if bandwidthSelection not in A31301_Driver.BANDWIDTH_SELECTION:
+            error_message(f"A31301 {self.sensorPos}: CIC_BW_SEL {bandwidthSelection} not supported")
+            return
+        if self.getField('CIC_CORDIC_CONF_DIR','CIC_BW_SEL_DIR')==bandwidthSelection:
+            return
+        self.setField('CIC_CORDIC_CONF_DIR','CIC_BW_SEL_DIR',bandwidthSelection)
+        if self.operatingMode()==A31301_Driver.OperatingMode.ACTIVE:
+            # restart the conversions with the new filter (see NOTES)
+            self.setOperatingMode(A31301_Driver.OperatingMode.SLEEP)
+            self.setOperatingMode(A31301_Driver.OperatingMode.ACTIVE)
+
+    def bandwidthSelection(self) -> int:
+        return self.getField('CIC_CORDIC_CONF_DIR','CIC_BW_SEL_DIR')
+
+    def updatePeriodSec(self) -> float:
+        """
+        how often the output registers get a new conversion, with the current configuration
+        """
+        channelCount = max(1,self.enabledChannelCount())
+        return A31301_Driver.BANDWIDTH_SELECTION[self.bandwidthSelection()][1][channelCount-1]
+
+    @staticmethod
+    def bandwidthSelectionForPeriod(samplingPeriodSec,channelCount=3) -> int:
+        """
+        the lowest-noise CIC_BW_SEL whose update period still fits in the sampling period,
+        so that every reading is a new, maximally averaged, conversion
+        """
+        for bandwidthSelection,(_,updatePeriodSec,_,_) in sorted(A31301_Driver.BANDWIDTH_SELECTION.items()):
+            if updatePeriodSec[channelCount-1]<=samplingPeriodSec:
+                return bandwidthSelection
+        return max(A31301_Driver.BANDWIDTH_SELECTION)
@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+
+#-------------------------------------------------------------------------------
+#
+#      The Magnetic Resonance Scanner Mockup Project
+#
+#
+#      M  R  S  M  _  A c q u i s i t i o n  .  p  y
+#
+#
+#      Last update: 261018
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+#  N O T E S :
+#
+#   The magnetometer is sampled in a background thread, so that the (blocking)
+#   SMBus I/O never runs in the Qt event loop. The GUI timers only pick up
+#   the latest complete sweep from the ring buffer.
+#
+#   The ring buffer has a single writer (the acquisition thread) and does not
+#   use locks: the writer fills a free slot and then publishes it by incrementing
+#   'writeCount'. Readers copy the newest slot and check afterwards that the slot
+#   has not been reused in the meantime (seqlock pattern). Under the GIL, the
+#   assignment of 'writeCount' is atomic.
+#
+#   The AcquisitionScheduler decides what is read in each tick of the thread.
+#   Every channel class (field, temperature, availability probe) has its own
+#   sweep period and priority. The sensors of a sweep are read round-robin,
+#   and only as many transactions are issued per tick as fit in the bus time
+#   budget; an unfinished sweep continues in the next tick.
+#   With several I2C buses, every bus has its own budget and the buses are
+#   served in parallel (see MRSM_Magnetometer.runOnEachBus).
+#
+#   Only the available sensors are swept, the rows of missing sensors are NaN.
+#   A sensor failing a read is dropped from the sweeps at once. The AVAILABILITY
+#   channel probes the missing sensors, each one only when its backoff interval
+#   has elapsed (see MRSM_Magnetometer.setSensorAvailability), so that a sensor
+#   plugged in (or coming back) is picked up without costing a NACK per tick.
+#
+#   The FIELD channel only collects the raw register bytes of the sensors,
+#   the whole sweep is decoded in one NumPy pass when it is complete
+#   (see MRSM_Magnetometer.decodeRawFieldBlocks). With an emulated (or
+#   replayed) signal source, all sensors of the FIELD sweep are computed by
+#   one evaluation of the source (getSweep) in the tick which starts it.
+#
+#   Every field reading carries its own time.monotonic_ns() instant. As the
+#   sensors are read one after another, a sweep is smeared over several ms.
+#   FrameRingBuffer.latest(hasToAlign=True) interpolates every sensor linearly
+#   between its last two readings to one common instant, the first reading of
+#   the newest sweep; this instant lies between the two readings of every
+#   sensor, so there is no extrapolation (at the cost of less than one sweep
+#   of latency).
+#
+#-------------------------------------------------------------------------------
+
+import threading
+from collections import deque
+from enum import Enum
+from time import time, monotonic_ns
+
+import numpy as np
+
+from MRSM_Utilities import debug_message, error_message
+
+
+class AcquisitionChannel(Enum):
+        FIELD           = 1     # X,Y,Z field components
+        TEMPERATURE     = 2     # die temperature
+        AVAILABILITY    = 3     # probing for sensors which are not available (yet)
+
+
+class FrameRingBuffer():
+    """
+    Preallocated ring buffer of magnetometer sweeps (MagnetometerFrame data)
+    """
+
+    def __init__(self,sensorNames,frameClass,capacity=64) -> None:
+        self.sensorNames  = tuple(sensorNames)
+        self.frameClass   = frameClass                            # MagnetometerFrame
+        self.capacity     = capacity
+        self.data         = np.zeros((capacity,len(self.sensorNames),4))
+        self.timestamps   = np.zeros(capacity)
+        self.sampleTimesNs= np.zeros((capacity,len(self.sensorNames)),dtype=np.int64)   # instant of every field reading
+        self.holderPositions = np.full((capacity,2),np.nan)       # recorded holder position of replayed sweeps
+        self.slotSequence = np.full(capacity,-1,dtype=np.int64)  # which sweep is stored in the slot
+        self.writeCount   = 0                                     # number of published sweeps
+
+    def nextSlot(self) -> np.ndarray:
+        """
+        writer only: returns the (sensors x 4) array to be filled by the next sweep
+        """
+        slot = self.writeCount % self.capacity
+        self.slotSequence[slot] = -1    # the slot is not valid while being written
+        return self.data[slot]
+
+    def publish(self,timestamp,sampleTimesNs,holderPosition=None) -> None:
+        """
+        writer only: makes the slot returned by nextSlot() visible to readers;
+        'holderPosition' is None for live readings (see MagnetometerFrame)
+        """
+        slot = self.writeCount % self.capacity
+        self.timestamps[slot] = timestamp
+        self.sampleTimesNs[slot] = sampleTimesNs
+        self.holderPositions[slot] = np.nan if holderPosition is None else holderPosition
+        self.slotSequence[slot] = self.writeCount
+        self.writeCount += 1
+
+    def copySlot(self,sequence) -> tuple:
+        """
+        returns (data, timestamp, sampleTimesNs, holderPosition) of a published sweep,
+        None if the writer has already reused its slot
+        """
+        slot = sequence % self.capacity
+        data = self.data[slot].copy()
+        timestamp = self.timestamps[slot]
+        sampleTimesNs = self.sampleTimesNs[slot].copy()
+        holderPosition = self.holderPositions[slot].copy()
+        if self.slotSequence[slot]!=sequence:
+            return None
+        return (data,timestamp,sampleTimesNs,holderPosition)
+
+    def latest(self,hasToAlign=False):
+        """
+        returns a copy of the newest complete sweep as a MagnetometerFrame,
+        or None if nothing has been acquired yet;
+        with 'hasToAlign', the field readings are interpolated to a common instant (see NOTES)
+        """
+        while True:
+            sequence = self.writeCount-1
+            if sequence<0:
+                return None
+            newest = self.copySlot(sequence)
+            if newest is None:
+                continue    # the writer has wrapped around and reused the slot, try again
+            if not hasToAlign or sequence==0:
+                return self.frameClass(self.sensorNames,*newest)
+            previous = self.copySlot(sequence-1)
+            if previous is None:
+                continue
+            return self.frameClass(self.sensorNames,*self.alignedSweep(previous,newest))
+
+    @staticmethod
+    def alignedSweep(previous,newest) -> tuple:
+        """
+        interpolates the X,Y,Z readings of every sensor between two consecutive sweeps
+        to the first reading instant of the newest sweep, returns (data, timestamp, sampleTimesNs, holderPosition)
+        """
+        previousData, _, previousTimesNs, _ = previous
+        data, timestamp, sampleTimesNs, holderPosition = newest
+        isRead = ~np.isnan(data[:,0])
+        if not isRead.any():
+            return newest
+        alignmentTimeNs = sampleTimesNs[isRead].min()
+        durationNs = (sampleTimesNs-previousTimesNs).astype(float)
+        weight = np.divide((alignmentTimeNs-previousTimesNs).astype(float),durationNs,
+                           out=np.ones(len(durationNs)),where=durationNs>0)
+        aligned = previousData[:,0:3] + weight[:,None]*(data[:,0:3]-previousData[:,0:3])
+        # sensors missing in the previous sweep keep their newest reading
+        data[:,0:3] = np.where(np.isnan(previousData[:,0:3]),data[:,0:3],aligned)
+        return (data,timestamp,np.full(len(sampleTimesNs),alignmentTimeNs,dtype=np.int64),holderPosition)
+
+
+class AcquisitionScheduler():
+    """
+    Multi-rate scheduling of the magnetometer bus transactions
+    """
+
+    DEFAULT_CHANNEL_CONFIG = {
+        # 'periodSec' is the period of a complete sweep over all sensors,
+        # 'priority' 0 is the highest
+        AcquisitionChannel.FIELD:           {'periodSec':   0.05,   'priority': 0},
+        AcquisitionChannel.TEMPERATURE:     {'periodSec':   5.0,    'priority': 1},
+        AcquisitionChannel.AVAILABILITY:    {'periodSec':   0.5,    'priority': 2},   # per-sensor backoff applies
+    }
+    BUS_TIME_BUDGET_SEC = 0.008     # per tick
+    STATISTICS_LENGTH   = 32        # number of sweeps used for rate and jitter
+
+    class ChannelState():
+
+        def __init__(self,periodSec,priority) -> None:
+            self.periodSec              = periodSec
+            self.priority               = priority
+            self.nextSweepTime          = 0.0       # when the next sweep is due
+            self.sweepStartTime         = None      # None if no sweep is in progress
+            self.sweepSensors           = {}        # bus -> sensors of the sweep in progress
+            self.cursor                 = {}        # bus -> round-robin position in 'sweepSensors'
+            self.transactionCostSec     = 0.0       # running estimate of one transaction
+            self.sweepCompletionTimes   = deque(maxlen=AcquisitionScheduler.STATISTICS_LENGTH)
+
+    def __init__(self,magnetometer,ringBuffer,busTimeBudgetSec=BUS_TIME_BUDGET_SEC,channelConfig=None) -> None:
+        self.magnetometer       = magnetometer
+        self.ringBuffer         = ringBuffer
+        self.busTimeBudgetSec   = busTimeBudgetSec
+        self.sensorIndex        = {s: i for i,s in enumerate(ringBuffer.sensorNames)}
+        self.currentData        = np.full((len(ringBuffer.sensorNames),4),np.nan)   # latest reading of every channel
+        self.fieldBlocks        = np.zeros((len(ringBuffer.sensorNames),6),dtype=np.uint8) # raw X,Y,Z registers of the sweep in progress
+        self.sampleTimesNs      = np.zeros(len(ringBuffer.sensorNames),dtype=np.int64)     # instant of the latest field reading
+        self.isFieldBlockRead   = np.zeros(len(ringBuffer.sensorNames),dtype=bool)
+        self.channels = {
+            channel: AcquisitionScheduler.ChannelState(config['periodSec'],config['priority'])
+            for channel,config in (channelConfig or AcquisitionScheduler.DEFAULT_CHANNEL_CONFIG).items()
+        }
+
+    def setChannelPeriod(self,channel: AcquisitionChannel,periodSec) -> None:
+        self.channels[channel].periodSec = periodSec
+        if channel==AcquisitionChannel.FIELD:
+            # a longer period allows more on-chip averaging, i.e. less noise
+            self.magnetometer.setSensorBandwidthForPeriod(periodSec)
+
+    def sensorsForChannel(self,channel: AcquisitionChannel) -> dict:
+        """
+        returns {bus: sensors in sweep order}
+        """
+        if channel==AcquisitionChannel.AVAILABILITY:
+            return {b: self.magnetometer.sensorsDueForProbe(sensors)
+                    for b,sensors in self.magnetometer.sweepOrderByBus.items()}
+        availableSensors = self.magnetometer.availableSensors
+        return {b: [s for s in sensors if s in availableSensors] for b,sensors in self.magnetometer.sweepOrderByBus.items()}
+
+    def readSensor(self,channel: AcquisitionChannel,sensorPos) -> None:
+        i = self.sensorIndex[sensorPos]
+        row = self.currentData[i]
+        if channel==AcquisitionChannel.FIELD:
+            readStartTimeNs = monotonic_ns()
+            block = self.magnetometer.readFieldBlock(sensorPos)
+            if block is None:
+                row[0:3] = np.nan
+            else:
+                self.fieldBlocks[i] = block
+                self.isFieldBlockRead[i] = True
+            self.sampleTimesNs[i] = (readStartTimeNs+monotonic_ns())//2
+        elif channel==AcquisitionChannel.TEMPERATURE:
+            row[3] = self.magnetometer.getTemperatureReadingDegC(sensorPos)
+        elif channel==AcquisitionChannel.AVAILABILITY:
+            if self.magnetometer.probeSensor(sensorPos):
+                # do not wait for the next temperature sweep
+                row[3] = self.magnetometer.getTemperatureReadingDegC(sensorPos)
+
+    def readEmulatedFieldSweep(self,state: ChannelState) -> None:
+        """
+        the sensors of the FIELD sweep not read yet, by one evaluation of the emulated (or replayed) source
+        """
+        sensors = [s for b,busSensors in state.sweepSensors.items() for s in busSensors[state.cursor[b]:]]
+        state.cursor = {b: len(busSensors) for b,busSensors in state.sweepSensors.items()}
+        if len(sensors)==0:
+            return
+        rows = [self.sensorIndex[s] for s in sensors]
+        readStartTimeNs = monotonic_ns()
+        try:
+            sweep = self.magnetometer.signalEmulator.getSweep(sensors)
+        except Exception as e:
+            error_message(f"Magnetometer FIELD reading failed: {e}")
+            sweep = np.full((len(sensors),4),np.nan)
+        self.currentData[rows,0:3] = sweep[:,0:3]
+        self.sampleTimesNs[rows] = (readStartTimeNs+monotonic_ns())//2
+        for s,i in zip(sensors,rows):
+            if np.isnan(self.currentData[i,0]):
+                self.magnetometer.setSensorAvailability(s,False)     # did not respond
+
+    def completeSweep(self,channel: AcquisitionChannel,state: ChannelState) -> None:
+        state.sweepCompletionTimes.append(time())
+        if channel==AcquisitionChannel.FIELD:
+            if self.isFieldBlockRead.any():
+                self.currentData[self.isFieldBlockRead,0:3] = (
+                    self.magnetometer.decodeRawFieldBlocks(self.fieldBlocks[self.isFieldBlockRead]))
+                self.isFieldBlockRead[:] = False
+            availableSensors = self.magnetometer.availableSensors
+            for s,i in self.sensorIndex.items():
+                if s not in availableSensors:
+                    self.currentData[i,:] = np.nan
+            self.magnetometer.recordSweep(self.currentData,self.sampleTimesNs,state.sweepStartTime)
+            slot = self.ringBuffer.nextSlot()
+            slot[:] = self.currentData
+            self.magnetometer.applyCalibration(slot)
+            self.ringBuffer.publish(state.sweepStartTime,self.sampleTimesNs,self.magnetometer.getReplayedHolderPosition())
+        state.sweepStartTime = None
+
+    def runTickOnBus(self,bus,busSensors,prioritizedChannels) -> None:
+        """
+        issues the transactions of one bus, by channel priority, within the bus time budget 
+        """
+        spentSec = 0.0
+        for channel,state in prioritizedChannels:
+            sensors = state.sweepSensors.get(bus,[])
+            while state.cursor[bus]<len(sensors):
+                # at least one transaction per tick, so that the sweeps always progress
+                if spentSec>0 and spentSec+state.transactionCostSec>self.busTimeBudgetSec:
+                    return
+                transactionStartTime = time()
+                try:
+                    self.readSensor(channel,sensors[state.cursor[bus]])
+                except Exception as e:
+                    error_message(f"Magnetometer {channel.name} reading failed: {e}")
+                transactionSec = time()-transactionStartTime
+                state.transactionCostSec = 0.8*state.transactionCostSec + 0.2*transactionSec
+                spentSec += transactionSec
+                state.cursor[bus] += 1
+
+    def runTick(self) -> None:
+        """
+        starts the due sweeps and lets all buses work on the sweeps in progress 
+        """
+        tickStartTime = time()
+        prioritizedChannels = []
+        for channel,state in sorted(self.channels.items(),key=lambda cs: cs[1].priority):
+            if state.sweepStartTime is None:
+                if tickStartTime<state.nextSweepTime:
+                    continue
+                # start a new sweep; the period is measured from start to start
+                state.sweepStartTime = tickStartTime
+                if state.nextSweepTime+state.periodSec>tickStartTime:
+                    state.nextSweepTime += state.periodSec
+                else:
+                    # more than one period late, do not try to catch up
+                    state.nextSweepTime = tickStartTime+state.periodSec
+                state.sweepSensors = self.sensorsForChannel(channel)
+                state.cursor = {b: 0 for b in state.sweepSensors}
+            prioritizedChannels += [(channel,state)]
+            if channel==AcquisitionChannel.FIELD and self.magnetometer.isReadingThroughEmulator:
+                self.readEmulatedFieldSweep(state)
+
+        self.magnetometer.runOnEachBus(self.runTickOnBus,prioritizedChannels)
+
+        for channel,state in prioritizedChannels:
+            if all(state.cursor[b]>=len(sensors) for b,sensors in state.sweepSensors.items()):
+                self.completeSweep(channel,state)
+
+    def getChannelStatistics(self) -> dict:
+        """
+        returns {channel: (achieved sweep rate [Hz], jitter of the sweep period [sec])},
+        None values if there are not enough sweeps yet
+        """
+        statistics = {}
+        for channel,state in self.channels.items():
+            if len(state.sweepCompletionTimes)<3:
+                statistics[channel] = (None,None)
+                continue
+            periods = np.diff(np.array(state.sweepCompletionTimes))
+            statistics[channel] = (1.0/periods.mean(), periods.std())
+        return statistics
+
+
+class AcquisitionWorker(threading.Thread):
+    """
+    Samples the magnetometer continuously into a FrameRingBuffer,
+    the bus transactions are planned by an AcquisitionScheduler.
+    The worker is created paused, use resume() / pause() when the panels
+    showing the readings are (de)activated.
+    """
+
+    SAMPLING_PERIOD_SEC = 0.05      # of the field components
+    TICK_PERIOD_SEC     = 0.01
+
+    def __init__(self,magnetometer,frameClass,samplingPeriodSec=SAMPLING_PERIOD_SEC,capacity=64) -> None:
+        super().__init__(name="MRSM_AcquisitionWorker",daemon=True)
+        self.magnetometer       = magnetometer
+        self.ringBuffer         = FrameRingBuffer(magnetometer.MgMGeometry.keys(),frameClass,capacity)
+        self.scheduler          = AcquisitionScheduler(magnetometer,self.ringBuffer)
+        self.scheduler.setChannelPeriod(AcquisitionChannel.FIELD,samplingPeriodSec)
+        self.runEvent           = threading.Event()
+        self.stopEvent          = threading.Event()
+
+    def resume(self) -> None:
+        if not self.is_alive():
+            self.start()
+        self.runEvent.set()
+
+    def pause(self) -> None:
+        self.runEvent.clear()
+
+    def finalize(self) -> None:
+        self.stopEvent.set()
+        self.runEvent.set()     # wake up a paused worker so that it can quit
+        if self.is_alive():
+            self.join(timeout=1.0)
+
+    def latestFrame(self,hasToAlign=False):
+        """
+        the newest sweep, see FrameRingBuffer.latest()
+        """
+        return self.ringBuffer.latest(hasToAlign)
+
+    def run(self) -> None:
+        debug_message("Magnetometer acquisition thread started")
+        while not self.stopEvent.is_set():
+            self.runEvent.wait()
+            if self.stopEvent.is_set():
+                break
+            tickStartTime = time()
+            self.scheduler.runTick()
+            remainingSec = self.TICK_PERIOD_SEC - (time()-tickStartTime)
+            if remainingSec>0:
+                self.stopEvent.wait(remainingSec)
+        debug_message("Magnetometer acquisition thread finished")
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+
+#-------------------------------------------------------------------------------
+#
+#      The Magnetic Resonance Scanner Mockup Project
+#
+#
+#      M  R  S  M  _  C a l i b r a t i o n  .  p  y
+#
+#
+#      Last update: 261018
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+#  N O T E S :
+#
+#   Per-sensor correction of the raw A31301 readings, so that field maps from
+#   different holders (chips) can be compared.
+#
+#   Sensor model (raw readings in the Sensor coordinate frame, in counts):
+#
+#       raw = A @ B + offset + temperatureCoefficient * (T - referenceTemperatureDegC)
+#
+#   where B is the true field (in counts of an ideal sensor), A is the 3x3
+#   gain / cross-axis matrix. The correction is the inverse:
+#
+#       corrected = G @ (raw - offset - temperatureCoefficient * (T - referenceTemperatureDegC)),   G = inv(A)
+#
+#   The parameters of all sensors are kept in stacked arrays, so that a whole
+#   sweep is corrected by one batched matrix operation (see apply()).
+#
+#   Calibration file (JSON):
+#
+#       {"referenceTemperatureDegC": 25.0,
+#        "sensors": {
+#           "sensorPositionName": {"Gain": [[..],[..],[..]], "Offset": [..], "TemperatureCoefficient": [..]},
+#           ...
+#       }}
+#
+#   Sensors not listed in the file are left uncorrected.
+#
+#   Calibration run: the holder is exposed to a sequence of known homogeneous
+#   fields (e.g. of a coil) while the sweeps are recorded (MRSM_Demo -R, see
+#   MRSM_Recording). The run file gives the applied fields, in the Scanner
+#   coordinates and relative units (as the field maps), and when they were
+#   applied, in seconds from the first recorded sweep:
+#
+#       {"steps": [{"start": 2.0, "end": 8.0, "field": [0.0, 0.0, 0.5]}, ...]}
+#
+#   The sweeps between the steps (field being switched) are left out. The
+#   recorded holder rotation gives the reference field in the Sensor frame of
+#   every sensor. The fields should span all three axes in the Sensor frames;
+#   the temperature coefficient is only fitted if the run covers
+#   MIN_TEMPERATURE_SPAN_DEGC, otherwise it is left zero. To fit and save
+#   a calibration file (loaded by MRSM_Demo -c), run
+#       python code/MRSM_Calibration.py recording.mrsmrec run.json calibration.json [holder.json]
+#   A sensor whose samples do not determine all parameters is left uncorrected.
+#   The fit is checked on synthetic sensors by
+#       python code/MRSM_Calibration.py --test
+#
+#-------------------------------------------------------------------------------
+
+import json
+
+import numpy as np
+
+from MRSM_Utilities import debug_message, error_message
+
+
+class SensorCalibration():
+    """
+    Gain / cross-axis matrix, offset vector and temperature coefficient of every sensor
+    """
+
+    REFERENCE_TEMPERATURE_DEGC  = 25.0
+    MIN_SAMPLE_COUNT            = 5
+    MIN_TEMPERATURE_SPAN_DEGC   = 5.0   # for the temperature coefficient to be fitted
+
+    def __init__(self,sensorNames,referenceTemperatureDegC=REFERENCE_TEMPERATURE_DEGC) -> None:
+        self.sensorNames                = tuple(sensorNames)
+        self.sensorIndex                = {s: i for i,s in enumerate(self.sensorNames)}
+        self.referenceTemperatureDegC   = referenceTemperatureDegC
+        n = len(self.sensorNames)
+        # identity calibration, i.e. no correction
+        self.gains                      = np.tile(np.eye(3),(n,1,1))    # (sensors x 3 x 3), G = inv(A)
+        self.offsets                    = np.zeros((n,3))               # in counts
+        self.temperatureCoefficients    = np.zeros((n,3))               # in counts per degC
+        self.filename                   = None
+
+    def apply(self,rawReadings: np.ndarray,temperaturesDegC: np.ndarray) -> np.ndarray:
+        """
+        corrects a whole sweep at once: 'rawReadings' is (sensors x 3), 'temperaturesDegC' is (sensors,),
+        rows follow 'sensorNames'; returns the corrected (sensors x 3) readings in counts.
+        Missing sensors (NaN) stay NaN, unknown temperatures (NaN) are taken as the reference temperature.
+        """
+        deltaTemperature = np.nan_to_num(temperaturesDegC-self.referenceTemperatureDegC)
+        centered = rawReadings - self.offsets - self.temperatureCoefficients*deltaTemperature[:,None]
+        return np.einsum('nij,nj->ni',self.gains,centered)
+
+    def fitSensor(self,sensorPos,rawReadings,temperaturesDegC,referenceField) -> float:
+        """
+        least-squares fit of the sensor model from a calibration run:
+        'rawReadings' (samples x 3) and 'temperaturesDegC' (samples,) as read from the sensor,
+        'referenceField' (samples x 3) is the known field in the Sensor coordinate frame, in counts.
+        The run needs at least MIN_SAMPLE_COUNT samples, with field directions spanning all 3 axes;
+        the temperature coefficient is fitted only if the temperatures span MIN_TEMPERATURE_SPAN_DEGC
+        (otherwise it is zero). Returns the RMS residual in counts; NaN if the run does not
+        determine all parameters, the sensor is left uncorrected then.
+        """
+        rawReadings         = np.asarray(rawReadings,dtype=float)
+        referenceField      = np.asarray(referenceField,dtype=float)
+        deltaTemperature    = np.asarray(temperaturesDegC,dtype=float)-self.referenceTemperatureDegC
+        hasToFitTemperature = np.ptp(deltaTemperature)>=SensorCalibration.MIN_TEMPERATURE_SPAN_DEGC
+
+        # raw = [B, 1, dT] @ [A^T; offset; temperatureCoefficient]
+        design = np.column_stack((referenceField,np.ones(len(rawReadings)))+((deltaTemperature,) if hasToFitTemperature else ()))
+        coefficients, _, rank, _ = np.linalg.lstsq(design,rawReadings,rcond=None)
+        i = self.sensorIndex[sensorPos]
+        if rank<design.shape[1]:
+            error_message(f"Calibration of sensor {sensorPos}: the run does not determine all parameters (rank {rank}), left uncorrected")
+            self.gains[i]                   = np.eye(3)
+            self.offsets[i]                 = 0.0
+            self.temperatureCoefficients[i] = 0.0
+            return np.nan
+
+        self.gains[i]                   = np.linalg.inv(coefficients[0:3].T)
+        self.offsets[i]                 = coefficients[3]
+        self.temperatureCoefficients[i] = coefficients[4] if hasToFitTemperature else 0.0
+        return float(np.sqrt(np.mean((design @ coefficients - rawReadings)**2)))
+
+    def load(self,filename) -> None:
+        with open(filename,'r') as file:
+            calibration = json.load(file)
+        self.referenceTemperatureDegC = calibration.get('referenceTemperatureDegC',SensorCalibration.REFERENCE_TEMPERATURE_DEGC)
+        for sensorPos,sensor in calibration['sensors'].items():
+            if sensorPos not in self.sensorIndex:
+                error_message(f"Calibration file {filename}: unknown sensor {sensorPos}")
+                continue
+            i = self.sensorIndex[sensorPos]
+            self.gains[i]                   = sensor['Gain']
+            self.offsets[i]                 = sensor['Offset']
+            self.temperatureCoefficients[i] = sensor['TemperatureCoefficient']
+        self.filename = filename
+        debug_message(f"Calibration loaded from {filename}")
+
+    def save(self,filename) -> None:
+        calibration = {
+            'referenceTemperatureDegC': self.referenceTemperatureDegC,
+            'sensors': {
+                s: {'Gain':                     self.gains[i].tolist(),
+                    'Offset':                   self.offsets[i].tolist(),
+                    'TemperatureCoefficient':   self.temperatureCoefficients[i].tolist()}
+                for s,i in self.sensorIndex.items()
+            },
+        }
+        with open(filename,'w') as file:
+            json.dump(calibration,file,indent=4)
+        self.filename = filename
+        debug_message(f"Calibration saved to {filename}")
+
+
+def fitCalibrationFromRecording(recordingFile,runFile,holderConfigurationFile=None) -> tuple:
+    """
+    fits the calibration of the recorded sensors from a calibration run (see NOTES);
+    returns (SensorCalibration, {sensorPos: RMS residual in counts})
+    """
+    from MRSM_Controller import MRSM_Magnetometer
+
+    # the replay decodes the raw (uncalibrated) readings of all sweeps
+    magnetometer = MRSM_Magnetometer(holderConfigurationFile=holderConfigurationFile,
+                                     replayFile=recordingFile,replaySpeed=None)
+    replay = magnetometer.signalEmulator
+    with open(runFile,'r') as file:
+        run = json.load(file)
+
+    # the applied field of every sweep, in the Scanner coordinates and counts (NaN between the steps)
+    sweepTimes = replay.relativeTimes
+    appliedField = np.full((len(sweepTimes),3),np.nan)
+    for step in run['steps']:
+        isInStep = (sweepTimes>=step['start']) & (sweepTimes<=step['end'])
+        appliedField[isInStep] = np.asarray(step['field'],dtype=float)*MRSM_Magnetometer.A31301_maxReadingRange
+    isInRun = ~np.isnan(appliedField).any(axis=1)
+
+    # in the Sensor frames: the transposed rotations (Sensor -> Scanner) of the recorded holder rotation
+    geometry = magnetometer.MgMGeometry
+    referenceField = np.full((len(sweepTimes),len(geometry),3),np.nan)
+    for angleDeg in np.unique(replay.holderRotationAnglesDeg[isInRun]):
+        sweeps = isInRun & (replay.holderRotationAnglesDeg==angleDeg)
+        magnetometer.setHolderAxialRotationAngle(float(angleDeg))
+        referenceField[sweeps] = np.einsum('nji,sj->sni',magnetometer.getSensorRotationMatrices(),appliedField[sweeps])
+
+    calibration = SensorCalibration(geometry.sensorNames)
+    residuals = {}
+    for sensorPos,i in replay.recordedIndex.items():
+        samples = isInRun & ~np.isnan(replay.readings[:,i]).any(axis=1)
+        if samples.sum()<SensorCalibration.MIN_SAMPLE_COUNT:
+            error_message(f"Calibration of sensor {sensorPos}: {samples.sum()} samples in the run, left uncorrected")
+            continue
+        residuals[sensorPos] = calibration.fitSensor(sensorPos,replay.readings[samples,i],replay.temperatures[samples,i],
+                                                     referenceField[samples,geometry.sensorIndex[sensorPos]])
+    return calibration, residuals
+
+
+def selfTest():
+    """
+    fits synthetic sensors: a run spanning all axes recovers the model, a degenerate run
+    (a single field direction) leaves the sensor uncorrected
+    """
+    rng = np.random.default_rng(1)
+    calibration = SensorCalibration(['1','2'])
+    gain = np.eye(3)+rng.normal(0,0.03,(3,3))
+    offset = rng.normal(0,200,3)
+    field = rng.normal(0,8000,(20,3))
+    raw = field @ gain.T + offset
+    temperatures = np.full(len(field),30.0)
+    assert calibration.fitSensor('1',raw,temperatures,field)<1e-6
+    assert np.allclose(calibration.gains[0],np.linalg.inv(gain)) and np.allclose(calibration.offsets[0],offset)
+
+    field = np.outer(np.linspace(-1,1,20),[8000,0,0])
+    raw = field @ gain.T + offset
+    assert np.isnan(calibration.fitSensor('2',raw,temperatures,field))
+    assert (calibration.gains[1]==np.eye(3)).all() and (calibration.offsets[1]==0).all()
+    assert np.allclose(calibration.gains[0],np.linalg.inv(gain))     # the other sensor is kept
+    print("MRSM_Calibration self test passed")
+
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:]==['--test']:
+        selfTest()
+        sys.exit(0)
+    if len(sys.argv)<4:
+        print("usage: python MRSM_Calibration.py recording.mrsmrec run.json calibration.json [holder.json]\n"
+              "       python MRSM_Calibration.py --test")
+        sys.exit(1)
+    calibration, residuals = fitCalibrationFromRecording(sys.argv[1],sys.argv[2],sys.argv[4] if len(sys.argv)>4 else None)
+    for sensorPos,residual in residuals.items():
+        print(f"sensor {sensorPos}: " + ("not determined by the run, left uncorrected" if np.isnan(residual) else
+                                         f"RMS residual {residual:.1f} counts"))
+    calibration.save(sys.argv[3])
@@ -80,15 +80,27 @@ Controller of the Raspberry Pi hardware
 #
 #-------------------------------------------------------------------------------
 
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from enum import Enum
-from time import sleep, time, asctime
+from time import sleep, time, asctime, monotonic_ns
 from math import sin,cos,pi,radians
-from random import random, uniform, choice
 
+import numpy as np
 
-from MRSM_Globals import IsRaspberryPi5Emulated, IsMagneticSensorEmulated, __version__
+from MRSM_Globals import IsRaspberryPi5Emulated, IsMagneticSensorEmulated, IsI2CBusSimulated, __version__
 from MRSM_Utilities import error_message, debug_message
 from MRSM_DataExporter import JSONDataExporter
+from MRSM_Acquisition import AcquisitionWorker
+from MRSM_Calibration import SensorCalibration
+from MRSM_A31301 import A31301_Driver
+from MRSM_FieldEmulator import A31301_FieldEmulator
+from MRSM_Recording import SweepRecorder, SweepReplaySource
+from MRSM_FaultInjection import FaultInjector
+from MRSM_MappingSession import MappingSession
 from MRSM_Utilities import (
     TimerIterator,
 )
@@ -105,6 +117,8 @@ from gpiozero import (
 #IH241107  use "pip install smbus2" if not installed
 if not IsMagneticSensorEmulated:
     from smbus2 import SMBus
+elif IsI2CBusSimulated:
+    from MRSM_SimulatedSMBus import SimulatedSMBus
 
 if IsRaspberryPi5Emulated:
     from gpiozero.pins.mock import MockFactory
@@ -132,7 +146,8 @@ class BoreLEDGroup(Enum):
         
 class MRSM_Controller():
 
-    def __init__(self,exportDirectory='.') -> None:
+    def __init__(self,exportDirectory='.',recordFile=None,replayFile=None,replaySpeed=1.0,faultInjectionFile=None,
+                 holderConfigurationFile=None,calibrationFile=None,hasToConfigureSensors=False) -> None:
 
         # audio 
 
@@ -159,10 +174,20 @@ class MRSM_Controller():
         # Magnetometer
 
         self.exportDirectory = exportDirectory
-        self.magnetometer = MRSM_Magnetometer(self.exportDirectory)
+        self.magnetometer = MRSM_Magnetometer(self.exportDirectory,holderConfigurationFile=holderConfigurationFile,
+                                              calibrationFile=calibrationFile,
+                                              replayFile=replayFile,replaySpeed=replaySpeed,
+                                              faultInjectionFile=faultInjectionFile,
+                                              hasToConfigureSensors=hasToConfigureSensors)
+        if recordFile is not None:
+            self.magnetometer.startRecording(recordFile)
+        # the magnetometer is sampled in the background, the GUI only reads the latest frame
+        self.magnetometerAcquisition = AcquisitionWorker(self.magnetometer,MagnetometerFrame)
 
       
     def finalize(self):
+         self.magnetometerAcquisition.finalize()
+         self.magnetometer.stopRecording()
          self.audioPlayer.finalize()
          LEDShowStep(RaspberryPiGPIO.LEDShowStep_AllOff)
 
@@ -352,6 +377,176 @@ def LEDShowStep(d: dict):
             RaspberryPiGPIO.boreLEDGroup2.on() if d[BoreLEDGroup.GROUP2]>0.5 else RaspberryPiGPIO.boreLEDGroup2.off()
             RaspberryPiGPIO.boreLEDGroup3.on() if d[BoreLEDGroup.GROUP3]>0.5 else RaspberryPiGPIO.boreLEDGroup3.off()
  
+class MagnetometerFrame():
+    """
+    One sweep over all sensors of the magnetometer, acquired at once.
+
+    'data' is a (sensors x 4) array, the columns are the raw X, Y, Z readings 
+    (in the Sensor coordinate frame) and the temperature in degC.
+    The rows follow the order of 'sensorNames'.
+
+    The sensors are read one after another; 'sampleTimesNs' holds the time.monotonic_ns()
+    instant of the field reading of every sensor ('timestamp' is the wall-clock start of the sweep).
+
+    A replayed sweep carries the recorded 'holderPosition' (rotation angle, axial position),
+    the holder is set from it in the GUI thread; both are None for live readings.
+    """
+    X   =   0   # column indices in 'data'
+    Y   =   1
+    Z   =   2
+    T   =   3
+
+    def __init__(self,sensorNames,data,timestamp=None,sampleTimesNs=None,holderPosition=None) -> None:
+        self.sensorNames = tuple(sensorNames)
+        self.data = data
+        self.timestamp = time() if timestamp is None else timestamp
+        self.sampleTimesNs = np.full(len(self.sensorNames),monotonic_ns(),dtype=np.int64) if sampleTimesNs is None else sampleTimesNs
+        if holderPosition is None or np.isnan(holderPosition[0]):
+            self.holderRotationAngleDeg, self.holderAxialPositionMm = None, None
+        else:
+            self.holderRotationAngleDeg, self.holderAxialPositionMm = float(holderPosition[0]), float(holderPosition[1])
+
+    def __len__(self):
+        return len(self.sensorNames)
+
+    def rawReadings(self) -> np.ndarray:
+        """
+        (sensors x 3) view of the raw X,Y,Z readings
+        """
+        return self.data[:,MagnetometerFrame.X:MagnetometerFrame.Z+1]
+
+    def normalizedReadings(self) -> np.ndarray:
+        """
+        (sensors x 3) array of X,Y,Z readings from -1.00 to +1.00, 1 is the max range of the sensor
+        """
+        return self.rawReadings()/MRSM_Magnetometer.A31301_maxReadingRange
+
+    def temperatures(self) -> np.ndarray:
+        return self.data[:,MagnetometerFrame.T]
+
+    def availableMask(self) -> np.ndarray:
+        """
+        boolean per-sensor array, False for sensors which were missing in this sweep (NaN readings)
+        """
+        return ~np.isnan(self.rawReadings()).any(axis=1)
+
+    def asDict(self,values,hasToSkipMissing=False) -> dict:
+        """
+        'values' is a per-sensor 1D array (e.g. a column of this frame), 
+        returns {sensorName: value}, as used by the exporter and the FieldPlotCanvas;
+        missing sensors have NaN values, or are left out if 'hasToSkipMissing'
+        """
+        return {s: float(v) for s,v in zip(self.sensorNames,values) if not (hasToSkipMissing and np.isnan(v))}
+
+
+class SensorGeometry():
+    """
+    Geometry of the sensor holder, in contiguous arrays with one row per sensor.
+
+    The rows follow 'sensorNames' (stable, also the row order of MagnetometerFrame);
+    'sensorIndex' maps the names to the rows. 'Radius' and 'Angle' give the reference
+    point of the sensor in polar coordinates, 'Orientation' the sensor angle (see MRSM_Magnetometer).
+    The active point coordinates 'xy' (in millimeters, Scanner coordinate system) and the
+    rotation matrices follow the holder rotation; 'x', 'y' are views, updated in place.
+    Iterating the geometry gives the sensor names, as for the former dict of dicts.
+    """
+
+    def __init__(self,sensorNames,radiusMm,angleDeg,orientationDeg,chipOffsetMm) -> None:
+        self.sensorNames        = tuple(sensorNames)
+        self.sensorIndex        = {s: i for i,s in enumerate(self.sensorNames)}
+        self.radiusMm           = np.array(radiusMm,dtype=float)
+        self.angleDeg           = np.array(angleDeg,dtype=float)
+        self.orientationDeg     = np.array(orientationDeg,dtype=float)
+        self.chipOffsetMm       = chipOffsetMm
+        self.xy                 = np.zeros((len(self.sensorNames),2))
+        self.x                  = self.xy[:,0]
+        self.y                  = self.xy[:,1]
+        self.holderRotationAngleDeg = 0.0
+        self.rotationMatricesCache  = None
+        self.setHolderRotationAngle(0.0)
+
+    @staticmethod
+    def fromDict(geometry: dict,chipOffsetMm):
+        """
+        from {'sensorPositionName': {'Radius': .., 'Angle': .., 'Orientation': ..}, ...}
+        """
+        return SensorGeometry(geometry.keys(),
+                              [g['Radius'] for g in geometry.values()],
+                              [g['Angle'] for g in geometry.values()],
+                              [g['Orientation'] for g in geometry.values()],
+                              chipOffsetMm)
+
+    def __len__(self):
+        return len(self.sensorNames)
+
+    def __iter__(self):
+        return iter(self.sensorNames)
+
+    def __contains__(self,sensorPos):
+        return sensorPos in self.sensorIndex
+
+    def keys(self) -> tuple:
+        return self.sensorNames
+
+    def indices(self,sensorNames) -> np.ndarray:
+        return np.array([self.sensorIndex[s] for s in sensorNames],dtype=int)
+
+    def setHolderRotationAngle(self,rotationAngleDeg) -> None:
+        """
+        recalculates X,Y of THE SENSOR ACTIVE POINT in the Scanner coordinate system,
+        X (Horizontal) points to the right, Y (Vertical) points up, origin is in the center
+        """
+        self.holderRotationAngleDeg = rotationAngleDeg
+        angleRad        = np.radians(self.angleDeg+rotationAngleDeg)
+        orientationRad  = np.radians(self.orientationDeg+rotationAngleDeg)
+        self.x[:] = self.radiusMm*np.sin(angleRad) + self.chipOffsetMm*np.sin(orientationRad)
+        self.y[:] = self.radiusMm*np.cos(angleRad) + self.chipOffsetMm*np.cos(orientationRad)
+        self.rotationMatricesCache = None   # recalculated when needed
+
+    def rotationMatrices(self) -> np.ndarray:
+        """
+        (sensors x 3 x 3) rotation matrices from the Sensor to the Scanner coordinate frame,
+        including the holder rotation (the sensors turn with the holder, as their positions);
+        cached until the holder rotation changes
+        """
+        rotationMatrices = self.rotationMatricesCache
+        if rotationMatrices is not None:
+            return rotationMatrices
+
+        orientationRad = np.radians(self.orientationDeg+self.holderRotationAngleDeg)
+        cosOrientation = np.cos(orientationRad)
+        sinOrientation = np.sin(orientationRad)
+
+        # sensor mount geometry:
+        #   if pin 1 is pointing in the orientation of patient head (cranial direction):
+        #       X is in the AXIAL direction, showing to patient head (cranial direction)
+        #       Y in in the tangential direction
+        #       Z is in the radial direction, pointing out of the center
+        #   XYZ is  LEFTHANDED system (see A31301 datasheet)
+
+        #IH241113 CHECK these formulae:
+        #   HORIZONTAL = Y * cos(orientation) - Z * sin(orientation)
+        #   VERTICAL   = Z * cos(orientation) + Y * sin(orientation)
+        #   AXIAL      = X
+        rotationMatrices = np.zeros((len(orientationRad),3,3))
+        rotationMatrices[:,0,1] = cosOrientation
+        rotationMatrices[:,0,2] = -sinOrientation
+        rotationMatrices[:,1,1] = sinOrientation
+        rotationMatrices[:,1,2] = cosOrientation
+        rotationMatrices[:,2,0] = 1.0
+        self.rotationMatricesCache = rotationMatrices
+        return rotationMatrices
+
+    def asDict(self) -> dict:
+        """
+        {'sensorPositionName': {'Radius','Angle','Orientation','X','Y'}}, for the export file
+        """
+        return {s: {'Radius': float(self.radiusMm[i]), 'Angle': float(self.angleDeg[i]),
+                    'Orientation': float(self.orientationDeg[i]),
+                    'X': float(self.x[i]), 'Y': float(self.y[i])}
+                for s,i in self.sensorIndex.items()}
+
+
 class MRSM_Magnetometer():
 
     Geometry_Radius1_mm    =   22.50
@@ -361,16 +556,24 @@ class MRSM_Magnetometer():
     ChipOffset_mm          =   1.0  # distance from reference plane (containing reference point) to sensor active point
     A31301_maxReadingRange =   pow(2,15-1)-1  # the A31301 delivers signed 15bit values
 
+    # a missing sensor is probed again after PROBE_BACKOFF_INITIAL_SEC,
+    # the interval is doubled after each failed probe, up to PROBE_BACKOFF_MAX_SEC
+    PROBE_BACKOFF_INITIAL_SEC   =   0.5
+    PROBE_BACKOFF_MAX_SEC       =   30.0
 
+    # CIC filter bandwidth of the sensors until the sampling period is known (see setSensorBandwidthForPeriod)
+    A31301_DEFAULT_BANDWIDTH_SELECTION  =   0
 
-    def __init__(self,exportDirectory='.') -> None:
-        
-        self.holderRotationAngleDeg     = 0.0   # rotation angle is degrees, 0 is pointing up, clockwise in the cranial view
-        self.holderAxialPositionMm      = 0.0   # axial position in M, TODO specify 
-        self.exportDirectory            = exportDirectory
-        self.dataExporter = JSONDataExporter(self.exportDirectory)
+    # range of the holder axial position (the mapping sessions cover all of it)
+    HOLDER_AXIAL_RANGE_MM       =   (0.0, 150.0)
 
-        self.MgMGeometry = {
+
+    @staticmethod
+    def builtinSensorGeometry() -> SensorGeometry:
+        """
+        the geometry of the built-in 15-sensor holder
+        """
+        return SensorGeometry.fromDict({
              
                 #   for sensor geometry, see 
                 #       resources/images/diverse/ChipHolder Geometry.pdf
@@ -385,58 +588,64 @@ class MRSM_Magnetometer():
 
                 #   'Radius'    in millimeters
                 #   'Angle'     in degrees, 0 is pointing up, clockwise
-                #   'Angle'     in degrees, 0 is pointing up, clockwise
-                #   'X','Y'     are carthesian coordinates OF THE SENSOR ACTIVE POINT, will be computed, in millimeters,
+                #   the carthesian coordinates OF THE SENSOR ACTIVE POINT are computed by SensorGeometry, in millimeters
         
                 
                 '1':    {'Radius': MRSM_Magnetometer.Geometry_Radius1_mm, 
-                         'Angle': 0*60.0, 'Orientation': 0*60.0,
-                         'X':None, 'Y':None },
+                         'Angle': 0*60.0, 'Orientation': 0*60.0 },
                 '2':    {'Radius': MRSM_Magnetometer.Geometry_Radius1_mm, 
-                         'Angle': 1*60.0, 'Orientation': 1*60.0,
-                         'X':None, 'Y':None },
+                         'Angle': 1*60.0, 'Orientation': 1*60.0 },
                 '3':    {'Radius': MRSM_Magnetometer.Geometry_Radius1_mm, 
-                         'Angle': 2*60.0, 'Orientation': 2*60.0,
-                         'X':None, 'Y':None },
+                         'Angle': 2*60.0, 'Orientation': 2*60.0 },
                 '4':    {'Radius': MRSM_Magnetometer.Geometry_Radius1_mm, 
-                         'Angle': 3*60.0, 'Orientation': 3*60.0,
-                         'X':None, 'Y':None },
+                         'Angle': 3*60.0, 'Orientation': 3*60.0 },
                 '5':    {'Radius': MRSM_Magnetometer.Geometry_Radius1_mm, 
-                         'Angle': 4*60.0, 'Orientation': 4*60.0,
-                         'X':None, 'Y':None },
+                         'Angle': 4*60.0, 'Orientation': 4*60.0 },
                 '6':    {'Radius': MRSM_Magnetometer.Geometry_Radius1_mm, 
-                         'Angle': 5*60.0, 'Orientation': 5*60.0,
-                         'X':None, 'Y':None },
+                         'Angle': 5*60.0, 'Orientation': 5*60.0 },
                 '7':    {'Radius': MRSM_Magnetometer.Geometry_Radius2_mm, 
-                         'Angle': 0*60.0+30.0, 'Orientation': 0*60.0-60.0,
-                         'X':None, 'Y':None },
+                         'Angle': 0*60.0+30.0, 'Orientation': 0*60.0-60.0 },
                 '8':    {'Radius': MRSM_Magnetometer.Geometry_Radius2_mm, 
-                         'Angle': 1*60.0+30.0, 'Orientation': 1*60.0-60.0,
-                         'X':None, 'Y':None },
+                         'Angle': 1*60.0+30.0, 'Orientation': 1*60.0-60.0 },
                 '9':    {'Radius': MRSM_Magnetometer.Geometry_Radius2_mm, 
-                         'Angle': 2*60.0+30.0, 'Orientation': 2*60.0-60.0,
-                         'X':None, 'Y':None },
+                         'Angle': 2*60.0+30.0, 'Orientation': 2*60.0-60.0 },
                 'A':    {'Radius': MRSM_Magnetometer.Geometry_Radius2_mm, 
-                         'Angle': 3*60.0+30.0, 'Orientation': 3*60.0-60.0,
-                         'X':None, 'Y':None },
+                         'Angle': 3*60.0+30.0, 'Orientation': 3*60.0-60.0 },
                 'B':    {'Radius': MRSM_Magnetometer.Geometry_Radius2_mm, 
-                         'Angle': 4*60.0+30.0, 'Orientation': 4*60.0-60.0,
-                         'X':None, 'Y':None },
+                         'Angle': 4*60.0+30.0, 'Orientation': 4*60.0-60.0 },
                 'C':    {'Radius': MRSM_Magnetometer.Geometry_Radius2_mm, 
-                         'Angle': 5*60.0+30.0, 'Orientation': 5*60.0-60.0,
-                         'X':None, 'Y':None },
+                         'Angle': 5*60.0+30.0, 'Orientation': 5*60.0-60.0 },
 
                 'D':    {'Radius': MRSM_Magnetometer.Geometry_Radius3_mm, 
-                         'Angle': 0.0, 'Orientation': 0.0,
-                         'X':None, 'Y':None },
+                         'Angle': 0.0, 'Orientation': 0.0 },
                 'E':    {'Radius': MRSM_Magnetometer.Geometry_Radius3_mm, 
-                         'Angle': 180.0, 'Orientation': 180.0,
-                         'X':None, 'Y':None },
+                         'Angle': 180.0, 'Orientation': 180.0 },
 
                 'F':    {'Radius': 2.36, 
-                         'Angle': 0.0, 'Orientation': 0.0,
-                         'X':None, 'Y':None },
-        }
+                         'Angle': 0.0, 'Orientation': 0.0 },
+        },MRSM_Magnetometer.ChipOffset_mm)
+
+    @staticmethod
+    def loadSensorGeometry(holderConfigurationFile=None) -> SensorGeometry:
+        """
+        the geometry of the holder described in 'holderConfigurationFile' (see loadHolderConfiguration),
+        of the built-in holder if None; the buses are not touched
+        """
+        if holderConfigurationFile is None:
+            return MRSM_Magnetometer.builtinSensorGeometry()
+        with open(holderConfigurationFile,'r') as file:
+            return SensorGeometry.fromDict(json.load(file)['sensors'],MRSM_Magnetometer.ChipOffset_mm)
+
+    def __init__(self,exportDirectory='.',holderConfigurationFile=None,calibrationFile=None,
+                 replayFile=None,replaySpeed=1.0,faultInjectionFile=None,hasToConfigureSensors=False) -> None:
+        
+        self.holderRotationAngleDeg     = 0.0   # rotation angle is degrees, 0 is pointing up, clockwise in the cranial view
+        self.holderAxialPositionMm      = 0.0   # axial position in M, TODO specify 
+        self.exportDirectory            = exportDirectory
+        self.dataExporter = JSONDataExporter(self.exportDirectory)
+        self.mappingSession             = None  # MappingSession, while the positions of a bore map are stored
+
+        self.MgMGeometry = MRSM_Magnetometer.builtinSensorGeometry()
 
         self.MgMsensorI2CAddress = {
                 '1':    96,      # AD1 = 0.00 ,  AD0 =  0.00       * Vcc
@@ -469,12 +678,50 @@ class MRSM_Magnetometer():
              'Y_CHANNEL_15B_LSB' :  0x21,
              'Z_CHANNEL_15B_MSB' :  0x22,
              'Z_CHANNEL_15B_LSB' :  0x23,
+
+             # the whole output window TEMPERATURE..Z_CHANNEL, read in one block transaction
+             'OUTPUT_BLOCK_START' :  0x1c,
+             'OUTPUT_BLOCK_LENGTH':  8,
+             # the field channels only, X_CHANNEL..Z_CHANNEL
+             'FIELD_BLOCK_START' :   0x1e,
+             'FIELD_BLOCK_LENGTH':   6,
             }
 
+        # where the sensor is connected: I2C bus number and, for sensors behind a TCA9548A-style
+        # multiplexer, the multiplexer address and channel (None if connected directly)
+        self.MgMsensorBusLocation = {
+                s: {'Bus': 1, 'MuxAddress': None, 'MuxChannel': None} for s in self.MgMGeometry
+        }
+
+        if holderConfigurationFile is not None:
+            self.loadHolderConfiguration(holderConfigurationFile)
+        self.calculateSensorXY()     # before the emulator is used
+
+        # per-sensor gain/offset/temperature correction, applied to every sweep (identity if no file is given)
+        self.calibration = SensorCalibration(self.MgMGeometry.keys())
+        if calibrationFile is not None:
+            self.calibration.load(calibrationFile)
+
+        # the readings come from a recording (see MRSM_Recording), 'replaySpeed' None is as fast as possible
+        self.replaySource = SweepReplaySource(self,replayFile,replaySpeed) if replayFile is not None else None
+
+        # readings come either from the (real or simulated) I2C bus, or directly from the signal emulator (or the recording)
+        self.isReadingThroughEmulator = (IsMagneticSensorEmulated and not IsI2CBusSimulated) or self.replaySource is not None
+        self.setupBuses()
+
+        # availability is live state: sensors failing a read are dropped (negative caching),
+        # missing sensors are probed again with exponential backoff (see setSensorAvailability)
+        self.availabilityLock = threading.Lock()
+        self.probeBackoffSec = {s: MRSM_Magnetometer.PROBE_BACKOFF_INITIAL_SEC for s in self.MgMGeometry}
+        self.nextProbeTime = {s: 0.0 for s in self.MgMGeometry}
+
+        self.recorder = None    # see startRecording()
+
         self.availableSensors = set() 
-        if not IsMagneticSensorEmulated:
+        if self.replaySource is not None:
+            self.signalEmulator = self.replaySource     # 'replaySource' stays, also if wrapped by the fault injection
+        elif not IsMagneticSensorEmulated:
             self.signalEmulator = None
-            self.smbus = SMBus(1)   #using I2C bus 1
             self.availableSensors.add('4')  # IH241108 use actually available sensor positions
                                                     # IH241204 1 is 0x60, 4 is 0x63
 
@@ -482,17 +729,36 @@ class MRSM_Magnetometer():
             self.availableSensors = set(self.MgMGeometry.keys()) 
             # IH241210 for debugging only 
             self.availableSensors = set(['1','3','4','A','B','F'])      
-            self.signalEmulator = MRSM_Magnetometer.A31301_SimpleEmulator(self)
+            self.signalEmulator = A31301_FieldEmulator(self)
+            if IsI2CBusSimulated:
+                self.attachEmulatorToSimulatedBuses()
+
+        if faultInjectionFile is not None:
+            # delays, dropouts, stuck-at values and bus stalls (see MRSM_FaultInjection)
+            if self.signalEmulator is None:
+                error_message("Fault injection is only possible with emulated or replayed readings, ignored")
+            else:
+                self.signalEmulator = FaultInjector.fromFile(self.signalEmulator,faultInjectionFile)
         
         # IH241210 EXPERIMENTAL
         for s in self.MgMGeometry.keys():
             if self.CheckI2CDeviceAvailability(s):
                 self.availableSensors.add(s)
+            elif s not in self.availableSensors:
+                self.nextProbeTime[s] = time()+self.probeBackoffSec[s]
 
         # debug_message(self.availableSensors)
         assert(len(self.availableSensors)>0)
 
-        self.calculateSensorXY()
+        # configuration of the sensor chips (only if read through the real or simulated I2C bus, and only
+        #  on request: the register writes are not yet verified on the Raspberry Pi, see MRSM_A31301)
+        self.hasToConfigureSensors = hasToConfigureSensors
+        self.sensorBandwidthSelection = MRSM_Magnetometer.A31301_DEFAULT_BANDWIDTH_SELECTION
+        self.sensorDrivers = {}
+        for s in sorted(self.availableSensors):
+            self.configureSensor(s)
+
+        self.lastFrame = None
 
         # # calculate X,Y coordinates of THE SENSOR ACTIVE POINT in the Scanner coordinate system,
         # #  X (Horizontal) points to the right, Y (Vertical) points up, origin is in the center
@@ -516,20 +782,141 @@ class MRSM_Magnetometer():
                 sleep(1)
                 doAgain = False            
 
+    def loadHolderConfiguration(self,filename) -> None:
+        """
+        replaces the built-in 15-sensor holder by a holder described in a JSON file:
+
+            {"sensors": {
+                "sensorPositionName": {"Radius": .., "Angle": .., "Orientation": .., 
+                                       "Address": 96, "Bus": 1, "MuxAddress": 112, "MuxChannel": 0},
+                ...
+            }}
+
+        'Bus' defaults to 1, 'MuxAddress' and 'MuxChannel' may be omitted for sensors 
+        connected directly to the bus
+        """
+        with open(filename,'r') as file:
+            sensors = json.load(file)['sensors']
+        self.MgMGeometry            = SensorGeometry.fromDict(sensors,MRSM_Magnetometer.ChipOffset_mm)
+        self.MgMsensorI2CAddress    = {}
+        self.MgMsensorBusLocation   = {}
+        for sensorPos,sensor in sensors.items():
+            self.MgMsensorI2CAddress[sensorPos]  = sensor['Address']
+            self.MgMsensorBusLocation[sensorPos] = {'Bus': sensor.get('Bus',1),
+                                                    'MuxAddress': sensor.get('MuxAddress'),
+                                                    'MuxChannel': sensor.get('MuxChannel')}
+        debug_message(f"Loaded holder configuration {filename} ({len(self.MgMGeometry)} sensors)")
+
+    def setupBuses(self) -> None:
+        """
+        opens the I2C buses, creates the multiplexers and the sweep order;
+        on replay, no bus is opened and there are no multiplexers
+        """
+        busNumbers = sorted(set(location['Bus'] for location in self.MgMsensorBusLocation.values()))
+
+        self.smbuses  = {}
+        self.busLocks = {b: threading.Lock() for b in busNumbers}
+        if self.replaySource is not None:
+            pass    # the readings come from the recording
+        elif not IsMagneticSensorEmulated:
+            for b in busNumbers:
+                self.smbuses[b] = SMBus(b)
+        elif IsI2CBusSimulated:
+            for b in busNumbers:
+                self.smbuses[b] = SimulatedSMBus(b,seed=b)
+            for location in self.MgMsensorBusLocation.values():
+                if location['MuxAddress'] is not None:
+                    self.smbuses[location['Bus']].addMultiplexer(location['MuxAddress'])
+
+        self.multiplexers = {}  # (bus, muxAddress) -> multiplexer
+        for location in self.MgMsensorBusLocation.values():
+            key = (location['Bus'],location['MuxAddress'])
+            if location['MuxAddress'] is not None and key not in self.multiplexers and self.replaySource is None:
+                self.multiplexers[key] = MRSM_Magnetometer.TCA9548A_Multiplexer(
+                    self.smbuses.get(location['Bus']),location['MuxAddress'])
+
+        # in a sweep, the sensors of one bus are read grouped by the multiplexer channel,
+        # so that every channel is selected only once per sweep
+        def sweepOrderKey(sensorPos):
+            location = self.MgMsensorBusLocation[sensorPos]
+            return (-1 if location['MuxAddress'] is None else location['MuxAddress'],
+                    -1 if location['MuxChannel'] is None else location['MuxChannel'])
+        self.sweepOrderByBus = {
+            b: sorted([s for s in self.MgMGeometry if self.MgMsensorBusLocation[s]['Bus']==b],key=sweepOrderKey)
+            for b in busNumbers
+        }
+        # the buses are swept in parallel, one thread per bus
+        self.busExecutor = ThreadPoolExecutor(max_workers=len(busNumbers),thread_name_prefix="MRSM_I2CBus") if len(busNumbers)>1 else None
+
+    def attachEmulatorToSimulatedBuses(self) -> None:
+        """
+        every sensor present in the signal emulator becomes a device on the simulated bus, 
+        its output registers are refreshed from the emulator on every read
+        """
+        def refreshRegisters(device,sensorPos):
+            SimulatedSMBus.encodeA31301OutputRegisters(device.registers,*self.signalEmulator.getReadingFrame(sensorPos))
+
+        for sensorPos in self.signalEmulator.presentSensors | self.availableSensors:
+            location = self.MgMsensorBusLocation[sensorPos]
+            self.smbuses[location['Bus']].addDevice(self.MgMsensorI2CAddress[sensorPos],
+                registerSource=lambda device,sensorPos=sensorPos: refreshRegisters(device,sensorPos),
+                muxAddress=location['MuxAddress'],muxChannel=location['MuxChannel'])
+
+    def runOnEachBus(self,busFunction,*args) -> None:
+        """
+        calls busFunction(bus, sensorsInSweepOrder, *args) for every bus, in parallel if there are more buses
+        """
+        if self.busExecutor is None:
+            for b,sensors in self.sweepOrderByBus.items():
+                busFunction(b,sensors,*args)
+        else:
+            futures = [self.busExecutor.submit(busFunction,b,sensors,*args) for b,sensors in self.sweepOrderByBus.items()]
+            for f in futures:
+                f.result()
+
+    @contextmanager
+    def sensorBus(self,sensorPos):
+        """
+        selects the multiplexer channel of the sensor (if needed) and yields (smbus, I2C address);
+        the bus is locked for the duration of the transaction
+        """
+        location = self.MgMsensorBusLocation[sensorPos]
+        with self.busLocks[location['Bus']]:
+            for (b,muxAddress),mux in self.multiplexers.items():
+                if b==location['Bus'] and muxAddress!=location['MuxAddress']:
+                    mux.deselect()  # another multiplexer could expose a device with the same address
+            if location['MuxAddress'] is not None:
+                self.multiplexers[(location['Bus'],location['MuxAddress'])].select(location['MuxChannel'])
+            yield self.smbuses[location['Bus']], self.MgMsensorI2CAddress[sensorPos]
+
+    class TCA9548A_Multiplexer():
+        """
+        TCA9548A-style 1-to-8 I2C multiplexer, a channel is enabled by writing its bit to the control register.
+        The selected channel is cached, the multiplexer is only written when the channel changes.
+        """
+        def __init__(self,smbus,address) -> None:
+            self.smbus = smbus
+            self.address = address
+            self.selectedChannel = None
+            self.switchCount = 0    # for diagnostics
+
+        def select(self,channel) -> None:
+            if channel!=self.selectedChannel:
+                self.smbus.write_byte(self.address,1<<channel)
+                self.selectedChannel = channel
+                self.switchCount += 1
+
+        def deselect(self) -> None:
+            if self.selectedChannel is not None:
+                self.smbus.write_byte(self.address,0)
+                self.selectedChannel = None
+
     def calculateSensorXY(self):
         """
         calculate X,Y coordinates of THE SENSOR ACTIVE POINT in the Scanner coordinate system,
         X (Horizontal) points to the right, Y (Vertical) points up, origin is in the center
         """
-        for sensorPos in self.MgMGeometry:
-            self.MgMGeometry[sensorPos]['X'] = (
-                self.MgMGeometry[sensorPos]['Radius']*sin(radians(self.MgMGeometry[sensorPos]['Angle']+self.holderRotationAngleDeg))+
-                MRSM_Magnetometer.ChipOffset_mm*sin(radians(self.MgMGeometry[sensorPos]['Orientation']+self.holderRotationAngleDeg)))
-            self.MgMGeometry[sensorPos]['Y'] = (
-                self.MgMGeometry[sensorPos]['Radius']*cos(radians(self.MgMGeometry[sensorPos]['Angle']+self.holderRotationAngleDeg))+
-                MRSM_Magnetometer.ChipOffset_mm*cos(radians(self.MgMGeometry[sensorPos]['Orientation']+self.holderRotationAngleDeg)))
-        
-            # debug_message(f'{sensorPos}: X={self.MgMGeometry[sensorPos]["X"]}, Y={self.MgMGeometry[sensorPos]["Y"]})')
+        self.MgMGeometry.setHolderRotationAngle(self.holderRotationAngleDeg)
     
 
     class MgMAxis(Enum):
@@ -557,15 +944,35 @@ class MRSM_Magnetometer():
     
     def setHolderAxialPosition(self,axialPositionMm):
         """
-        currently, this has no effect on calculations, just logging in export file
+        axial position in millimeters, the z of the sweeps of a mapping session (and logged in the export files)
         """
         self.holderAxialPositionMm = axialPositionMm 
+
+    def startMappingSession(self) -> MappingSession:
+        """
+        starts a new mapping session, the following stored readings are added to it (see storeCurrentReadings)
+        """
+        self.mappingSession = MappingSession(float(np.hypot(self.MgMGeometry.x,self.MgMGeometry.y).max()),
+                                             MRSM_Magnetometer.HOLDER_AXIAL_RANGE_MM)
+        debug_message("Mapping session started")
+        return self.mappingSession
+
+    def stopMappingSession(self) -> None:
+        self.mappingSession = None
+        debug_message("Mapping session stopped")
     
     
-    def storeCurrentReadings(self):
+    def storeCurrentReadings(self,frame: MagnetometerFrame=None):
         """
         export data to a JSON file with (fixed file name, will be overwitten each time)
+        all readings are taken from the same sweep ('frame', acquired here if not given);
+        during a mapping session, the sweep is added to the session, which is exported instead
         """
+        if frame is None:
+            frame = self.acquireFrame()
+        if self.mappingSession is not None:
+            self.storeMappingSweep(frame)
+            return
         self.exportFilename="MRSM_readings.json"  #IH241118 for debugging only
         self.readingsDict = {
             "_comment":                 """
@@ -573,22 +980,125 @@ This is an MRSM export file.
 """,
             "MRSM_version":             __version__,
             "datestamp":                asctime(),
-            "sensorGeometry":           self.MgMGeometry,
+            "sensorGeometry":           self.MgMGeometry.asDict(),
             "holderAxialPositionMM":    self.holderAxialPositionMm,
             "holderRotationAngleDeg":   self.holderRotationAngleDeg,
+            "calibrationFile":          self.calibration.filename,
             "readings_comment":         """
 The magnetic field readings are given in the sensor's own coordinate system. 
 The values are relative to a maximum possible readout (sensor max range).
+They are corrected by the calibration given in 'calibrationFile' (if not null).
 The temperature readings are given in Celsius degrees.
+Sensors which were missing in the sweep are left out.
 """,
-            "readings_X":               self.getNormalizedReadingForAllSensors(MRSM_Magnetometer.MgMAxis.X),
-            "readings_Y":               self.getNormalizedReadingForAllSensors(MRSM_Magnetometer.MgMAxis.Y),
-            "readings_Z":               self.getNormalizedReadingForAllSensors(MRSM_Magnetometer.MgMAxis.Z),
-            "readings_Temperature":      self.getTemperatureReadingForAllSensors(),
+            "readings_X":               frame.asDict(frame.normalizedReadings()[:,MagnetometerFrame.X],hasToSkipMissing=True),
+            "readings_Y":               frame.asDict(frame.normalizedReadings()[:,MagnetometerFrame.Y],hasToSkipMissing=True),
+            "readings_Z":               frame.asDict(frame.normalizedReadings()[:,MagnetometerFrame.Z],hasToSkipMissing=True),
+            "readings_Temperature":     frame.asDict(frame.temperatures(),hasToSkipMissing=True),
         }
 
         self.dataExporter.export(self.readingsDict, self.exportFilename)
 
+    def storeMappingSweep(self,frame: MagnetometerFrame) -> None:
+        """
+        adds the sweep at the current holder position to the mapping session, and exports
+        the session (JSON, fixed file name) and its interpolated volume (.npz, next to it)
+        """
+        xy = self.MgMGeometry.xy
+        if frame.sensorNames!=self.MgMGeometry.sensorNames:
+            xy = xy[self.MgMGeometry.indices(frame.sensorNames)]
+        self.mappingSession.addSweep(self.holderAxialPositionMm,self.holderRotationAngleDeg,
+                                     xy,self.getFieldInScannerCoordinates(frame))
+        self.exportFilename="MRSM_mapping.json"
+        self.mappingDict = {
+            "_comment":                 """
+This is an MRSM mapping session export file.
+""",
+            "MRSM_version":             __version__,
+            "datestamp":                asctime(),
+            "calibrationFile":          self.calibration.filename,
+            "field_comment":            """
+The sensor positions x, y (in millimeters) and the field components are given in the Scanner coordinate system,
+the axial position is the z of the points. The values are relative to a maximum possible readout (sensor max range).
+Sensors which were missing in the sweep are left out. The interpolated volume is in the .npz file of the same name.
+""",
+            "mappingSession":           self.mappingSession.asDict(),
+        }
+        self.dataExporter.export(self.mappingDict, self.exportFilename)
+        volumeFilename = os.path.splitext(self.dataExporter.dirfilename)[0]+'.npz'
+        try:
+            self.mappingSession.saveVolume(volumeFilename)
+        except Exception:
+            error_message(f"{volumeFilename} not written")
+            raise JSONDataExporter.FileExportException("Could not write file",volumeFilename)
+
+    def setSensorAvailability(self,sensorPos,isAvailable: bool) -> None:
+        """
+        updates the live availability state of a sensor, 
+        a missing sensor is scheduled for the next probe with exponential backoff
+        """
+        with self.availabilityLock:
+            # a new set is assigned (not modified in place), other threads may be iterating the old one
+            if isAvailable:
+                self.probeBackoffSec[sensorPos] = MRSM_Magnetometer.PROBE_BACKOFF_INITIAL_SEC
+                if sensorPos not in self.availableSensors:
+                    self.availableSensors = self.availableSensors | {sensorPos}
+                    debug_message(f"Sensor {sensorPos} is now available")
+            else:
+                if sensorPos in self.availableSensors:
+                    self.availableSensors = self.availableSensors - {sensorPos}
+                    self.probeBackoffSec[sensorPos] = MRSM_Magnetometer.PROBE_BACKOFF_INITIAL_SEC
+                    debug_message(f"Sensor {sensorPos} is not available any more")
+                else:
+                    self.probeBackoffSec[sensorPos] = min(2*self.probeBackoffSec[sensorPos],MRSM_Magnetometer.PROBE_BACKOFF_MAX_SEC)
+                self.nextProbeTime[sensorPos] = time()+self.probeBackoffSec[sensorPos]
+
+    def sensorsDueForProbe(self,sensors,now=None) -> list:
+        """
+        the missing sensors (out of 'sensors') whose backoff interval has elapsed
+        """
+        now = time() if now is None else now
+        availableSensors = self.availableSensors
+        return [s for s in sensors if s not in availableSensors and self.nextProbeTime[s]<=now]
+
+    def probeSensor(self,sensorPos) -> bool:
+        isAvailable = self.CheckI2CDeviceAvailability(sensorPos)
+        self.setSensorAvailability(sensorPos,isAvailable)
+        if isAvailable:
+            # the sensor may have been (re)plugged, i.e. it has its power-on configuration
+            self.configureSensor(sensorPos)
+        return isAvailable
+
+    def configureSensor(self,sensorPos) -> None:
+        """
+        writes the startup configuration of the A31301 (see MRSM_A31301), if requested
+        """
+        if self.isReadingThroughEmulator or not self.hasToConfigureSensors:
+            return
+        driver = self.sensorDrivers.setdefault(sensorPos,A31301_Driver(self,sensorPos))
+        try:
+            driver.configure(self.sensorBandwidthSelection)
+        except Exception as e:
+            error_message(f"A31301 {sensorPos}: configuration failed: {e}")
+            self.setSensorAvailability(sensorPos,False)
+
+    def setSensorBandwidthForPeriod(self,samplingPeriodSec) -> None:
+        """
+        trades the on-chip averaging against the update rate: the sensors get the lowest-noise
+        filter bandwidth which still gives a new conversion every 'samplingPeriodSec'
+        """
+        if not self.hasToConfigureSensors:
+            return
+        self.sensorBandwidthSelection = A31301_Driver.bandwidthSelectionForPeriod(samplingPeriodSec)
+        for sensorPos,driver in self.sensorDrivers.items():
+            if sensorPos not in self.availableSensors:
+                continue    # will be configured when it comes back
+            try:
+                driver.setBandwidthSelection(self.sensorBandwidthSelection)
+            except Exception as e:
+                error_message(f"A31301 {sensorPos}: bandwidth setting failed: {e}")
+                self.setSensorAvailability(sensorPos,False)
+
     def CheckI2CDeviceAvailability(self,sensorPos) -> bool:
             """
             IH241210 TODO to be tested
@@ -597,72 +1107,208 @@ The temperature readings are given in Celsius degrees.
             https://forums.raspberrypi.com/viewtopic.php?t=114401
 
             """
-            if IsMagneticSensorEmulated:
-                return choice([True,False]) # IH241210 random choice
+            if self.isReadingThroughEmulator:
+                try:
+                    return self.signalEmulator.isSensorPresent(sensorPos)
+                except Exception as e:
+                    return False
             
             isAvailable=True
             try:
-                self.smbus.write_byte(self.MgMsensorI2CAddress[sensorPos],0) #IH241210 in forum, they claim this to be better than read_byte
+                with self.sensorBus(sensorPos) as (smbus, I2C_address):
+                    smbus.write_byte(I2C_address,0) #IH241210 in forum, they claim this to be better than read_byte
             except Exception as e:
                 debug_message(f'I2C Device Check: sensor {sensorPos} at {self.MgMsensorI2CAddress[sensorPos]}:{e} (probably sensor missing)')
                 isAvailable=False
             finally:
                 return isAvailable
 
+    @staticmethod
+    def convert_12bitSignedInt_to_int(msb,lsb):
+        """
+        IH241212 tested on RPI 
+        """
+        msb &= 0x0F     # the bits above the 12-bit value are not part of it (as in decodeTemperatureBlocks)
+        if msb>7:
+            b = bytearray(bytes([msb,lsb]))
+            b[0] = ~b[0] & 0x07
+            b[1] = ~b[1] & 0xFF
+            v = -b[0]*256 - b[1]-1
+        else:
+            v = msb*256 + lsb
+        return v
+
+    @staticmethod
+    def convert_15bitSignedInt_to_int(msb,lsb):
+        """
+        IH241212 Tested on RPI OK
+        """
+        msb &= 0x7F     # bit 15 is reserved (as in decodeRawFieldBlocks)
+        if msb>63:
+            b = bytearray(bytes([msb,lsb]))
+            b[0] = ~b[0] & 0x3F
+            b[1] = ~b[1] & 0xFF
+            v = -b[0]*256 - b[1]-1
+        else:
+            v = msb*256 + lsb
+        return v
+
     def getTemperatureReadingDegC(self,sensorPos) -> float:
           
-        def convert_12bitSignedInt_to_int(msb,lsb):
-            """
-            IH241212 tested on RPI 
-            """
-            if msb>7:
-                b = bytearray(bytes([msb,lsb]))
-                b[0] = ~b[0] & 0x07
-                b[1] = ~b[1] & 0xFF
-                v = -b[0]*256 - b[1]-1
-            else:
-                v = msb*256 + lsb
-            return v
-          
-        if IsMagneticSensorEmulated:
-            return self.signalEmulator.getTemperatureReadingDegC(sensorPos)
+        if self.isReadingThroughEmulator:
+            try:
+                return self.signalEmulator.getTemperatureReadingDegC(sensorPos)
+            except Exception as e:  # injected fault
+                self.setSensorAvailability(sensorPos,False)
+                return np.nan
         else:
-            I2C_address = self.MgMsensorI2CAddress[sensorPos]
             try:
-                Temperature_readout_MSB = self.smbus.read_byte_data(I2C_address,   self.MgMsensorI2CRegister['TEMPERATURE_12B_MSB'])    
-                Temperature_readout_LSB = self.smbus.read_byte_data(I2C_address,   self.MgMsensorI2CRegister['TEMPERATURE_12B_LSB']) 
+                # MSB and LSB in one transaction, so that they belong to the same conversion
+                with self.sensorBus(sensorPos) as (smbus, I2C_address):
+                    Temperature_readout_MSB, Temperature_readout_LSB = smbus.read_i2c_block_data(
+                        I2C_address, self.MgMsensorI2CRegister['TEMPERATURE_12B_MSB'], 2)
             except Exception as e:
-                return 0
+                self.setSensorAvailability(sensorPos,False)
+                return np.nan
             
             # debug_message(f'MSB_temp_readout> {Temperature_readout_MSB},LSB_temp_readout> {Temperature_readout_LSB}' )
 
-            # for formula, see A31303 Datasheet, p.13
-            Temperature_DegC = float(convert_12bitSignedInt_to_int(Temperature_readout_MSB, Temperature_readout_LSB))/8.052 + 25
-            
-            return Temperature_DegC
-               
+            return self.convertTemperatureReadout(Temperature_readout_MSB, Temperature_readout_LSB)
+
+    @staticmethod
+    def convertTemperatureReadout(msb,lsb) -> float:
+        # for formula, see A31303 Datasheet, p.13
+        return float(MRSM_Magnetometer.convert_12bitSignedInt_to_int(msb,lsb))/8.052 + 25
+
+    def getReadingFrame(self,sensorPos) -> tuple:
+        """
+        returns a coherent (temperatureDegC, X, Y, Z) frame of one sensor,
+        X, Y, Z are raw signed 15bit readings in the Sensor coordinate frame
+
+        The whole output register window 0x1C..0x23 is read in ONE block transaction
+        (A31301 I2C continuous readback mode, see datasheet p.19), 
+        so MSB and LSB of all channels come from the same conversion.
+        """
+        if self.isReadingThroughEmulator:
+            try:
+                return self.signalEmulator.getReadingFrame(sensorPos)
+            except Exception as e:  # injected fault
+                self.setSensorAvailability(sensorPos,False)
+                return (np.nan,np.nan,np.nan,np.nan)
+        
+        block = self.readOutputBlock(sensorPos)
+        if block is None: #IH241212 in case I2C is not responding
+            return (np.nan,np.nan,np.nan,np.nan)
         
+        return self.convertOutputBlock(block)
+
+    def getFieldReading(self,sensorPos) -> tuple:
+        """
+        returns raw (X, Y, Z) of one sensor, read by a single block transaction 0x1E..0x23
+        """
+        if self.isReadingThroughEmulator:
+            return self.getReadingFrame(sensorPos)[1:]
+
+        block = self.readFieldBlock(sensorPos)
+        if block is None:
+            return (np.nan,np.nan,np.nan)
+
+        return (
+            MRSM_Magnetometer.convert_15bitSignedInt_to_int(block[0],block[1]),
+            MRSM_Magnetometer.convert_15bitSignedInt_to_int(block[2],block[3]),
+            MRSM_Magnetometer.convert_15bitSignedInt_to_int(block[4],block[5]),
+        )
+
+    def readRegisterBlock(self,sensorPos,startRegisterName,lengthName) -> list:
+        """
+        raw bytes of one block transaction, None if the sensor does not respond (it is then marked as missing)
+        """
+        try:
+            with self.sensorBus(sensorPos) as (smbus, I2C_address):
+                return smbus.read_i2c_block_data(I2C_address,
+                            self.MgMsensorI2CRegister[startRegisterName],
+                            self.MgMsensorI2CRegister[lengthName])
+        except Exception as e:
+            self.setSensorAvailability(sensorPos,False)
+            return None
+
+    def readOutputBlock(self,sensorPos) -> list:
+        """
+        the 8 raw bytes of the output register window 0x1C..0x23 (see decodeOutputBlocks)
+        """
+        return self.readRegisterBlock(sensorPos,'OUTPUT_BLOCK_START','OUTPUT_BLOCK_LENGTH')
+
+    def readFieldBlock(self,sensorPos) -> list:
+        """
+        the 6 raw bytes of the field registers 0x1E..0x23 (see decodeRawFieldBlocks)
+        """
+        return self.readRegisterBlock(sensorPos,'FIELD_BLOCK_START','FIELD_BLOCK_LENGTH')
+
+    @staticmethod
+    def decodeRawFieldBlocks(blocks: np.ndarray) -> np.ndarray:
+        """
+        vectorized convert_15bitSignedInt_to_int for a whole sweep:
+        'blocks' is a (sensors x 6) uint8 array of the X,Y,Z registers (MSB first),
+        returns (sensors x 3) int array of raw readings
+        """
+        blocks = np.asarray(blocks,dtype=np.int32)
+        words = (blocks[:,0::2]<<8) | blocks[:,1::2]
+        return ((words & 0x7FFF) ^ 0x4000) - 0x4000     # sign extension of bit 14
+
+    @staticmethod
+    def decodeTemperatureBlocks(blocks: np.ndarray) -> np.ndarray:
+        """
+        vectorized convertTemperatureReadout for a whole sweep:
+        'blocks' is a (sensors x 2) uint8 array (MSB, LSB), returns (sensors,) array in degC
+        """
+        blocks = np.asarray(blocks,dtype=np.int32)
+        words = (blocks[:,0]<<8) | blocks[:,1]
+        # for formula, see A31303 Datasheet, p.13
+        return (((words & 0x0FFF) ^ 0x0800) - 0x0800)/8.052 + 25     # sign extension of bit 11
+
+    @staticmethod
+    def decodeOutputBlocks(blocks: np.ndarray) -> tuple:
+        """
+        vectorized convertOutputBlock for a whole sweep:
+        'blocks' is a (sensors x 8) uint8 array of the output register windows 0x1C..0x23,
+        returns ((sensors x 3) array of X,Y,Z readings from -1.00 to +1.00, (sensors,) array of temperatures in degC)
+        """
+        return (MRSM_Magnetometer.decodeRawFieldBlocks(blocks[:,2:8])/MRSM_Magnetometer.A31301_maxReadingRange,
+                MRSM_Magnetometer.decodeTemperatureBlocks(blocks[:,0:2]))
+
+    @staticmethod
+    def encodeOutputBlocks(data: np.ndarray) -> np.ndarray:
+        """
+        inverse of decodeRawFieldBlocks/decodeTemperatureBlocks: (sensors x 8) uint8 output register windows
+        of a (sensors x 4) sweep array of raw readings (see MagnetometerFrame); NaN is encoded as 0 / 25 degC
+        """
+        temperatureWords = np.round((np.nan_to_num(data[:,MagnetometerFrame.T],nan=25.0)-25)*8.052).astype(np.int32) & 0x0FFF
+        fieldWords = np.nan_to_num(data[:,MagnetometerFrame.X:MagnetometerFrame.Z+1]).astype(np.int32) & 0x7FFF
+        words = np.column_stack((temperatureWords,fieldWords))
+        blocks = np.empty((len(data),8),dtype=np.uint8)
+        blocks[:,0::2] = words>>8
+        blocks[:,1::2] = words & 0xFF
+        return blocks
+
+    @staticmethod
+    def convertOutputBlock(block) -> tuple:
+        """
+        converts the 8 bytes of the output register window 0x1C..0x23 to (temperatureDegC, X, Y, Z)
+        """
+        return (
+            MRSM_Magnetometer.convertTemperatureReadout(block[0],block[1]),
+            MRSM_Magnetometer.convert_15bitSignedInt_to_int(block[2],block[3]),
+            MRSM_Magnetometer.convert_15bitSignedInt_to_int(block[4],block[5]),
+            MRSM_Magnetometer.convert_15bitSignedInt_to_int(block[6],block[7]),
+        )
+               
     def getReading(self,sensorPos,axis: MgMAxis,stopTime:bool=False) -> int:
 
         # sleep(0.5) # IH241204 for debugging only, make a forced pause between subsequent readings
 
-
-        def convert_15bitSignedInt_to_int(msb,lsb):
-            """
-            IH241212 Tested on RPI OK
-            """
-            if msb>63:
-                b = bytearray(bytes([msb,lsb]))
-                b[0] = ~b[0] & 0x3F
-                b[1] = ~b[1] & 0xFF
-                v = -b[0]*256 - b[1]-1
-            else:
-                v = msb*256 + lsb
-            return v
-    
         # IH241203 the stopTime parameter is only relevant for simulation        
-        if IsMagneticSensorEmulated:
-            return self.signalEmulator.getReading(sensorPos,axis,stopTime)
+        if self.isReadingThroughEmulator:
+            return self.getReadingFrame(sensorPos)[axis.value]
         else:
             # see A31301 datasheet, p.28
             # Output registers to use:
@@ -673,64 +1319,11 @@ The temperature readings are given in Celsius degrees.
             #       This register holds the 15-bit signed output of the Y-axis sensor output.
             #   Z_CHANNEL_15B (0x22:0x23[14:0])
             #       This register holds the 15-bit signed output of the Z-axis sensor output
+            #
+            # NOTE if more than one axis is needed, use getReadingFrame() instead,
+            # it costs the same single block transaction
 
-
-            # IH241204 for experimenting
-            READOUT_METHOD_BYTE = True
-            READOUT_METHOD_WORD = False # IH241210 OBSOLETE
-
-            I2C_address = self.MgMsensorI2CAddress[sensorPos]
-
-            if READOUT_METHOD_BYTE:
-                try:
-                    MSB_X_readout = self.smbus.read_byte_data(I2C_address,   self.MgMsensorI2CRegister['X_CHANNEL_15B_MSB'])
-                    LSB_X_readout = self.smbus.read_byte_data(I2C_address,   self.MgMsensorI2CRegister['X_CHANNEL_15B_LSB'])
-                        
-                    MSB_Y_readout = self.smbus.read_byte_data(I2C_address,   self.MgMsensorI2CRegister['Y_CHANNEL_15B_MSB'])
-                    LSB_Y_readout = self.smbus.read_byte_data(I2C_address,   self.MgMsensorI2CRegister['Y_CHANNEL_15B_LSB'])
-                        
-                    MSB_Z_readout = self.smbus.read_byte_data(I2C_address,   self.MgMsensorI2CRegister['Z_CHANNEL_15B_MSB'])
-                    LSB_Z_readout = self.smbus.read_byte_data(I2C_address,   self.MgMsensorI2CRegister['Z_CHANNEL_15B_LSB'])
-                except Exception as e: #IH241212 in case I2C is not responding
-                    return 0
-
-                # debug_message(f'MSB_X_readout> {MSB_X_readout},LSB_X_readout> {LSB_X_readout}' )
-
-                value_X = convert_15bitSignedInt_to_int(MSB_X_readout,LSB_X_readout)
-                value_Y = convert_15bitSignedInt_to_int(MSB_Y_readout,LSB_Y_readout)
-                value_Z = convert_15bitSignedInt_to_int(MSB_Z_readout,LSB_Z_readout)
-                     
-                # value_X = ((MSB_X_readout & 0x7F) << 8) | (LSB_X_readout & 0xFF)
-                # value_Y = ((MSB_Y_readout & 0x7F) << 8) | (LSB_Y_readout & 0xFF)
-                # value_Z = ((MSB_Z_readout & 0x7F) << 8) | (LSB_Z_readout & 0xFF)
-
-                # # IH241205 PROBLEM still not correct conversion
-                
-                # if(value_X & 0x4000):
-                #         value_X -= 0x8000
-                # if(value_Y & 0x4000):
-                #         value_Y -= 0x8000
-                # if(value_Z & 0x4000):
-                #         value_Z -= 0x8000
-
-            # IH241210 OBSOLETE
-            if READOUT_METHOD_WORD:
-                
-                Word_X_readout = self.smbus.read_word_data(I2C_address,   self.MgMsensorI2CRegister['X_CHANNEL_15B_MSB'])    
-                Word_Y_readout = self.smbus.read_word_data(I2C_address,   self.MgMsensorI2CRegister['Y_CHANNEL_15B_MSB'])
-                Word_Z_readout = self.smbus.read_word_data(I2C_address,   self.MgMsensorI2CRegister['Z_CHANNEL_15B_MSB'])
-                # debug_message(f'Word_X_readout> {Word_X_readout}')
-
-                value_X = Word_X_readout & 0x7FFF
-                value_Y = Word_Y_readout & 0x7FFF
-                value_Z = Word_Z_readout & 0x7FFF
-
-                if (value_X & 0x4000):                    
-                    value_X -= 0x8000
-                if (value_Y & 0x8000):                                                   
-                    value_Y -= 0x8000
-                if (value_Z & 0x4000):                                        
-                    value_Z -= 0x8000
+            _, value_X, value_Y, value_Z = self.getReadingFrame(sensorPos)
 
             if axis==self.MgMAxis.X:
                 value = value_X
@@ -748,102 +1341,172 @@ The temperature readings are given in Celsius degrees.
          """
          return self.getReading(sensorPos,axis)/MRSM_Magnetometer.A31301_maxReadingRange
     
-    def getNormalizedReadingForAllSensors(self,axis:MgMAxis) -> dict:
-        retDict = {}
-        for sensorPos in self.MgMGeometry:
-            retDict[sensorPos] = self.getNormalizedReading(sensorPos,axis)
-            
-        return retDict
-    
-    def getTemperatureReadingForAllSensors(self) -> dict:
-        retDict = {}
-        for sensorPos in self.MgMGeometry:
-            retDict[sensorPos] = self.getTemperatureReadingDegC(sensorPos)
-            
-        return retDict
+    def readSweepInto(self,data: np.ndarray,sampleTimesNs: np.ndarray=None) -> None:
+        """
+        one sweep over all sensors into the (sensors x 4) array 'data' (see MagnetometerFrame),
+        each sensor is read by a single block transaction, the buses are swept in parallel;
+        missing sensors are not read, their rows are NaN.
+        The raw blocks of the whole sweep are decoded at once (see decodeOutputBlocks).
+        The instant of every sensor reading is stored in 'sampleTimesNs' (if given, see MagnetometerFrame).
+        """
+        sensorIndex = self.MgMGeometry.sensorIndex
+        availableSensors = self.availableSensors
+
+        if self.isReadingThroughEmulator:
+            # the emulator computes all sensors in one evaluation
+            data[:,:] = np.nan
+            sensors = [s for s in sensorIndex if s in availableSensors]
+            rows = [sensorIndex[s] for s in sensors]
+            if len(rows)>0:
+                data[rows,:] = self.signalEmulator.getSweep(sensors)
+            for s,i in zip(sensors,rows):
+                if np.isnan(data[i,MagnetometerFrame.X]):
+                    self.setSensorAvailability(s,False)     # did not respond
+            if sampleTimesNs is not None:
+                sampleTimesNs[:] = monotonic_ns()
+            self.applyCalibration(data)
+            return
+
+        blocks = np.zeros((len(sensorIndex),self.MgMsensorI2CRegister['OUTPUT_BLOCK_LENGTH']),dtype=np.uint8)
+        isRead = np.zeros(len(sensorIndex),dtype=bool)
+
+        def readBus(bus,sensors):
+            for sensorPos in sensors:
+                i = sensorIndex[sensorPos]
+                if sensorPos not in availableSensors:
+                    continue
+                readStartTimeNs = monotonic_ns()
+                block = self.readOutputBlock(sensorPos)
+                if block is not None:
+                    blocks[i] = block
+                    isRead[i] = True
+                if sampleTimesNs is not None:
+                    sampleTimesNs[i] = (readStartTimeNs+monotonic_ns())//2
+
+        data[:,:] = np.nan     # stays NaN for sensors which are missing (or fail)
+        self.runOnEachBus(readBus)
+
+        if isRead.any():
+            data[isRead,MagnetometerFrame.X:MagnetometerFrame.Z+1] = self.decodeRawFieldBlocks(blocks[isRead,2:8])
+            data[isRead,MagnetometerFrame.T] = self.decodeTemperatureBlocks(blocks[isRead,0:2])
+        self.applyCalibration(data)
+
+    def startRecording(self,filename) -> None:
+        """
+        the sweeps of the acquisition worker are recorded to 'filename' (see MRSM_Recording)
+        """
+        self.stopRecording()
+        self.recorder = SweepRecorder(filename,self.MgMGeometry.keys(),__version__)
+
+    def stopRecording(self) -> None:
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def recordSweep(self,data: np.ndarray,sampleTimesNs: np.ndarray,timestamp) -> None:
+        """
+        'data' is the (sensors x 4) sweep array before calibration
+        """
+        recorder = self.recorder
+        if recorder is None:
+            return
+        holderPosition = self.getReplayedHolderPosition() or (self.holderRotationAngleDeg,self.holderAxialPositionMm)
+        recorder.write(timestamp,self.encodeOutputBlocks(data),~np.isnan(data[:,MagnetometerFrame.X]),
+                       sampleTimesNs,*holderPosition)
+
+    def getReplayedHolderPosition(self) -> tuple:
+        """
+        (holder rotation angle, axial position) of the replayed sweep, None for live readings
+        """
+        return None if self.replaySource is None else self.replaySource.holderPosition()
+
+    def applyCalibration(self,data: np.ndarray) -> None:
+        """
+        corrects the X,Y,Z readings of a (sensors x 4) sweep array (see MagnetometerFrame) in place
+        """
+        data[:,MagnetometerFrame.X:MagnetometerFrame.Z+1] = self.calibration.apply(
+            data[:,MagnetometerFrame.X:MagnetometerFrame.Z+1],data[:,MagnetometerFrame.T])
+
+    def acquireFrame(self) -> MagnetometerFrame:
+        """
+        one sweep over all sensors (blocking, in the caller's thread)
+        """
+        sensorNames = list(self.MgMGeometry.keys())
+        data = np.empty((len(sensorNames),4))
+        sampleTimesNs = np.full(len(sensorNames),monotonic_ns(),dtype=np.int64)
+        sweepStartTime = time()
+        self.readSweepInto(data,sampleTimesNs)
+        self.lastFrame = MagnetometerFrame(sensorNames,data,sweepStartTime,sampleTimesNs,self.getReplayedHolderPosition())
+        return self.lastFrame
+
+    def getNormalizedReadingForAllSensors(self,axis:MgMAxis,frame: MagnetometerFrame=None) -> dict:
+        if frame is None:
+            frame = self.acquireFrame()
+        return frame.asDict(frame.normalizedReadings()[:,axis.value-1])
     
-    def getNormalizedReadingForAllSensorsInScannerCoordinates(self,orientation:MgMOrientation) -> dict:
-        retDict = {}
-        for sensorPos in self.MgMGeometry:
-            readingX = self.getNormalizedReading(sensorPos,MRSM_Magnetometer.MgMAxis.X)
-            readingY = self.getNormalizedReading(sensorPos,MRSM_Magnetometer.MgMAxis.Y)
-            readingZ = self.getNormalizedReading(sensorPos,MRSM_Magnetometer.MgMAxis.Z)
-
-            # sensor mount geometry:
-            #   if pin 1 is pointing in the orientation of patient head (cranial direction):
-            #       X is in the AXIAL direction, showing to patient head (cranial direction)
-            #       Y in in the tangential direction
-            #       Z is in the radial direction, pointing out of the center
-            #   XYZ is  LEFTHANDED system (see A31301 datasheet)
-
-            #IH241113 CHECK these formulae:
-            if orientation==MRSM_Magnetometer.MgMOrientation.AXIAL:
-                retDict[sensorPos] = readingX
-            if orientation==MRSM_Magnetometer.MgMOrientation.VERTICAL:
-                retDict[sensorPos] = (
-                        readingZ * cos(radians(self.MgMGeometry[sensorPos]['Orientation']))
-                      + readingY * sin(radians(self.MgMGeometry[sensorPos]['Orientation'])))
-            if orientation==MRSM_Magnetometer.MgMOrientation.HORIZONTAL:
-                retDict[sensorPos] = (
-                        readingY * cos(radians(self.MgMGeometry[sensorPos]['Orientation'])) 
-                      - readingZ * sin(radians(self.MgMGeometry[sensorPos]['Orientation'])))
-            
-        return retDict
+    def getTemperatureReadingForAllSensors(self,frame: MagnetometerFrame=None) -> dict:
+        if frame is None:
+            frame = self.acquireFrame()
+        return frame.asDict(frame.temperatures())
     
-    class A31301_SimpleEmulator():
+    def getSensorRotationMatrices(self) -> np.ndarray:
         """
-        Simple generator of time-dependent signal reading
+        (sensors x 3 x 3) rotation matrices from the Sensor to the Scanner coordinate frame,
+        rows follow MgMGeometry (see SensorGeometry.rotationMatrices)
         """
+        return self.MgMGeometry.rotationMatrices()
 
-        def __init__(self,magnetometer) -> None:
-            self.magnetometer = magnetometer                    
-            self.timeForSensor = {}
-            self.randomFactorForSensor = {}
-            for s in self.magnetometer.MgMGeometry.keys():
-                self.timeForSensor[s] = time()
-                self.randomFactorForSensor[s] = uniform(0.9,1.0) 
+    def getFieldInScannerCoordinates(self,frame: MagnetometerFrame) -> np.ndarray:
+        """
+        returns (sensors x 3) array of normalized readings, 
+        the columns are HORIZONTAL, VERTICAL, AXIAL (i.e. MgMOrientation.value-1);
+        all sensors and orientations by one batched matrix multiplication
+        """
+        rotationMatrices = self.getSensorRotationMatrices()
+        if frame.sensorNames!=self.MgMGeometry.sensorNames:
+            rotationMatrices = rotationMatrices[self.MgMGeometry.indices(frame.sensorNames)]
+        return np.matmul(rotationMatrices,frame.normalizedReadings()[:,:,None])[:,:,0]
 
-        def getTemperatureReadingDegC(self,sensorPos) -> float:        
-            return 25.0 + uniform(-0.5,+0.5) 
-         
-        def getReading(self,sensorPos,axis,stopTime:bool=False) -> int:
-            """
-            IH241203 the stopTime parameter is used to simulate readings comming immediately after each other,
-            so the return value should be the same
-            """
-            """
-            IH241203 BUG not working as expected
-            temporary workaround: only use stopTime=False
-            """
-            
-            if not stopTime:                
-                self.timeForSensor[sensorPos] = time()
-                self.randomFactorForSensor[sensorPos] = uniform(0.9,1.0)            
-
-            if axis==MRSM_Magnetometer.MgMAxis.X:           
-                peakValue = int(sin(self.timeForSensor[sensorPos]/pi/10)*MRSM_Magnetometer.A31301_maxReadingRange)         
-            if axis==MRSM_Magnetometer.MgMAxis.Z:                 
-                peakValue = int(MRSM_Magnetometer.A31301_maxReadingRange*0.7)
-            if axis==MRSM_Magnetometer.MgMAxis.Y:
-                peakValue = int(MRSM_Magnetometer.A31301_maxReadingRange*0.9)
-                             
-            spreadCoefficient = {
-                    # sensorPos -> value from 0 to 1
-                    "1" :  1.00,
-                    "C" :  0.80,                    
-                    "7" :  0.80,                    
-                    "6" :  0.30,                    
-                    "D" :  0.30,                    
-                    "2" :  0.30,
-
-                    "3" :  0.11, "4" :  0.12, "5" :  0.13, "8" :  0.14,
-                    "9" :  0.15, "A" :  0.16, "B" :  0.17, "E" :  0.18, "F" :  0.19,
-                    }
-            spreadFactor = 0.1
-            if sensorPos in spreadCoefficient:
-                spreadFactor = spreadCoefficient[sensorPos]                
-
-            returnValue = int(max(-MRSM_Magnetometer.A31301_maxReadingRange,min(MRSM_Magnetometer.A31301_maxReadingRange,
-                        peakValue*spreadFactor*self.randomFactorForSensor[sensorPos])))
-            return returnValue
-                    
\ No newline at end of file
+    def getNormalizedReadingForAllSensorsInScannerCoordinates(self,orientation:MgMOrientation,frame: MagnetometerFrame=None) -> dict:
+        if frame is None:
+            frame = self.acquireFrame()
+        return frame.asDict(self.getFieldInScannerCoordinates(frame)[:,orientation.value-1])
+
+    def getNormalizedReadingForAllOrientations(self,frame: MagnetometerFrame=None) -> dict:
+        """
+        {MgMOrientation: {sensorPos: normalized reading}}, all orientations from one transformation of the frame
+        """
+        if frame is None:
+            frame = self.acquireFrame()
+        field = self.getFieldInScannerCoordinates(frame)
+        return {orientation: frame.asDict(field[:,orientation.value-1]) for orientation in MRSM_Magnetometer.MgMOrientation}
+
+
+def selfTest():
+    """
+    pins the Scanner frame components of the sensor readings, also for a rotated holder
+    """
+    geometry = MRSM_Magnetometer.builtinSensorGeometry()
+    sensor = geometry.sensorIndex['1']      # at the top, 'Orientation' 0
+    X, Y, Z = np.eye(3)                     # unit readings along the Sensor axes
+    for holderRotationAngleDeg, expected in (
+            ( 0.0, {'X': (0,0,1), 'Y': ( 1,0,0), 'Z': (0, 1,0)}),
+            (90.0, {'X': (0,0,1), 'Y': ( 0,1,0), 'Z': (-1,0,0)}),
+            (180.0,{'X': (0,0,1), 'Y': (-1,0,0), 'Z': (0,-1,0)})):
+        geometry.setHolderRotationAngle(holderRotationAngleDeg)
+        rotationMatrix = geometry.rotationMatrices()[sensor]
+        for axis,reading in zip('XYZ',(X,Y,Z)):
+            assert np.allclose(rotationMatrix@reading,expected[axis]), (holderRotationAngleDeg,axis,rotationMatrix@reading)
+
+    # a rotated holder turns every sensor like its 'Orientation' does
+    geometry.setHolderRotationAngle(30.0)
+    rotated = geometry.rotationMatrices()
+    geometry.orientationDeg += 30.0
+    geometry.setHolderRotationAngle(0.0)
+    assert np.allclose(rotated,geometry.rotationMatrices())
+    print("MRSM_Controller self test passed")
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:]==['--test']:
+        selfTest()
@@ -166,6 +166,11 @@ class MSRM_Demo_QApplication(QApplication):
             "Use complex magnetic field visualization (takes longer to load)",
             # defaut is not to use this
         )
+        lightweightRenderer_option = QCommandLineOption(
+            "r",
+            "Use the lightweight field visualization, without matplotlib (implies -f)",
+            # defaut is not to use this
+        )
         exportDirectory_option = QCommandLineOption(
             "d",
             "Directory to be used for exported data files",
@@ -182,11 +187,54 @@ class MSRM_Demo_QApplication(QApplication):
             "Use seasonal (Xmas) features",
             # defaut is not to use this
         )
+        recordFile_option = QCommandLineOption(
+            "R",
+            "Record the magnetometer sweeps to the specified file",
+            "recordFile",
+        )
+        replayFile_option = QCommandLineOption(
+            "p",
+            "Replay the magnetometer sweeps from the specified recording (instead of the sensors)",
+            "replayFile",
+        )
+        replaySpeed_option = QCommandLineOption(
+            "n",
+            "Replay speed factor, 0 is as fast as possible",
+            "replaySpeed",
+            "1.0"
+        )
+        faultInjectionFile_option = QCommandLineOption(
+            "F",
+            "Inject bus faults into the emulated readings, as configured in the specified JSON file",
+            "faultInjectionFile",
+        )
+        holderConfigurationFile_option = QCommandLineOption(
+            "g",
+            "Use the sensor holder (geometry, buses, multiplexers) configured in the specified JSON file",
+            "holderConfigurationFile",
+        )
+        calibrationFile_option = QCommandLineOption(
+            "c",
+            "Correct the magnetometer readings by the calibration in the specified JSON file (see MRSM_Calibration)",
+            "calibrationFile",
+        )
+        configureSensors_option = QCommandLineOption(
+            "a",
+            "Configure the A31301 sensors (filter bandwidth, operating mode), not yet verified on the Raspberry Pi",
+        )
         parser.addOption(language_option)
         parser.addOption(magFieldVisualization_option)
+        parser.addOption(lightweightRenderer_option)
         parser.addOption(exportDirectory_option)
         parser.addOption(startService_option)
         parser.addOption(seasonalEdition_option)
+        parser.addOption(recordFile_option)
+        parser.addOption(replayFile_option)
+        parser.addOption(replaySpeed_option)
+        parser.addOption(faultInjectionFile_option)
+        parser.addOption(holderConfigurationFile_option)
+        parser.addOption(calibrationFile_option)
+        parser.addOption(configureSensors_option)
                 
         parser.process(self)
 
@@ -195,27 +243,82 @@ class MSRM_Demo_QApplication(QApplication):
             error_message(f'Invalid language: {parser.value(language_option)}. Using EN instead.')
             self.app_language = Language.ENGLISH
 
-        self.hasToUseMagFieldVisualization = parser.isSet(magFieldVisualization_option)
+        self.hasToUseLightweightRenderer = parser.isSet(lightweightRenderer_option)
+        self.hasToUseMagFieldVisualization = parser.isSet(magFieldVisualization_option) or self.hasToUseLightweightRenderer
         self.exportDirectory = parser.value(exportDirectory_option)
         self.hasToUseSeasonalFeatures = parser.isSet(seasonalEdition_option)
         self.hasToStartWithService = parser.isSet(startService_option)
+        self.recordFile = parser.value(recordFile_option) if parser.isSet(recordFile_option) else None
+        self.replayFile = parser.value(replayFile_option) if parser.isSet(replayFile_option) else None
+        try:
+            self.replaySpeed = float(parser.value(replaySpeed_option))
+        except ValueError:
+            error_message(f'Invalid replay speed: {parser.value(replaySpeed_option)}. Using 1.0 instead.')
+            self.replaySpeed = 1.0
+        if self.replaySpeed<=0:
+            self.replaySpeed = None     # as fast as possible
+        self.faultInjectionFile = parser.value(faultInjectionFile_option) if parser.isSet(faultInjectionFile_option) else None
+        self.holderConfigurationFile = parser.value(holderConfigurationFile_option) if parser.isSet(holderConfigurationFile_option) else None
+        self.calibrationFile = parser.value(calibrationFile_option) if parser.isSet(calibrationFile_option) else None
+        self.hasToConfigureSensors = parser.isSet(configureSensors_option)
         pass
         
 
+def startFieldMapWorker(argv):
+    """
+    forks the field map worker of the magnetometer panel before the QApplication, the audio and the
+    acquisition threads exist (see MRSM_FieldWorker); None if the field maps are not shown, or the worker
+    is not available (the panel creates it then).
+    The options are parsed leniently, as the Qt options are still in 'argv' (parseCommandLine checks all of them)
+    """
+    parser = QCommandLineParser()
+    parser.setSingleDashWordOptionMode(QCommandLineParser.SingleDashWordOptionMode.ParseAsLongOptions)  # e.g. -platform
+    magFieldVisualization_option = QCommandLineOption("f")      # as in parseCommandLine
+    lightweightRenderer_option = QCommandLineOption("r")
+    holderConfigurationFile_option = QCommandLineOption("g","","holderConfigurationFile")
+    parser.addOptions([magFieldVisualization_option,lightweightRenderer_option,holderConfigurationFile_option])
+    parser.parse(argv)
+    if not (parser.isSet(magFieldVisualization_option) or parser.isSet(lightweightRenderer_option)):
+        return None
+
+    from MRSM_Controller import MRSM_Magnetometer
+    from MRSM_FieldInterpolation import FIELD_MAP_LEVELS
+    from MRSM_FieldWorker import FieldMapWorker
+    try:
+        fieldMapWorker = FieldMapWorker(MRSM_Magnetometer.loadSensorGeometry(parser.value(holderConfigurationFile_option) or None),
+                                        FIELD_MAP_LEVELS)
+        fieldMapWorker.start()
+    except Exception as e:
+        debug_message(f'Field map worker not started beforehand ({e})')
+        return None
+    return fieldMapWorker
+
 def finalizeApp():
+    MRSM_presentation.finalize()
     MRSM_controller.finalize()
 
 #-------------------------------------------------------------------------------
+# the worker process is forked first, while this is the only thread
+MRSM_fieldMapWorker = startFieldMapWorker(sys.argv)
 MRSM_application = MSRM_Demo_QApplication(sys.argv)
 MRSM_application.parseCommandLine()
 MRSM_application.aboutToQuit.connect(finalizeApp)
-MRSM_controller = MRSM_Controller(exportDirectory=MRSM_application.exportDirectory)
+MRSM_controller = MRSM_Controller(exportDirectory=MRSM_application.exportDirectory,
+        recordFile=MRSM_application.recordFile,
+        replayFile=MRSM_application.replayFile,
+        replaySpeed=MRSM_application.replaySpeed,
+        faultInjectionFile=MRSM_application.faultInjectionFile,
+        holderConfigurationFile=MRSM_application.holderConfigurationFile,
+        calibrationFile=MRSM_application.calibrationFile,
+        hasToConfigureSensors=MRSM_application.hasToConfigureSensors)
 MRSM_presentation = MRSM_Presentation(
         language=MRSM_application.app_language,
         hardwareController=MRSM_controller,
         hasToUseMagFieldVisualization=MRSM_application.hasToUseMagFieldVisualization,
         hasToUseSeasonalFeatures=MRSM_application.hasToUseSeasonalFeatures,
         hasToStartWithService=MRSM_application.hasToStartWithService,
+        hasToUseLightweightRenderer=MRSM_application.hasToUseLightweightRenderer,
+        fieldMapWorker=MRSM_fieldMapWorker,
         )
 MRSM_presentation.show()
 MRSM_application.exec()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+
+#-------------------------------------------------------------------------------
+#
+#      The Magnetic Resonance Scanner Mockup Project
+#
+#
+#      M  R  S  M  _  F a u l t  I n j e c t i o n  .  p  y
+#
+#
+#      Last update: 261018
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+#  N O T E S :
+#
+#   Fault injection for the emulated magnetometer (A31301_FieldEmulator or a
+#   replayed recording), to see how the acquisition and the panels behave
+#   when the bus is slow, flaky or saturated. The FaultInjector wraps the
+#   signal source and has the same interface. Every sensor reading is one
+#   (emulated) transaction, which can be
+#
+#       - delayed:  'transactionDelaySec' plus a uniform random jitter
+#                   up to 'transactionDelayJitterSec'
+#       - dropped:  with probability 'dropoutRate', raised as OSError 121,
+#                   like a NACK on the real bus
+#       - stuck:    with probability 'stuckAtRate' the sensor starts repeating
+#                   its current reading for 'stuckAtDurationSec';
+#                   'stuckAtValues' {sensorPos: [T, X, Y, Z]} are stuck for good
+#       - stalled:  with probability 'stallRate' the whole bus stalls
+#                   for 'stallDurationSec'
+#
+#   The configuration can be given as a JSON file with these keys
+#   (MRSM_Demo option -F).
+#
+#-------------------------------------------------------------------------------
+
+import errno
+import json
+import threading
+from time import sleep, time
+
+import numpy as np
+
+from MRSM_Utilities import debug_message, error_message
+
+
+class FaultInjector():
+    """
+    Wraps a signal source (see A31301_FieldEmulator) and injects bus faults
+    """
+
+    DEFAULT_CONFIG = {
+        'transactionDelaySec':          0.0,
+        'transactionDelayJitterSec':    0.0,
+        'dropoutRate':                  0.0,
+        'stuckAtRate':                  0.0,
+        'stuckAtDurationSec':           1.0,
+        'stuckAtValues':                {},
+        'stallRate':                    0.0,
+        'stallDurationSec':             0.5,
+        'seed':                         1,
+    }
+
+    def __init__(self,source,**config) -> None:
+        unknownKeys = set(config)-set(FaultInjector.DEFAULT_CONFIG)
+        if unknownKeys:
+            error_message(f"Fault injection: unknown settings {sorted(unknownKeys)} ignored")
+        self.source = source
+        self.config = {k: config.get(k,v) for k,v in FaultInjector.DEFAULT_CONFIG.items()}
+        self.random = np.random.default_rng(self.config['seed'])
+        self.lock   = threading.Lock()      # the buses may be served in parallel
+        self.stuckReadings = {s: tuple(v) for s,v in self.config['stuckAtValues'].items()}   # sensorPos -> (T,X,Y,Z)
+        self.stuckUntil    = {s: float('inf') for s in self.stuckReadings}
+
+        # statistics
+        self.transactionCount   = 0
+        self.dropoutCount       = 0
+        self.stallCount         = 0
+        debug_message(f"Fault injection: {self.config}")
+
+    @staticmethod
+    def fromFile(source,filename):
+        with open(filename,'r') as file:
+            return FaultInjector(source,**json.load(file))
+
+    @property
+    def presentSensors(self) -> set:
+        return self.source.presentSensors
+
+    def transaction(self,sensorPos) -> None:
+        """
+        the faults of one transaction: delay, bus stall, dropout
+        """
+        with self.lock:
+            self.transactionCount += 1
+            delaySec = self.config['transactionDelaySec'] + self.random.uniform(0.0,self.config['transactionDelayJitterSec'])
+            isStalled = self.random.random()<self.config['stallRate']
+            isDropped = self.random.random()<self.config['dropoutRate']
+            if isStalled:
+                self.stallCount += 1
+                delaySec += self.config['stallDurationSec']
+            if isDropped:
+                self.dropoutCount += 1
+        if delaySec>0:
+            sleep(delaySec)
+        if isDropped:
+            raise OSError(errno.EREMOTEIO,f"Remote I/O error (injected, sensor {sensorPos})")
+
+    def stuckReading(self,sensorPos,readingFrame) -> tuple:
+        """
+        returns the stuck (T,X,Y,Z) reading of the sensor, or 'readingFrame' if it is not stuck
+        """
+        with self.lock:
+            now = time()
+            if self.stuckUntil.get(sensorPos,0.0)>now:
+                return self.stuckReadings[sensorPos]
+            if self.random.random()<self.config['stuckAtRate']:
+                self.stuckReadings[sensorPos] = tuple(readingFrame)
+                self.stuckUntil[sensorPos] = now+self.config['stuckAtDurationSec']
+        return readingFrame
+
+    def stuckFrame(self,sensorPos):
+        """
+        returns the stuck (T,X,Y,Z) reading of the sensor, or None if it is not stuck
+        """
+        with self.lock:
+            if self.stuckUntil.get(sensorPos,0.0)>time():
+                return self.stuckReadings[sensorPos]
+        return None
+
+    # ---- signal source interface -----------------------------------------
+
+    def isSensorPresent(self,sensorPos) -> bool:
+        try:
+            self.transaction(sensorPos)
+        except OSError:
+            return False
+        return self.source.isSensorPresent(sensorPos)
+
+    def getReadingFrame(self,sensorPos) -> tuple:
+        self.transaction(sensorPos)
+        return self.stuckReading(sensorPos,self.source.getReadingFrame(sensorPos))
+
+    def getSweep(self,sensorNames,t=None) -> np.ndarray:
+        """
+        the sensors are read one after another, so every sensor has its own faults;
+        dropped sensors have NaN rows
+        """
+        sweep = self.source.getSweep(sensorNames,t)
+        for row,sensorPos in enumerate(sensorNames):
+            try:
+                self.transaction(sensorPos)
+            except OSError:
+                sweep[row,:] = np.nan
+                continue
+            readingX, readingY, readingZ, temperature = sweep[row]
+            temperature, readingX, readingY, readingZ = self.stuckReading(sensorPos,(temperature,readingX,readingY,readingZ))
+            sweep[row,:] = (readingX, readingY, readingZ, temperature)
+        return sweep
+
+    def getTemperatureReadingDegC(self,sensorPos) -> float:
+        # through the source's own method: a replayed temperature read does not advance the replay
+        self.transaction(sensorPos)
+        stuckFrame = self.stuckFrame(sensorPos)
+        return self.source.getTemperatureReadingDegC(sensorPos) if stuckFrame is None else stuckFrame[0]
+
+    def getReading(self,sensorPos,axis,stopTime:bool=False):
+        self.transaction(sensorPos)
+        stuckFrame = self.stuckFrame(sensorPos)
+        return self.source.getReading(sensorPos,axis,stopTime) if stuckFrame is None else stuckFrame[axis.value]
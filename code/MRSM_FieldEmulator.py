@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+
+#-------------------------------------------------------------------------------
+#
+#      The Magnetic Resonance Scanner Mockup Project
+#
+#
+#      M  R  S  M  _  F i e l d  E m u l a t o r  .  p  y
+#
+#
+#      Last update: 261018
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+#  N O T E S :
+#
+#   Emulation of the A31301 readings from a parametric magnet model.
+#   The field B is computed at the active point of every sensor, for all
+#   sensors in one NumPy evaluation, as the superposition of
+#
+#       - a finite solenoid along the scanner axis (the main magnet),
+#         by the paraxial expansion of its on-axis field
+#       - magnetic dipoles (e.g. a permanent magnet near the bore),
+#         optionally modulated in time, so that the maps change
+#       - a uniform field and a constant gradient
+#       - Gaussian noise (A31301 datasheet, Table 5 order of magnitude)
+#
+#   Scanner coordinates: HORIZONTAL points to the right, VERTICAL points up,
+#   AXIAL points to the patient head; origin in the center of the bore; in mm.
+#   Field in Gauss, converted to counts by the sensitivity of the 600 G
+#   device (26.8 LSB/G, A31301 datasheet p.9).
+#
+#   The sensor positions follow MgMGeometry (whose 'x','y' already include the
+#   holder rotation, see SensorGeometry.setHolderRotationAngle) and the holder
+#   axial position, the orientations are rotated with the holder; so the
+#   emulated maps react to setHolderAxialRotationAngle / setHolderAxialPosition.
+#   The field is transformed to the Sensor coordinate frame by the inverse
+#   (transpose) of MRSM_Magnetometer.getSensorRotationMatrices.
+#
+#   All random numbers come from one seeded generator (deterministic runs).
+#
+#-------------------------------------------------------------------------------
+
+from time import time
+
+import numpy as np
+
+
+class A31301_FieldEmulator():
+    """
+    Vectorized physics-based emulator of the magnetometer sensor readings
+    """
+
+    SENSITIVITY_LSB_PER_GAUSS = 26.8
+    SEED = 1
+
+    # default magnet model
+    SOLENOID = {'CentralFieldG': 250.0, 'RadiusMm': 80.0, 'LengthMm': 300.0}
+    DIPOLES = [
+        # 'PositionMm' in scanner coordinates (H,V,A), 'MomentGmm3' in G.mm^3,
+        # the moment is modulated by cos(2*pi*t/ModulationPeriodSec) (no modulation if None)
+        {'PositionMm': (0.0, 45.0, 0.0), 'MomentGmm3': (0.0, -1.5e6, 0.0), 'ModulationPeriodSec': 60.0},
+    ]
+    UNIFORM_FIELD_G = (0.0, 0.0, 0.0)
+    GRADIENT_G_PER_MM = ((1.0, 0.0, 0.0),    # dB/dH, dB/dV, dB/dA per row (H,V,A components)
+                         (0.0, 0.0, 0.0),
+                         (0.0, 0.0, 0.0))
+    NOISE_G = 0.1
+    TEMPERATURE_DEGC = 25.0
+    TEMPERATURE_NOISE_DEGC = 0.5
+
+    def __init__(self,magnetometer,seed=SEED,
+                 solenoid=SOLENOID,dipoles=DIPOLES,
+                 uniformFieldG=UNIFORM_FIELD_G,gradientGPerMm=GRADIENT_G_PER_MM,
+                 noiseG=NOISE_G) -> None:
+        self.magnetometer   = magnetometer
+        self.random         = np.random.default_rng(seed)
+        self.solenoid       = dict(solenoid)
+        self.dipoles        = [dict(d) for d in dipoles]
+        self.uniformFieldG  = np.array(uniformFieldG,dtype=float)
+        self.gradientGPerMm = np.array(gradientGPerMm,dtype=float)
+        self.noiseG         = noiseG
+        self.startTime      = time()
+
+        # the emulated holder is populated randomly, but the population does not change
+        # while running, so that repeated availability probes give the same answer
+        self.presentSensors = set(s for s in self.magnetometer.MgMGeometry.keys() if self.random.random()<0.5)
+
+    def isSensorPresent(self,sensorPos) -> bool:
+        return sensorPos in self.presentSensors
+
+    # ---- magnet model ----------------------------------------------------
+
+    def solenoidOnAxisField(self,axialMm) -> tuple:
+        """
+        on-axis field of the finite solenoid and its first two derivatives along the axis
+        """
+        a = self.solenoid['RadiusMm']
+        halfLength = self.solenoid['LengthMm']/2
+        # scaled so that the field in the center is CentralFieldG
+        scale = self.solenoid['CentralFieldG']/(halfLength/np.hypot(halfLength,a))
+
+        def f(u):       # B = scale/2 * (f(z+L/2) - f(z-L/2))
+            return u/np.hypot(u,a)
+        def df(u):
+            return a**2/np.hypot(u,a)**3
+        def d2f(u):
+            return -3*a**2*u/np.hypot(u,a)**5
+
+        zp, zm = axialMm+halfLength, axialMm-halfLength
+        return (scale/2*(f(zp)-f(zm)), scale/2*(df(zp)-df(zm)), scale/2*(d2f(zp)-d2f(zm)))
+
+    def fieldAt(self,positionsMm: np.ndarray,t=None) -> np.ndarray:
+        """
+        B [G] in scanner coordinates (H,V,A) at the (points x 3) positions
+        """
+        t = time()-self.startTime if t is None else t
+        h, v, z = positionsMm.T
+
+        # solenoid, paraxial expansion: Bz = B0(z) - r^2/4 B0''(z), Br = -r/2 B0'(z)
+        b0, db0, d2b0 = self.solenoidOnAxisField(z)
+        field = np.column_stack((-h/2*db0, -v/2*db0, b0-(h**2+v**2)/4*d2b0))
+
+        for dipole in self.dipoles:
+            moment = np.array(dipole['MomentGmm3'],dtype=float)
+            if dipole.get('ModulationPeriodSec') is not None:
+                moment = moment*np.cos(2*np.pi*t/dipole['ModulationPeriodSec'])
+            r = positionsMm-np.array(dipole['PositionMm'],dtype=float)
+            distance = np.linalg.norm(r,axis=1)
+            distance = np.maximum(distance,1.0)     # the sensor is never inside the magnet
+            unit = r/distance[:,None]
+            field += (3*(unit @ moment)[:,None]*unit - moment)/distance[:,None]**3
+
+        field += self.uniformFieldG + positionsMm @ self.gradientGPerMm.T
+        return field
+
+    # ---- sensors ---------------------------------------------------------
+
+    def sensorPositions(self,sensorNames) -> np.ndarray:
+        """
+        (sensors x 3) positions in scanner coordinates [mm], for the current holder rotation and axial position
+        """
+        geometry = self.magnetometer.MgMGeometry
+        rows = geometry.indices(sensorNames)
+        return np.column_stack((geometry.x[rows],geometry.y[rows],np.full(len(rows),self.magnetometer.holderAxialPositionMm)))
+
+    def getSweep(self,sensorNames,t=None) -> np.ndarray:
+        """
+        (sensors x 4) array of raw X, Y, Z readings (Sensor coordinate frame) and temperatures in degC,
+        as in MagnetometerFrame
+        """
+        positions = self.sensorPositions(sensorNames)
+        field = self.fieldAt(positions,t)
+        field += self.random.normal(0.0,self.noiseG,field.shape)
+
+        # the rotation matrices are orthogonal, the inverse is the transpose
+        rotationMatrices = self.magnetometer.getSensorRotationMatrices()[self.magnetometer.MgMGeometry.indices(sensorNames)]
+        readings = np.einsum('nji,nj->ni',rotationMatrices,field)*A31301_FieldEmulator.SENSITIVITY_LSB_PER_GAUSS
+        maxReading = self.magnetometer.A31301_maxReadingRange
+        readings = np.clip(np.round(readings),-maxReading-1,maxReading)    # the sensor saturates
+
+        temperatures = A31301_FieldEmulator.TEMPERATURE_DEGC + self.random.uniform(
+            -A31301_FieldEmulator.TEMPERATURE_NOISE_DEGC,A31301_FieldEmulator.TEMPERATURE_NOISE_DEGC,len(readings))
+        return np.column_stack((readings,temperatures))
+
+    def getReadingFrame(self,sensorPos) -> tuple:
+        """
+        (temperatureDegC, X, Y, Z) of one sensor, all three axes taken at the same time instant
+        """
+        readingX, readingY, readingZ, temperature = self.getSweep((sensorPos,))[0]
+        return (float(temperature), int(readingX), int(readingY), int(readingZ))
+
+    def getTemperatureReadingDegC(self,sensorPos) -> float:
+        return self.getReadingFrame(sensorPos)[0]
+
+    def getReading(self,sensorPos,axis,stopTime:bool=False) -> int:
+        """
+        'axis' is MRSM_Magnetometer.MgMAxis, 'stopTime' is kept for compatibility (readings are instantaneous)
+        """
+        return self.getReadingFrame(sensorPos)[axis.value]
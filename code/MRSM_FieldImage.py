@@ -0,0 +1,448 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+
+#-------------------------------------------------------------------------------
+#
+#      The Magnetic Resonance Scanner Mockup Project
+#
+#
+#      M  R  S  M  _  F i e l d  I m a g e  .  p  y
+#
+#
+#      Last update: 261018
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+#  N O T E S :
+#
+#   Lightweight field-map renderer, an alternative to FieldPlotCanvas
+#   (MRSM_FieldVisualizer) which does not need matplotlib (MRSM_Demo option -r).
+#   The FieldImageCanvas has the same interface and shows the same picture:
+#
+#       - the interpolated grid (see MRSM_FieldInterpolation) is mapped to
+#         the 22 color bands of the 21 levels (as contourf(..., extend='both')
+#         with the PiYG colormap) through a precomputed ARGB lookup table,
+#         and to the pixels through a precomputed pixel -> grid cell index,
+#         all with NumPy, into a buffer which is shown as a QImage (no copy)
+#       - the isolines (MRSM_FieldInterpolation.fieldIsolines), their labels,
+#         the bore circle, the sensor markers and names are painted by QPainter
+#
+#   The FieldColorbar (used with both renderers) paints the same bands once,
+#   into a cached pixmap, the levels are fixed.
+#
+#   The view follows the matplotlib canvas: equal aspect, the bore circle
+#   plus 10% fills the canvas height, clipped by 10% on each side.
+#
+#   The display modes (FieldView) and their switching by a click are those
+#   of FieldPlotCanvas; the vectors are painted as arrows by QPainter.
+#
+#   The VolumeSliceCanvas shows a slice of the volume of a mapping session
+#   (MRSM_MappingSession) in the same color bands, one pixel per grid point
+#   scaled by QPainter; a click switches the axis of the slice.
+#
+#-------------------------------------------------------------------------------
+
+import time
+
+import numpy as np
+
+from PyQt6.QtCore import Qt, QPointF, QLineF, QRectF
+from PyQt6.QtGui import QImage, QPixmap, QPainter, QColor, QPen, QBrush, QFont
+from PyQt6.QtWidgets import QWidget, QSizePolicy
+
+from MRSM_Utilities import debug_message, error_message
+from MRSM_FieldInterpolation import FieldInterpolator, FieldView, FIELD_MAP_LEVELS
+from MRSM_MappingSession import SliceAxis
+
+
+# PiYG (ColorBrewer, as in matplotlib), from -1 (magenta) to +1 (green)
+PIYG_COLORS = ['#8e0152','#c51b7d','#de77ae','#f1b6da','#fde0ef','#f7f7f7',
+               '#e6f5d0','#b8e186','#7fbc41','#4d9221','#276419']
+
+def colormapLUT(colors,bandCount) -> np.ndarray:
+    """
+    ARGB32 (uint32) colors of 'bandCount' bands, sampled evenly from the linear colormap 'colors'
+    (as BoundaryNorm does for the bands of a contourf)
+    """
+    rgb = np.array([[int(c[i:i+2],16) for i in (1,3,5)] for c in colors],dtype=float)
+    t = np.linspace(0.0,1.0,bandCount)*(len(colors)-1)
+    band = np.column_stack([np.interp(t,np.arange(len(colors)),rgb[:,k]) for k in range(3)]).round().astype(np.uint32)
+    return (0xFF000000 | (band[:,0]<<16) | (band[:,1]<<8) | band[:,2]).astype(np.uint32)
+
+
+class FieldImageCanvas(QWidget):
+    """
+    Field map of one orientation, painted into a QImage (same interface as FieldPlotCanvas)
+    """
+
+    gridSizeX = 100
+    gridSizeY = 100
+
+    BORE_RADIUS_MM          = 30.0
+    VIEW_HALF_HEIGHT_MM     = 27.5      # 1.1 x bore radius, clipped by 10% (see NOTES)
+    FIGURE_COLOR            = QColor('blue')
+    BORE_COLOR              = QColor(0x1f,0x77,0xb4,128)
+    MARKER_RADIUS_PX        = 2.5
+
+    def __init__(self,sensorGeometry,figureWidth,figureHeight,dpi=100,parent=None,
+                 title='',
+                 hasToIncludeColorbar=True,
+                 fieldInterpolator=None,
+                 fieldView=None):
+        """
+        'figureWidth', 'figureHeight', 'dpi' and 'hasToIncludeColorbar' are kept for compatibility
+        with FieldPlotCanvas, the canvas takes the size given by the layout (the colorbar is a FieldColorbar)
+        """
+        super().__init__(parent)
+        self.setSizePolicy(QSizePolicy.Policy.Expanding,QSizePolicy.Policy.Expanding)
+        self.setAttribute(Qt.WidgetAttribute.WA_OpaquePaintEvent)
+
+        self.sensorGeometry = sensorGeometry    # MRSM_Controller.SensorGeometry
+        self.fieldInterpolator = (FieldInterpolator(sensorGeometry,FieldImageCanvas.gridSizeX,FieldImageCanvas.gridSizeY)
+                                  if fieldInterpolator is None else fieldInterpolator)
+        self.title = title
+        self.fieldView = fieldView      # FieldView shown (None: set by the caller of UpdatePlot)
+        self.hasToShowIsolineLabels = True  # (lowered detail, see FieldMapDetail)
+        self.paintDurationSec = 0.0         # of the latest paintEvent, a part of the cost of the refresh
+        self.levels = FIELD_MAP_LEVELS
+        self.bandColors = colormapLUT(PIYG_COLORS,len(self.levels)+1)     # below the first level, ..., above the last one
+        self.levelTexts = [f'{level:.1f}'.replace('-','−') for level in self.levels]
+
+        self.imageBuffer    = None  # (height x width) uint32 ARGB32, shown by self.image
+        self.image          = None
+        self.pixelCellIndex = None  # per pixel: the grid cell shown, -1 outside the grid
+        self.pixelMapKey    = None  # (width, height, grid extent) of pixelCellIndex
+        self.isolines       = []    # QLineF, in pixels
+        self.isolineLabels  = []    # (QPointF, level index)
+        self.vectorLines    = []    # QLineF of the arrows, in pixels
+        self.isValueAvailable_Array = np.zeros(len(sensorGeometry),dtype=bool)
+
+        self.updateScatteredPointPositions()
+
+    def updateScatteredPointPositions(self):
+        # the grid follows the holder rotation, see FieldInterpolator.regularGrid
+        self.UpdatePlot({k: 0 for k in self.sensorGeometry.sensorNames}) #use zero initial values
+
+    # ---- view ------------------------------------------------------------
+
+    def scale(self) -> float:
+        """
+        pixels per millimeter
+        """
+        return max(1,self.height())/(2*FieldImageCanvas.VIEW_HALF_HEIGHT_MM)
+
+    def toPixels(self,x,y) -> tuple:
+        s = self.scale()
+        return self.width()/2+x*s, self.height()/2-y*s
+
+    def updatePixelMap(self,extent) -> None:
+        """
+        the grid cell of every pixel (nearest, as imshow), recalculated on resize, on holder rotation
+        and on a new grid size
+        """
+        width, height = max(1,self.width()), max(1,self.height())
+        key = (width,height,extent,self.gridSizeX,self.gridSizeY)
+        if key==self.pixelMapKey:
+            return
+        s = self.scale()
+        x = (np.arange(width)+0.5-width/2)/s
+        y = (height/2-(np.arange(height)+0.5))/s
+        x0, x1, y0, y1 = extent
+        columns = np.floor((x-x0)/(x1-x0)*self.gridSizeX).astype(int)
+        rows = np.floor((y-y0)/(y1-y0)*self.gridSizeY).astype(int)
+        isInside = (rows[:,None]>=0) & (rows[:,None]<self.gridSizeY) & (columns[None,:]>=0) & (columns[None,:]<self.gridSizeX)
+        self.pixelCellIndex = np.where(isInside,rows[:,None]*self.gridSizeX+columns[None,:],-1)
+        self.imageBuffer = np.empty((height,width),dtype=np.uint32)
+        self.image = QImage(self.imageBuffer.data,width,height,width*4,QImage.Format.Format_ARGB32)
+        self.pixelMapKey = key
+
+    # ---- update ----------------------------------------------------------
+
+    def UpdatePlot(self,valuesDict):
+        values = np.array([float(valuesDict[p]) for p in valuesDict])
+        self.showFieldMap(self.fieldInterpolator.fieldMap(values,self.levels))
+
+    def showFieldMap(self,fieldMap):
+        """
+        shows a FieldMap (MRSM_FieldInterpolation), computed by UpdatePlot or by the FieldMapWorker
+        """
+        if fieldMap.fieldView is not None and fieldMap.fieldView!=self.fieldView:
+            return      # computed for the former view
+        self.isValueAvailable_Array = ~np.isnan(fieldMap.values)
+        gridValues = fieldMap.gridValues
+        self.gridSizeY, self.gridSizeX = gridValues.shape
+        self.updatePixelMap(fieldMap.extent)
+
+        # color bands, NaN (outside the convex hull of the sensors) shows the figure color
+        cellColors = self.bandColors[np.searchsorted(self.levels,gridValues.ravel(),side='right')]
+        cellColors[np.isnan(gridValues.ravel())] = FieldImageCanvas.FIGURE_COLOR.rgba()
+        self.imageBuffer[:] = np.where(self.pixelCellIndex>=0,cellColors[self.pixelCellIndex],FieldImageCanvas.FIGURE_COLOR.rgba())
+        self.updateIsolines(fieldMap.isolines)
+        self.updateVectors(fieldMap.vectors)
+        self.update()
+
+    def updateIsolines(self,isolines) -> None:
+        """
+        isoline segments in pixels, and one label per level, spread apart
+        """
+        s = self.scale()
+        centerX, centerY = self.width()/2, self.height()/2
+        self.isolines = []
+        self.isolineLabels = []
+        labelPositions = np.zeros((0,2))
+        for levelIndex,segments in isolines:
+            pixels = np.stack((centerX+segments[:,:,0]*s,centerY-segments[:,:,1]*s),axis=2)
+            self.isolines += [QLineF(*p) for p in pixels.reshape(-1,4).tolist()]
+            if not self.hasToShowIsolineLabels:
+                continue
+            midpoints = pixels.mean(axis=1)
+            if len(labelPositions)>0:
+                distance = np.min(np.hypot(midpoints[:,None,0]-labelPositions[None,:,0],midpoints[:,None,1]-labelPositions[None,:,1]),axis=1)
+                position = midpoints[np.argmax(distance)]
+            else:
+                position = midpoints[len(midpoints)//2]
+            labelPositions = np.vstack((labelPositions,position))
+            self.isolineLabels.append((QPointF(*position),levelIndex))
+
+    def updateVectors(self,vectors) -> None:
+        """
+        the arrows (shaft and head) of the vectors in pixels, 1 (relative units) is 4 mm as in FieldPlotCanvas
+        """
+        self.vectorLines = []
+        if vectors is None:
+            return
+        x, y, u, v = (a.ravel() for a in vectors)
+        isValid = ~np.isnan(u+v)
+        startX, startY = self.toPixels(x[isValid],y[isValid])
+        endX, endY = self.toPixels(x[isValid]+u[isValid]*4.0,y[isValid]+v[isValid]*4.0)
+        shaftX, shaftY = endX-startX, endY-startY
+        # the head: two strokes of 1/3 of the shaft, at +-25 degrees
+        cos, sin = np.cos(np.radians(25)), np.sin(np.radians(25))
+        headX1, headY1 = endX-(shaftX*cos-shaftY*sin)/3, endY-(shaftX*sin+shaftY*cos)/3
+        headX2, headY2 = endX-(shaftX*cos+shaftY*sin)/3, endY-(-shaftX*sin+shaftY*cos)/3
+        lines = np.concatenate((np.column_stack((startX,startY,endX,endY)),
+                                np.column_stack((endX,endY,headX1,headY1)),
+                                np.column_stack((endX,endY,headX2,headY2))))
+        self.vectorLines = [QLineF(*line) for line in lines.tolist()]
+
+    def setFieldView(self,fieldView):
+        """
+        the canvas shows 'fieldView' from the next FieldMap on
+        """
+        self.fieldView = fieldView
+        self.title = fieldView.name.replace('_',' ')
+        self.update()
+
+    def mousePressEvent(self,event):
+        if self.fieldView is not None:
+            views = list(FieldView)
+            self.setFieldView(views[(views.index(self.fieldView)+1)%len(views)])
+        super().mousePressEvent(event)
+
+    # ---- painting --------------------------------------------------------
+
+    def paintEvent(self,event):
+        startTime = time.perf_counter()
+        painter = QPainter(self)
+        painter.fillRect(self.rect(),FieldImageCanvas.FIGURE_COLOR)
+        if self.image is not None and self.pixelMapKey[0:2]==(self.width(),self.height()):
+            painter.drawImage(0,0,self.image)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+
+        # isolines and their labels
+        painter.setPen(QPen(QColor('black'),0.7))
+        painter.drawLines(self.isolines)
+        font = QFont(painter.font())
+        font.setPointSizeF(8)
+        painter.setFont(font)
+        for position,levelIndex in self.isolineLabels:
+            painter.drawText(QRectF(position.x()-20,position.y()-8,40,16),Qt.AlignmentFlag.AlignCenter,self.levelTexts[levelIndex])
+
+        # vectors
+        painter.setPen(QPen(QColor('black'),1.0))
+        painter.drawLines(self.vectorLines)
+
+        # bore circle
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(QBrush(FieldImageCanvas.BORE_COLOR))
+        radius = FieldImageCanvas.BORE_RADIUS_MM*self.scale()
+        painter.drawEllipse(QPointF(*self.toPixels(0,0)),radius,radius)
+
+        # measuring points
+        for i,(x,y) in enumerate(zip(self.sensorGeometry.x,self.sensorGeometry.y)):
+            painter.setBrush(QBrush(QColor('red' if self.isValueAvailable_Array[i] else 'gray')))
+            painter.drawEllipse(QPointF(*self.toPixels(x,y)),FieldImageCanvas.MARKER_RADIUS_PX,FieldImageCanvas.MARKER_RADIUS_PX)
+        painter.setPen(QColor('red'))
+        for pntName,x,y in zip(self.sensorGeometry.sensorNames,self.sensorGeometry.x,self.sensorGeometry.y):
+            painter.drawText(QPointF(*self.toPixels(x+0.5,y-0.5)),pntName)
+
+        # title
+        painter.setPen(QColor('white'))
+        font.setPointSizeF(10*0.579)     # 'x-small'
+        painter.setFont(font)
+        titleX, titleY = self.toPixels(0,-25.5)
+        painter.drawText(QRectF(titleX-100,titleY-20,200,20),Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignBottom,self.title)
+        painter.end()
+        self.paintDurationSec = time.perf_counter()-startTime
+
+
+class FieldColorbar(QWidget):
+    """
+    Colorbar of the field maps: the color bands of the levels, rendered once into a cached pixmap
+    (on resize and on setLevels), for both FieldPlotCanvas and FieldImageCanvas
+    """
+
+    FIGURE_COLOR    = FieldImageCanvas.FIGURE_COLOR
+    BAR_WIDTH_PX    = 10
+    TICK_LENGTH_PX  = 3
+
+    def __init__(self,levels,colors=PIYG_COLORS,parent=None):
+        super().__init__(parent)
+        self.setSizePolicy(QSizePolicy.Policy.Expanding,QSizePolicy.Policy.Expanding)
+        self.setAttribute(Qt.WidgetAttribute.WA_OpaquePaintEvent)
+        self.pixmap = None
+        self.renderCount = 0
+        self.setLevels(levels,colors)
+
+    def setLevels(self,levels,colors=PIYG_COLORS) -> None:
+        self.levels = np.asarray(levels,dtype=float)
+        self.bandColors = colormapLUT(colors,len(self.levels)+1)    # below the first level, ..., above the last one
+        self.pixmap = None
+        self.update()
+
+    def resizeEvent(self,event):
+        self.pixmap = None
+        super().resizeEvent(event)
+
+    def renderPixmap(self) -> QPixmap:
+        """
+        the color bands, the under/over bands as triangles (extend='both'), ticks at every 5th level
+        """
+        pixmap = QPixmap(max(1,self.width()),max(1,self.height()))
+        pixmap.fill(FieldColorbar.FIGURE_COLOR)
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        barWidth = min(FieldColorbar.BAR_WIDTH_PX,self.width()-2)
+        left = (self.width()-barWidth)/2
+        top, bottom = 0.1*self.height(), 0.9*self.height()
+        bandCount = len(self.bandColors)
+        bandHeight = (bottom-top)/bandCount
+        painter.setPen(Qt.PenStyle.NoPen)
+        for band in range(bandCount):
+            painter.setBrush(QColor.fromRgba(int(self.bandColors[band])))
+            y = bottom-(band+1)*bandHeight
+            if band==0:
+                painter.drawPolygon([QPointF(left,y),QPointF(left+barWidth,y),QPointF(left+barWidth/2,bottom)])
+            elif band==bandCount-1:
+                painter.drawPolygon([QPointF(left,y+bandHeight),QPointF(left+barWidth,y+bandHeight),QPointF(left+barWidth/2,top)])
+            else:
+                # (a little higher, so that the antialiased edges of the neighbours overlap)
+                painter.drawRect(QRectF(left,y,barWidth,bandHeight+0.5))
+        painter.setPen(QPen(QColor('black'),0.7))
+        for levelIndex in range(0,len(self.levels),5):
+            y = bottom-(levelIndex+1)*bandHeight
+            painter.drawLine(QLineF(left-FieldColorbar.TICK_LENGTH_PX,y,left,y))
+        painter.end()
+        self.renderCount += 1
+        return pixmap
+
+    def paintEvent(self,event):
+        if self.pixmap is None:
+            self.pixmap = self.renderPixmap()
+        painter = QPainter(self)
+        painter.drawPixmap(0,0,self.pixmap)
+        painter.end()
+
+
+class VolumeSliceCanvas(QWidget):
+    """
+    Slice of the volume of a MappingSession (MRSM_MappingSession), painted into a QImage;
+    a click switches to the slice along the next axis
+    """
+
+    FIGURE_COLOR    = FieldImageCanvas.FIGURE_COLOR
+    TEXT_HEIGHT_PX  = 16
+
+    def __init__(self,levels=None,fieldView=FieldView.MAGNITUDE,colors=PIYG_COLORS,parent=None):
+        """
+        'levels' as those of the field maps by default
+        """
+        super().__init__(parent)
+        self.setAttribute(Qt.WidgetAttribute.WA_OpaquePaintEvent)
+        self.levels = np.linspace(-1.0,1.0,21) if levels is None else np.asarray(levels,dtype=float)
+        self.bandColors = colormapLUT(colors,len(self.levels)+1)     # below the first level, ..., above the last one
+        self.fieldView = fieldView
+        self.sliceAxis = SliceAxis.Z
+        self.mappingSession = None
+        self.axialPositionMm = 0.0  # of the Z slice (the X and Y slices contain the bore axis)
+        self.imageBuffer = None     # (rows x columns) uint32 ARGB32 of the slice, shown by self.image
+        self.image = None
+        self.sliceText = ''
+
+    def setMappingSession(self,mappingSession) -> None:
+        self.mappingSession = mappingSession
+        self.updateSlice()
+
+    def setAxialPosition(self,axialPositionMm) -> None:
+        self.axialPositionMm = axialPositionMm
+        if self.sliceAxis==SliceAxis.Z:
+            self.updateSlice()
+
+    def setSliceAxis(self,sliceAxis: SliceAxis) -> None:
+        self.sliceAxis = sliceAxis
+        self.updateSlice()
+
+    def mousePressEvent(self,event):
+        axes = list(SliceAxis)
+        self.setSliceAxis(axes[(axes.index(self.sliceAxis)+1)%len(axes)])
+        super().mousePressEvent(event)
+
+    def updateSlice(self) -> None:
+        """
+        the slice of the current volume of the session, to be called when a sweep was added
+        """
+        self.image = None
+        if self.mappingSession is not None:
+            position = self.axialPositionMm if self.sliceAxis==SliceAxis.Z else 0.0
+            _, values = self.mappingSession.slice(self.sliceAxis,position,self.fieldView)
+            # color bands, NaN (not measured) shows the figure color; row 0 of the image is the top
+            colors = self.bandColors[np.searchsorted(self.levels,values,side='right')]
+            colors[np.isnan(values)] = VolumeSliceCanvas.FIGURE_COLOR.rgba()
+            self.imageBuffer = np.ascontiguousarray(colors[::-1])
+            rows, columns = self.imageBuffer.shape
+            self.image = QImage(self.imageBuffer.data,columns,rows,columns*4,QImage.Format.Format_ARGB32)
+            self.sliceText = f'{self.sliceAxis.name.lower()} = {position:.0f} mm'
+        self.update()
+
+    def plotRect(self) -> QRectF:
+        """
+        the slice in pixels: the transversal slice keeps the aspect, the longitudinal ones fill the width
+        """
+        top = VolumeSliceCanvas.TEXT_HEIGHT_PX
+        width, height = self.width(), max(1,self.height()-2*VolumeSliceCanvas.TEXT_HEIGHT_PX)
+        if self.sliceAxis==SliceAxis.Z:
+            side = min(width,height)
+            return QRectF((width-side)/2,top+(height-side)/2,side,side)
+        return QRectF(0,top,width,height)
+
+    def paintEvent(self,event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(),VolumeSliceCanvas.FIGURE_COLOR)
+        painter.setPen(QColor('white'))
+        font = QFont(painter.font())
+        font.setPointSizeF(8)
+        painter.setFont(font)
+        textHeight = VolumeSliceCanvas.TEXT_HEIGHT_PX
+        if self.mappingSession is None:
+            painter.drawText(QRectF(self.rect()),Qt.AlignmentFlag.AlignCenter,'no mapping session')
+            painter.end()
+            return
+
+        if self.image is not None:
+            painter.drawImage(self.plotRect(),self.image)
+        painter.drawText(QRectF(0,0,self.width(),textHeight),Qt.AlignmentFlag.AlignCenter,
+                         f'{self.fieldView.name.replace("_"," ")}, {self.sliceText}')
+        painter.drawText(QRectF(0,self.height()-textHeight,self.width(),textHeight),Qt.AlignmentFlag.AlignCenter,
+                         f'{len(self.mappingSession)} positions, {self.mappingSession.pointCount()} points')
+        painter.end()
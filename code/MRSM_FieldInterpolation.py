@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+
+#-------------------------------------------------------------------------------
+#
+#      The Magnetic Resonance Scanner Mockup Project
+#
+#
+#      M  R  S  M  _  F i e l d  I n t e r p o l a t i o n  .  p  y
+#
+#
+#      Last update: 261018
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+#  N O T E S :
+#
+#   Interpolation of the sensor values to the regular grid of the field maps.
+#
+#   The Clough-Tocher interpolation (griddata(..., method='cubic')) is linear
+#   in the values: for fixed sensor positions, the grid values are
+#
+#       gridValues = W @ values         W is (grid points x sensors)
+#
+#   W is obtained once, by interpolating the unit vectors of all sensors in
+#   one call on the Delaunay triangulation. The grid points outside the
+#   convex hull of the sensors have NaN rows (as fill_value=np.nan).
+#   (The gradient estimation of scipy is iterative, W reproduces griddata
+#   to its tolerance, ~1e-6.)
+#
+#   W depends on the sensor positions (i.e. the holder rotation) and on which
+#   sensors are available, which both change rarely; the operators are kept
+#   in a small LRU cache keyed by (holder rotation angle, availability mask).
+#   The holder rotation spinbox gives only a few different angles.
+#
+#   A FieldMap holds what a canvas shows for one FieldView: the sensor
+#   values, the grid and its isolines, as segments (marching squares, NumPy).
+#   It is computed here (FieldInterpolator.fieldMap(s)) or, off the Qt thread,
+#   by the FieldMapWorker (MRSM_FieldWorker).
+#
+#   As W is the same for all components, FieldInterpolator.fieldMaps
+#   interpolates the (sensors x 3) field in one product W @ values; the
+#   derived views (|B|, the magnitude in the transversal plane and its
+#   vectors, down-sampled for a quiver plot) come from the component grids
+#   without another interpolation. The isolines are only generated for the
+#   views which are shown.
+#
+#   The resolution of the maps (FieldMapDetail: grid size, isolines of every
+#   n-th level, their labels) is lowered and raised again by the frame-budget
+#   governor of the Magnetometer panel (MRSM_Utilities.FrameBudgetGovernor),
+#   along FIELD_MAP_DETAILS. A new grid size empties the operator cache.
+#   The quiver plot keeps about QUIVER_COUNT vectors per row at any grid size.
+#
+#-------------------------------------------------------------------------------
+
+from collections import OrderedDict
+from enum import Enum
+
+import numpy as np
+from scipy.interpolate import CloughTocher2DInterpolator
+from scipy.spatial import Delaunay
+
+from MRSM_Utilities import debug_message, error_message
+
+
+def cellSegments(corners: np.ndarray,x,y,level,dx,dy) -> np.ndarray:
+    """
+    marching squares: (segments x 2 x 2) isoline segments of 'level' in the cells with the 'corners'
+    (4 x cells, the values at (x,y), (x+dx,y), (x,y+dy), (x+dx,y+dy)), all crossed by the level
+    """
+    v00, v10, v01, v11 = corners
+    a00, a10, a01, a11 = corners>=level
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        # the crossing points of the edges [bottom, right, top, left]
+        points = np.stack((
+            np.column_stack((x+(level-v00)/(v10-v00)*dx, y)),
+            np.column_stack((x+dx, y+(level-v10)/(v11-v10)*dy)),
+            np.column_stack((x+(level-v01)/(v11-v01)*dx, y+dy)),
+            np.column_stack((x, y+(level-v00)/(v01-v00)*dy)),
+        ),axis=1)
+    isCrossed = np.column_stack((a00!=a10, a10!=a11, a01!=a11, a00!=a01))
+
+    # two crossed edges: one segment
+    isSimple = isCrossed.sum(axis=1)==2
+    edges = np.argsort(~isCrossed[isSimple],axis=1,kind='stable')[:,0:2]
+    segments = [np.take_along_axis(points[isSimple],edges[:,:,None],axis=1)]
+
+    # saddle: two segments, separating the corners which differ from the center
+    isSaddle = ~isSimple
+    if isSaddle.any():
+        saddlePoints = points[isSaddle]
+        isCenterLikeA00 = ((v00+v10+v01+v11)[isSaddle]/4>=level)==a00[isSaddle]
+        first = np.where(isCenterLikeA00[:,None],[0,1],[0,3])      # bottom-right, or bottom-left
+        second = np.where(isCenterLikeA00[:,None],[3,2],[2,1])     # left-top, or top-right
+        segments += [np.take_along_axis(saddlePoints,first[:,:,None],axis=1),
+                     np.take_along_axis(saddlePoints,second[:,:,None],axis=1)]
+    return np.concatenate(segments)
+
+
+def fieldIsolines(gridValues: np.ndarray,extent,levels,levelStep=1) -> list:
+    """
+    [(level index, (segments x 2 x 2) array)] of the levels which have isolines, in the grid coordinates
+    ('gridValues' is (rows x columns), row 0 at y0 of 'extent'); the cells with a NaN corner are left out;
+    only every 'levelStep'-th level (none if 0)
+    """
+    if levelStep<1:
+        return []
+    rows, columns = gridValues.shape
+    x0, x1, y0, y1 = extent
+    dx, dy = (x1-x0)/(columns-1), (y1-y0)/(rows-1)
+    corners = np.stack((gridValues[:-1,:-1],gridValues[:-1,1:],gridValues[1:,:-1],gridValues[1:,1:])).reshape(4,-1)
+    cellIndex = np.flatnonzero(~np.isnan(corners).any(axis=0))
+    corners = corners[:,cellIndex]
+    cellX, cellY = x0+(cellIndex%(columns-1))*dx, y0+(cellIndex//(columns-1))*dy
+    cellMin, cellMax = corners.min(axis=0), corners.max(axis=0)
+
+    isolines = []
+    for levelIndex in range(0,len(levels),levelStep):
+        level = levels[levelIndex]
+        cells = np.flatnonzero((cellMin<level) & (cellMax>=level))
+        if len(cells)>0:
+            isolines.append((levelIndex,cellSegments(corners[:,cells],cellX[cells],cellY[cells],level,dx,dy)))
+    return isolines
+
+
+class FieldMapDetail():
+    """
+    Resolution of the field maps: the grid size, the isolines of every 'isolineLevelStep'-th level
+    (none if 0) and whether they are labelled
+    """
+
+    def __init__(self,gridSize,isolineLevelStep=1,hasIsolineLabels=True) -> None:
+        self.gridSize           = gridSize
+        self.isolineLevelStep   = isolineLevelStep
+        self.hasIsolineLabels   = hasIsolineLabels
+
+    def __repr__(self):
+        return f'FieldMapDetail({self.gridSize},{self.isolineLevelStep},{self.hasIsolineLabels})'
+
+
+# the isoline levels and color band limits of the canvases (relative units)
+FIELD_MAP_LEVELS = np.linspace(-1.0,1.0,21)
+
+# from the finest (the grid of the canvases) to the coarsest, see NOTES
+FIELD_MAP_DETAILS = [
+    FieldMapDetail(100,1,True),
+    FieldMapDetail(80,1,True),
+    FieldMapDetail(60,2,True),
+    FieldMapDetail(45,2,False),
+    FieldMapDetail(30,4,False),
+    FieldMapDetail(20,0,False),
+]
+
+
+def quiverSlice(gridSizeX,gridSizeY,quiverCount) -> tuple:
+    """
+    the grid points of a quiver plot with about 'quiverCount' vectors per row and column
+    """
+    stepX, stepY = max(1,round(gridSizeX/quiverCount)), max(1,round(gridSizeY/quiverCount))
+    return np.s_[stepY//2::stepY,stepX//2::stepX]
+
+
+class FieldView(Enum):
+    """
+    what a field map shows; the components have the values of MRSM_Magnetometer.MgMOrientation
+    """
+    HORIZONTAL          = 1
+    VERTICAL            = 2
+    AXIAL               = 3
+    MAGNITUDE           = 4     # |B|
+    IN_PLANE_MAGNITUDE  = 5     # |(B_horizontal, B_vertical)|, with the vectors
+
+
+class FieldMap():
+    """
+    What a canvas shows for one FieldView: the sensor values, the interpolated grid and its isolines
+    """
+
+    def __init__(self,values,extent,gridValues,isolines,fieldView=None,vectors=None) -> None:
+        self.values     = values        # per sensor (rows as in the geometry), NaN for missing sensors
+        self.extent     = extent        # (x0, x1, y0, y1) of the grid
+        self.gridValues = gridValues    # (gridSizeY x gridSizeX)
+        self.isolines   = isolines      # see fieldIsolines
+        self.fieldView  = fieldView
+        self.vectors    = vectors       # None, or the (x, y, u, v) arrays of a quiver plot
+
+
+class InterpolationOperator():
+    """
+    Precomputed interpolation from the available sensors to the regular grid
+    """
+
+    def __init__(self,gridX,gridY,isAvailable,weights) -> None:
+        self.gridX          = gridX         # (gridSizeY x gridSizeX) meshgrid
+        self.gridY          = gridY
+        self.isAvailable    = isAvailable   # per-sensor mask, the columns of 'weights'
+        self.weights        = weights       # (grid points x available sensors)
+
+    def apply(self,values: np.ndarray) -> np.ndarray:
+        """
+        'values' of all sensors (the unavailable ones are ignored), returns the grid values;
+        for (sensors x components) 'values', (components x gridSizeY x gridSizeX), in one product
+        """
+        gridValues = self.weights @ values[self.isAvailable]
+        if values.ndim==1:
+            return gridValues.reshape(self.gridX.shape)
+        return gridValues.T.reshape((values.shape[1],)+self.gridX.shape)
+
+
+class FieldInterpolator():
+    """
+    Interpolates the sensor values of a SensorGeometry to a regular grid, by cached linear operators
+    """
+
+    GRID_SIZE_X = 100
+    GRID_SIZE_Y = 100
+    CACHE_SIZE  = 8
+    QUIVER_COUNT = 10   # vectors per row and column of the quiver plot
+
+    def __init__(self,sensorGeometry,gridSizeX=GRID_SIZE_X,gridSizeY=GRID_SIZE_Y,cacheSize=CACHE_SIZE) -> None:
+        self.sensorGeometry = sensorGeometry
+        self.gridSizeX      = gridSizeX
+        self.gridSizeY      = gridSizeY
+        self.cacheSize      = cacheSize
+        self.operators      = OrderedDict()     # (holder rotation angle, availability mask) -> InterpolationOperator
+        self.buildCount     = 0
+
+    def setGridSize(self,gridSizeX,gridSizeY) -> None:
+        """
+        the operators of the former grid size are dropped
+        """
+        if (gridSizeX,gridSizeY)==(self.gridSizeX,self.gridSizeY):
+            return
+        self.gridSizeX, self.gridSizeY = gridSizeX, gridSizeY
+        self.operators.clear()
+
+    def regularGrid(self) -> tuple:
+        """
+        (gridX, gridY) meshgrid over the bounding box of all sensors, for the current holder rotation
+        """
+        x, y = self.sensorGeometry.x, self.sensorGeometry.y
+        return np.meshgrid(np.linspace(x.min(),x.max(),self.gridSizeX),
+                           np.linspace(y.min(),y.max(),self.gridSizeY))
+
+    def buildOperator(self,isAvailable: np.ndarray) -> InterpolationOperator:
+        gridX, gridY = self.regularGrid()
+        points = self.sensorGeometry.xy[isAvailable]
+        try:
+            triangulation = Delaunay(points)
+            # the interpolation of the unit vectors gives the columns of the operator
+            weights = CloughTocher2DInterpolator(triangulation,np.eye(len(points)),fill_value=np.nan)(
+                        np.column_stack((gridX.ravel(),gridY.ravel())))
+        except Exception:
+            # too few (or collinear) points to interpolate
+            weights = np.full((gridX.size,len(points)),np.nan)
+        self.buildCount += 1
+        return InterpolationOperator(gridX,gridY,isAvailable.copy(),weights)
+
+    def operator(self,isAvailable: np.ndarray) -> InterpolationOperator:
+        key = (self.sensorGeometry.holderRotationAngleDeg,isAvailable.tobytes())
+        operator = self.operators.get(key)
+        if operator is None:
+            operator = self.buildOperator(isAvailable)
+            self.operators[key] = operator
+            if len(self.operators)>self.cacheSize:
+                self.operators.popitem(last=False)
+        else:
+            self.operators.move_to_end(key)
+        return operator
+
+    def interpolate(self,values: np.ndarray) -> tuple:
+        """
+        per-sensor 'values' (rows as in the geometry, NaN for missing sensors; or sensors x components),
+        returns (gridX, gridY, gridValues), see InterpolationOperator.apply
+        """
+        values = np.asarray(values,dtype=float)
+        operator = self.operator(~np.isnan(values.reshape(len(values),-1)).any(axis=1))
+        return operator.gridX, operator.gridY, operator.apply(values)
+
+    def fieldMap(self,values: np.ndarray,levels,isolineLevelStep=1) -> FieldMap:
+        """
+        the FieldMap of the per-sensor 'values', with the isolines of (every 'isolineLevelStep'-th of) 'levels'
+        """
+        values = np.asarray(values,dtype=float)
+        gridX, gridY, gridValues = self.interpolate(values)
+        extent = (gridX[0,0],gridX[0,-1],gridY[0,0],gridY[-1,0])
+        return FieldMap(values,extent,gridValues,fieldIsolines(gridValues,extent,levels,isolineLevelStep))
+
+    def fieldMaps(self,componentValues: np.ndarray,levels,fieldViews=None,isolineLevelStep=1) -> dict:
+        """
+        {FieldView: FieldMap} from the (sensors x 3) 'componentValues' (HORIZONTAL, VERTICAL, AXIAL),
+        by one interpolation; the isolines of (every 'isolineLevelStep'-th of) 'levels' only for 'fieldViews'
+        (default: all views)
+        """
+        componentValues = np.asarray(componentValues,dtype=float)
+        gridX, gridY, componentGrids = self.interpolate(componentValues)
+        extent = (gridX[0,0],gridX[0,-1],gridY[0,0],gridY[-1,0])
+        horizontal, vertical, axial = componentGrids
+        inPlaneMagnitude = np.hypot(horizontal,vertical)
+        views = {
+            FieldView.HORIZONTAL:           (componentValues[:,0],horizontal),
+            FieldView.VERTICAL:             (componentValues[:,1],vertical),
+            FieldView.AXIAL:                (componentValues[:,2],axial),
+            FieldView.MAGNITUDE:            (np.sqrt((componentValues**2).sum(axis=1)),np.sqrt(inPlaneMagnitude**2+axial**2)),
+            FieldView.IN_PLANE_MAGNITUDE:   (np.hypot(componentValues[:,0],componentValues[:,1]),inPlaneMagnitude),
+        }
+        shownViews = set(FieldView if fieldViews is None else fieldViews)
+        fieldMaps = {fieldView: FieldMap(values,extent,gridValues,
+                                         fieldIsolines(gridValues,extent,levels,isolineLevelStep) if fieldView in shownViews else [],
+                                         fieldView)
+                     for fieldView,(values,gridValues) in views.items()}
+        quiver = quiverSlice(self.gridSizeX,self.gridSizeY,self.QUIVER_COUNT)
+        fieldMaps[FieldView.IN_PLANE_MAGNITUDE].vectors = (gridX[quiver],gridY[quiver],horizontal[quiver],vertical[quiver])
+        return fieldMaps
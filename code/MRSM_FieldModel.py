@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+
+#-------------------------------------------------------------------------------
+#
+#      The Magnetic Resonance Scanner Mockup Project
+#
+#
+#      M  R  S  M  _  F i e l d  M o d e l  .  p  y
+#
+#
+#      Last update: 261018
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+#  N O T E S :
+#
+#   Harmonic model of the field in the transversal plane of the sensors.
+#   Every component satisfies the Laplace equation; in the plane (no axial
+#   dependence) its solutions are the cylindrical harmonics
+#
+#       B(r,phi) = A0 + sum_n (r/R)^n (An cos(n phi) + Bn sin(n phi))
+#
+#   i.e. the real and imaginary parts of ((x+iy)/R)^n, with R the radius
+#   of the outermost sensors (for the conditioning of the fit).
+#
+#   The coefficients are the least-squares fit to the sensor values. For
+#   fixed sensor positions this is linear, coefficients = P @ values, with
+#   P the pseudo-inverse of the basis at the sensors. P is computed once per
+#   holder rotation and set of available sensors (an LRU cache, as the
+#   interpolation operators in MRSM_FieldInterpolation), so that a sweep is
+#   fitted (all three components) by one matrix product. If there are too
+#   few sensors for the full order, the higher orders are left out (zero).
+#
+#   The homogeneity is the peak-to-peak variation of |B| of the model over
+#   the disk of radius R (the DSV of the plane), relative to its mean,
+#   in ppm. The sensor values are proportional to the field, so the ratio
+#   does not depend on their scale.
+#
+#-------------------------------------------------------------------------------
+
+from collections import OrderedDict
+
+import numpy as np
+
+from MRSM_Utilities import debug_message, error_message
+
+
+class CylindricalHarmonicModel():
+    """
+    Least-squares cylindrical-harmonic fit of the field of a SensorGeometry, by cached pseudo-inverses
+    """
+
+    ORDER       = 3
+    CACHE_SIZE  = 8
+    DSV_RADIAL_SAMPLES  = 8     # the disk of the homogeneity
+    DSV_ANGULAR_SAMPLES = 36
+
+    def __init__(self,sensorGeometry,order=ORDER,cacheSize=CACHE_SIZE) -> None:
+        self.sensorGeometry     = sensorGeometry
+        self.order              = order
+        self.cacheSize          = cacheSize
+        self.referenceRadiusMm  = float(np.max(sensorGeometry.radiusMm)) or 1.0
+        self.pseudoInverses     = OrderedDict()     # (holder rotation angle, availability mask) -> (basis terms used, P)
+        self.buildCount         = 0
+
+        # the disk is fixed in the scanner coordinates, its basis is computed once
+        radii = np.linspace(0.0,self.referenceRadiusMm,CylindricalHarmonicModel.DSV_RADIAL_SAMPLES)
+        angles = np.linspace(0.0,2*np.pi,CylindricalHarmonicModel.DSV_ANGULAR_SAMPLES,endpoint=False)
+        self.dsvBasis = self.basis(np.outer(radii,np.cos(angles)).ravel(),np.outer(radii,np.sin(angles)).ravel())
+
+    def termCount(self,order=None) -> int:
+        return 1+2*(self.order if order is None else order)
+
+    def termNames(self) -> list:
+        """
+        'A0', 'A1', 'B1', 'A2', 'B2', ... in the order of the coefficients
+        """
+        return ['A0']+[f'{ab}{n}' for n in range(1,self.order+1) for ab in 'AB']
+
+    def basis(self,x,y) -> np.ndarray:
+        """
+        (points x terms) values of the harmonics at the points (x, y) [mm]
+        """
+        z = (np.asarray(x,dtype=float)+1j*np.asarray(y,dtype=float))/self.referenceRadiusMm
+        powers = z[:,None]**np.arange(1,self.order+1)
+        terms = np.empty((len(z),self.termCount()))
+        terms[:,0] = 1.0
+        terms[:,1::2] = powers.real
+        terms[:,2::2] = powers.imag
+        return terms
+
+    def buildPseudoInverse(self,isAvailable: np.ndarray) -> tuple:
+        # at least as many sensors as terms
+        order = min(self.order,max(0,(int(isAvailable.sum())-1)//2))
+        termCount = self.termCount(order)
+        basis = self.basis(self.sensorGeometry.x[isAvailable],self.sensorGeometry.y[isAvailable])[:,0:termCount]
+        self.buildCount += 1
+        if len(basis)==0:
+            return termCount, np.zeros((termCount,0))
+        return termCount, np.linalg.pinv(basis)
+
+    def pseudoInverse(self,isAvailable: np.ndarray) -> tuple:
+        key = (self.sensorGeometry.holderRotationAngleDeg,isAvailable.tobytes())
+        pseudoInverse = self.pseudoInverses.get(key)
+        if pseudoInverse is None:
+            pseudoInverse = self.buildPseudoInverse(isAvailable)
+            self.pseudoInverses[key] = pseudoInverse
+            if len(self.pseudoInverses)>self.cacheSize:
+                self.pseudoInverses.popitem(last=False)
+        else:
+            self.pseudoInverses.move_to_end(key)
+        return pseudoInverse
+
+    def fit(self,componentValues: np.ndarray) -> np.ndarray:
+        """
+        (terms x components) coefficients of the (sensors x components) 'componentValues'
+        (rows as in the geometry, NaN for missing sensors); NaN if no sensor is available
+        """
+        componentValues = np.asarray(componentValues,dtype=float)
+        isAvailable = ~np.isnan(componentValues).any(axis=1)
+        termCount, pseudoInverse = self.pseudoInverse(isAvailable)
+        coefficients = np.zeros((self.termCount(),componentValues.shape[1]))
+        if not isAvailable.any():
+            return coefficients*np.nan
+        coefficients[0:termCount] = pseudoInverse @ componentValues[isAvailable]
+        return coefficients
+
+    def evaluate(self,coefficients: np.ndarray,x,y) -> np.ndarray:
+        """
+        (points x components) field of the model at the points (x, y) [mm]
+        """
+        return self.basis(np.ravel(x),np.ravel(y)) @ coefficients
+
+    def homogeneityPpm(self,coefficients: np.ndarray) -> float:
+        """
+        peak-to-peak |B| of the model over the DSV disk, relative to its mean, in ppm
+        """
+        magnitude = np.sqrt(((self.dsvBasis @ coefficients)**2).sum(axis=1))
+        meanMagnitude = magnitude.mean()
+        if not meanMagnitude>0:
+            return np.nan
+        return (magnitude.max()-magnitude.min())/meanMagnitude*1e6
@@ -20,10 +20,32 @@
 #       https://www.pythonguis.com/tutorials/pyqt6-plotting-matplotlib/
 #       https://how2matplotlib.com/matplotlib-contour-from-points.html
 #
+#   The interpolation to the regular grid is done by precomputed operators
+#   (see MRSM_FieldInterpolation), which can be shared by all canvases of
+#   the same holder.
+#
+#   Blitting mode (default): the artists are created once, not on every
+#   refresh. On every full draw (see on_draw) the figure without the
+#   animated artists is cached as the background, and the static overlay
+#   (bore circle, sensor names, title) and the 21 isoline labels are
+#   rendered once into RGBA sprites. A refresh restores the background,
+#   updates the field layer in place (an image with the 21 levels of the
+#   former contourf, as BoundaryNorm), replaces the isoline segments
+#   (of the FieldMap, see MRSM_FieldInterpolation), composites the sprites
+#   over it with NumPy (the overlay has to stay on top of the field) and
+#   blits. The isoline labels are horizontal, one per level, spread apart
+#   (clabel was most of the cost).
+#   With hasToUseBlitting=False, every refresh clears the axes and redraws
+#   everything (the former behaviour).
+#
+#   Display modes: a canvas shows one FieldView (a component, |B| or the
+#   magnitude in the transversal plane with its vectors as a quiver plot),
+#   see MRSM_FieldInterpolation; a click on the canvas switches to the next
+#   view (blitting mode only).
+#
 #-------------------------------------------------------------------------------
 
 import numpy as np
-from scipy.interpolate import griddata
 
 import matplotlib
 import matplotlib.pyplot as plt
@@ -31,57 +53,291 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg, NavigationToolbar2QT as NavigationToolbar
 from matplotlib.figure import Figure
 from matplotlib.patches import Circle,Polygon
-from matplotlib.collections import PatchCollection
+from matplotlib.collections import PatchCollection, LineCollection
+from matplotlib.colors import BoundaryNorm
+from matplotlib.text import Text
+from matplotlib.transforms import IdentityTransform
 
 from MRSM_Utilities import debug_message, error_message
+from MRSM_FieldInterpolation import FieldInterpolator, FieldView, FIELD_MAP_LEVELS
 
 class FieldPlotCanvas(FigureCanvasQTAgg):
 
     gridSizeX = 100
     gridSizeY = 100
 
-    def __init__(self,scatteredPointsDict,figureWidth,figureHeight,dpi=100,parent=None,
+    def __init__(self,sensorGeometry,figureWidth,figureHeight,dpi=100,parent=None,
                  title='',
-                 hasToIncludeColorbar=True):
+                 hasToIncludeColorbar=True,
+                 fieldInterpolator=None,
+                 hasToUseBlitting=True,
+                 fieldView=None):
         
-        self.scatteredPointDict = scatteredPointsDict 
+        self.sensorGeometry = sensorGeometry    # MRSM_Controller.SensorGeometry
+        self.fieldInterpolator = (FieldInterpolator(sensorGeometry,FieldPlotCanvas.gridSizeX,FieldPlotCanvas.gridSizeY) 
+                                  if fieldInterpolator is None else fieldInterpolator)
         self.title = title
         self.hasToIncludeColorbar = hasToIncludeColorbar
+        self.hasToUseBlitting = hasToUseBlitting
+        self.fieldView = fieldView      # FieldView shown (None: set by the caller of UpdatePlot)
+        self.hasToShowIsolineLabels = True  # (lowered detail, see FieldMapDetail)
+        # self.levels = [-0.5,-0.1,0.0,0.1,0.5]
+        self.levels = FIELD_MAP_LEVELS
 
         self.figure = Figure(figsize=(figureWidth, figureHeight), dpi=dpi,facecolor='blue')
         self.axes = self.figure.add_subplot(111)        
         self.axes.set_position([-0.1,-0.1,1.2,1.2])
         super().__init__(self.figure)    
 
+        self.background = None
+        if self.hasToUseBlitting:
+            self.createArtists()
+            self.mpl_connect('draw_event',self.on_draw)
+
         self.updateScatteredPointPositions()
      
     def updateScatteredPointPositions(self):
        
-        #IH241111 I was not sure if the order "for p in self.scatteredPointDict" is stable. But this is in doc:
-        # Python 3.7 and later: Dictionaries maintain the insertion order of keys. 
-        # This means that when you iterate over a dictionary, 
-        # the keys will be returned in the order they were added.
-
-        self.xScattered_Array = np.array([self.scatteredPointDict[p]['X'] for p in self.scatteredPointDict])
-        self.yScattered_Array = np.array([self.scatteredPointDict[p]['Y'] for p in self.scatteredPointDict])
-
-        # create regular grid
-        self.xRegularGrid_Array = np.linspace(self.xScattered_Array.min(),self.xScattered_Array.max(),FieldPlotCanvas.gridSizeX) 
-        self.yRegularGrid_Array = np.linspace(self.yScattered_Array.min(),self.yScattered_Array.max(),FieldPlotCanvas.gridSizeY) 
-        self.xRegularGrid_Array,self.yRegularGrid_Array = np.meshgrid(self.xRegularGrid_Array,self.yRegularGrid_Array)
-        
-        self.UpdatePlot({k: 0 for k in self.scatteredPointDict.keys()}) #use zero initial values
+        # views of the geometry arrays (updated in place by the holder rotation),
+        # the rows follow sensorGeometry.sensorNames, as the values in UpdatePlot
+        self.xScattered_Array = self.sensorGeometry.x
+        self.yScattered_Array = self.sensorGeometry.y
+
+        if self.hasToUseBlitting:
+            # the overlay follows the holder rotation, the limits change, so the background is redrawn
+            self.scatterPlot.set_offsets(self.sensorGeometry.xy)
+            for pntIndex,pntText in enumerate(self.pointNameTexts):
+                pntText.set_position((self.xScattered_Array[pntIndex]+0.5,self.yScattered_Array[pntIndex]-0.5))
+            self.background = None
+
+        # the regular grid follows the holder rotation, see FieldInterpolator.regularGrid
+        self.UpdatePlot({k: 0 for k in self.sensorGeometry.sensorNames}) #use zero initial values
+
+    def createArtists(self):
+        """
+        blitting mode: all artists are created once, they are animated, i.e. left out of the full draw
+        """
+        cmap = matplotlib.colormaps['PiYG']
+        #IH241114 for a choice of cmap's, see
+        # https://matplotlib.org/stable/users/explain/colors/colormaps.html
+
+        # field layer, the color bands of contourf(levels=self.levels, extend='both')
+        self.fieldImage = self.axes.imshow(
+                        np.full((2,2),np.nan),
+                        origin='lower',
+                        interpolation='nearest',
+                        cmap=cmap,
+                        norm=BoundaryNorm(self.levels,cmap.N,extend='both'),
+                        animated=True
+        )
+        self.isolineCollection = LineCollection([],colors='k',linewidths=0.5,animated=True)
+        self.axes.add_collection(self.isolineCollection,autolim=False)
+        self.isolineLabelPositions = []     # (level index, display x, display y)
+
+        if self.hasToIncludeColorbar:    
+            self.colorbar = plt.colorbar(self.fieldImage,location='left')
+            self.colorbar.ax.tick_params(labelsize=1000) #IH241114 this does not work
+
+        # overlay
+        self.scatterPlot = self.axes.scatter(
+                        self.sensorGeometry.x,
+                        self.sensorGeometry.y,
+                        c='red',
+                        s=10,
+                        animated=True,
+                        visible=not self.hasToIncludeColorbar
+        )
+        self.pointNameTexts = [self.axes.text(0,0,pntName,fontsize=8,color='red',animated=True,visible=not self.hasToIncludeColorbar)
+                               for pntName in self.sensorGeometry.sensorNames]
+        patchCollection = PatchCollection([Circle((0,0),30)],alpha=0.5,animated=True)
+        self.axes.add_collection(patchCollection)
+        #IH241114 'text' used rather than 'title' to save space
+        self.titleText = self.axes.text(0,-25.5,self.title,color='white',fontsize='x-small',horizontalalignment='center',verticalalignment='bottom',
+                                   animated=True)
+        self.overlayArtists = [patchCollection]+self.pointNameTexts+[self.titleText]
+        self.quiverPlot = None      # created by the first FieldMap with vectors
+
+        # cosmetics, the limits are fixed by the bore circle (as autoscaled in RedrawPlot)
+        self.axes.axis('equal')
+        self.axes.autoscale_view()
+        self.axes.set_axis_off()
 
+    def on_draw(self,event):
+        """
+        after a full draw (first show, resize, holder rotation): caches the background, 
+        renders the overlay and the isoline labels once into RGBA sprites, then draws the animated layer
+        """
+        renderer = self.get_renderer()
+        self.background = self.copy_from_bbox(self.figure.bbox)
+
+        renderer.clear()    # transparent
+        for artist in self.overlayArtists:
+            self.axes.draw_artist(artist)
+        self.overlaySprite = self.cropSprite(np.asarray(renderer.buffer_rgba()))
+
+        self.isolineLabelSprites = []
+        for level in self.levels:
+            renderer.clear()
+            labelText = Text(50,50,f'{level:.1f}'.replace('-','\u2212'),fontsize=8,color='k',
+                             horizontalalignment='center',verticalalignment='center',
+                             transform=IdentityTransform(),figure=self.figure)
+            labelText.draw(renderer)
+            self.isolineLabelSprites.append(self.cropSprite(np.asarray(renderer.buffer_rgba()),centerXY=(50,50)))
+
+        self.restore_region(self.background)
+        self.drawAnimatedLayer()
+
+    def cropSprite(self,rgba,centerXY=None) -> tuple:
+        """
+        (RGBA pixels with alpha in 0..1, top row, left column) of the non-transparent part of the buffer;
+        the offsets are relative to 'centerXY' (display coordinates) if given
+        """
+        rows, columns = np.nonzero(rgba[:,:,3])
+        if len(rows)==0:
+            return (np.zeros((0,0,4)),0,0)
+        top, bottom, left, right = rows.min(), rows.max()+1, columns.min(), columns.max()+1
+        sprite = rgba[top:bottom,left:right].astype(float)
+        sprite[:,:,3] /= 255
+        if centerXY is not None:
+            top, left = top-(rgba.shape[0]-centerXY[1]), left-centerXY[0]
+        return (sprite,top,left)
+
+    def stampSprite(self,buffer,spriteTopLeft,top=0,left=0) -> None:
+        """
+        alpha-composites the sprite over the (opaque) RGBA buffer, clipped to the buffer
+        """
+        sprite, spriteTop, spriteLeft = spriteTopLeft
+        top, left = top+spriteTop, left+spriteLeft
+        height, width = sprite.shape[0:2]
+        bufferTop, bufferLeft = max(top,0), max(left,0)
+        bufferBottom, bufferRight = min(top+height,buffer.shape[0]), min(left+width,buffer.shape[1])
+        if bufferBottom<=bufferTop or bufferRight<=bufferLeft:
+            return
+        sprite = sprite[bufferTop-top:bufferBottom-top,bufferLeft-left:bufferRight-left]
+        region = buffer[bufferTop:bufferBottom,bufferLeft:bufferRight,0:3]
+        alpha = sprite[:,:,3:4]
+        region[:] = (sprite[:,:,0:3]*alpha + region*(1-alpha)).astype(np.uint8)
+
+    def drawAnimatedLayer(self):
+        self.axes.draw_artist(self.fieldImage)
+        self.axes.draw_artist(self.isolineCollection)
+        if self.quiverPlot is not None and self.quiverPlot.get_visible():
+            self.axes.draw_artist(self.quiverPlot)
+        self.axes.draw_artist(self.scatterPlot)
+        buffer = np.asarray(self.get_renderer().buffer_rgba())
+        self.stampSprite(buffer,self.overlaySprite)
+        height = buffer.shape[0]
+        for levelIndex,x,y in self.isolineLabelPositions:
+            self.stampSprite(buffer,self.isolineLabelSprites[levelIndex],int(round(height-y)),int(round(x)))
+
+    def updateIsolines(self,isolines):
+        """
+        the isoline segments of a FieldMap, and a label position per level, the segment
+        farthest from the labels placed so far (spread apart as clabel does)
+        """
+        self.isolineLabelPositions = []
+        for levelIndex,segments in (isolines if self.hasToShowIsolineLabels else []):
+            midpoints = self.axes.transData.transform(segments.mean(axis=1))
+            if self.isolineLabelPositions:
+                placed = np.array([(x,y) for _,x,y in self.isolineLabelPositions])
+                distance = np.min(np.hypot(midpoints[:,None,0]-placed[None,:,0],midpoints[:,None,1]-placed[None,:,1]),axis=1)
+                x, y = midpoints[np.argmax(distance)]
+            else:
+                x, y = midpoints[len(midpoints)//2]
+            self.isolineLabelPositions.append((levelIndex,x,y))
+        self.isolineCollection.set_segments(np.concatenate([segments for _,segments in isolines]) if isolines else [])
+
+    def updateVectors(self,vectors):
+        if vectors is None:
+            if self.quiverPlot is not None:
+                self.quiverPlot.set_visible(False)
+            return
+        x, y, u, v = vectors
+        if self.quiverPlot is None or self.quiverPlot.N!=x.size:
+            if self.quiverPlot is not None:
+                self.quiverPlot.remove()
+            # 1 (relative units) is 4 mm, about the spacing of the vectors;
+            # (quiver rescales the axes, the limits stay as given by the bore circle)
+            xlim, ylim = self.axes.get_xlim(), self.axes.get_ylim()
+            self.quiverPlot = self.axes.quiver(x,y,u,v,angles='xy',scale_units='xy',scale=0.25,
+                                               width=0.005,color='k',animated=True)
+            self.axes.set_xlim(xlim,auto=None)
+            self.axes.set_ylim(ylim,auto=None)
+        self.quiverPlot.set_offsets(np.column_stack((x.ravel(),y.ravel())))
+        self.quiverPlot.set_UVC(np.ma.masked_invalid(u),np.ma.masked_invalid(v))
+        self.quiverPlot.set_visible(True)
+
+    def setFieldView(self,fieldView):
+        """
+        blitting mode: the canvas shows 'fieldView' from the next FieldMap on
+        """
+        self.fieldView = fieldView
+        self.title = fieldView.name.replace('_',' ')
+        self.titleText.set_text(self.title)
+        self.background = None      # the title is a part of the overlay
+        if self.isVisible():
+            self.draw_idle()
+
+    def mousePressEvent(self,event):
+        if self.hasToUseBlitting and self.fieldView is not None and not self.hasToIncludeColorbar:
+            views = list(FieldView)
+            self.setFieldView(views[(views.index(self.fieldView)+1)%len(views)])
+        super().mousePressEvent(event)
 
     def UpdatePlot(self,valuesDict):
+        if not self.hasToUseBlitting:
+            self.RedrawPlot(valuesDict)
+            return
+        values = np.array([float(valuesDict[p]) for p in valuesDict])
+        self.showFieldMap(self.fieldInterpolator.fieldMap(values,self.levels))
+
+    def showFieldMap(self,fieldMap):
+        """
+        blitting mode: shows a FieldMap (MRSM_FieldInterpolation), computed by UpdatePlot or by the FieldMapWorker
+        """
+        if fieldMap.fieldView is not None and fieldMap.fieldView!=self.fieldView:
+            return      # computed for the former view
+        self.valueScattered_Array = fieldMap.values
+        self.isValueAvailable_Array = ~np.isnan(self.valueScattered_Array)
+        self.valueRegularGrid_Array = fieldMap.gridValues
+
+        # field layer, in place
+        # (colors mapped here, outside the convex hull of the sensors transparent)
+        self.fieldImage.set_data(self.fieldImage.to_rgba(np.ma.masked_invalid(self.valueRegularGrid_Array),bytes=True))
+        extent = tuple(fieldMap.extent)
+        if tuple(self.fieldImage.get_extent())!=extent:
+            # (set_extent rescales the axes to the image, the limits stay as given by the bore circle)
+            xlim, ylim = self.axes.get_xlim(), self.axes.get_ylim()
+            self.fieldImage.set_extent(extent)
+            self.axes.set_xlim(xlim,auto=None)
+            self.axes.set_ylim(ylim,auto=None)
+
+        # show isolines, vectors and measuring points
+        if not self.hasToIncludeColorbar:
+            self.updateIsolines(fieldMap.isolines)
+            self.updateVectors(fieldMap.vectors)
+            self.scatterPlot.set_color(np.where(self.isValueAvailable_Array,'red','gray'))
+
+        if self.background is None:
+            # not drawn yet (or the geometry changed): a full draw, see on_draw;
+            # not while hidden, the figure gets its size when the canvas is shown (and resized)
+            if self.isVisible():
+                self.draw_idle()
+            return
+        self.restore_region(self.background)
+        self.drawAnimatedLayer()
+        self.blit(self.figure.bbox)
+
+    def RedrawPlot(self,valuesDict):
 
         self.valueScattered_Array = np.array([float(valuesDict[p]) for p in valuesDict])
-        self.valueRegularGrid_Array = griddata((self.xScattered_Array, self.yScattered_Array), self.valueScattered_Array, 
-                                      (self.xRegularGrid_Array, self.yRegularGrid_Array), method='cubic',fill_value=np.nan)
 
-        # self.levels = [-0.5,-0.1,0.0,0.1,0.5]
-        self.levels = np.linspace(-1.0,1.0,21)
-        
+        # missing sensors have NaN values, they are left out of the interpolation
+        # (cubic, as griddata(..., method='cubic'), by a cached operator)
+        self.isValueAvailable_Array = ~np.isnan(self.valueScattered_Array)
+        self.xRegularGrid_Array, self.yRegularGrid_Array, self.valueRegularGrid_Array = (
+                                      self.fieldInterpolator.interpolate(self.valueScattered_Array))
+
         # purge old plots
         self.axes.cla()
        
@@ -124,7 +380,7 @@ class FieldPlotCanvas(FigureCanvasQTAgg):
           self.scatterPlot = self.axes.scatter(
                         self.xScattered_Array,
                         self.yScattered_Array,
-                        c='red',
+                        c=np.where(self.isValueAvailable_Array,'red','gray'),
                         s=10
           )
           pntIndex=0 
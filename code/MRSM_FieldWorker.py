@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+
+#-------------------------------------------------------------------------------
+#
+#      The Magnetic Resonance Scanner Mockup Project
+#
+#
+#      M  R  S  M  _  F i e l d  W o r k e r  .  p  y
+#
+#
+#      Last update: 261018
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+#  N O T E S :
+#
+#   The field maps shown by the canvases (interpolation, derived views and
+#   isolines, see MRSM_FieldInterpolation) are computed in a separate process,
+#   on another core, so that only the painting is left in the Qt thread.
+#
+#   Nothing is pickled, the data travel through two shared memory blocks:
+#
+#       request     the newest field (sensors x 3), the views to be shown, the
+#                   sensor positions and the holder rotation angle; a new request
+#                   overwrites the one not yet taken by the worker (latest
+#                   wins, the worker never works through a backlog)
+#       results     three slots (triple buffering): the worker writes into
+#                   the 'back' slot and swaps it with the 'ready' one, the
+#                   Qt thread swaps 'ready' with its 'front' slot when it
+#                   is new, and shows 'front' (views, no copy) until the
+#                   next swap; the swaps are done under a lock. A 'ready'
+#                   result of a former holder rotation angle is dropped
+#                   without the swap, 'front' stays shown
+#
+#   The isolines are stored as segments, at most MAX_SEGMENT_COUNT per
+#   map (more are left out).
+#
+#   Every request carries its FieldMapDetail (grid size, isoline levels), set
+#   by the frame-budget governor of the panel. The grids and vectors of the
+#   result slots have the size of the finest detail, a result uses their top
+#   left part (its sizes are in the header). The result header also gives
+#   the computation time of the maps, a part of the cost of the refresh.
+#
+#   The process is forked (MRSM_Demo has no __main__ guard, so that it cannot
+#   be spawned). Only the forking thread lives on in the child, a lock held by
+#   another thread at the fork (Qt, the SDL audio of pygame, the acquisition)
+#   would stay locked there. So MRSM_Demo forks the worker first, before the
+#   QApplication and MRSM_Controller exist, with the geometry of the holder
+#   given on the command line; the magnetometer panel attaches it to the
+#   geometry of the magnetometer (the child uses only the sensor positions of
+#   the requests). A worker created by the panel itself (e.g. without
+#   MRSM_Demo) is forked with these threads running, which is not safe.
+#   Where fork is not available, the FieldMapWorker cannot be created and the
+#   field maps are computed in the Qt thread, as before.
+#
+#   The worker quits when the application has quit without finalizing it.
+#
+#   A result is shown one status update later than its request was sent.
+#
+#-------------------------------------------------------------------------------
+
+import multiprocessing
+import os
+import time
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from MRSM_Utilities import debug_message, error_message
+from MRSM_FieldInterpolation import FieldInterpolator, FieldMap, FieldMapDetail, FieldView
+
+
+def sharedArrays(buffer,layout) -> dict:
+    """
+    NumPy views of the fields [(name, shape, dtype)] of 'layout', one after another in 'buffer'
+    """
+    arrays = {}
+    offset = 0
+    for name,shape,dtype in layout:
+        arrays[name] = np.ndarray(shape,dtype=dtype,buffer=buffer,offset=offset)
+        offset += -(-arrays[name].nbytes//8)*8     # 8-byte aligned
+    return arrays
+
+def layoutSize(layout) -> int:
+    return sum(-(-int(np.prod(shape))*np.dtype(dtype).itemsize//8)*8 for _,shape,dtype in layout)
+
+
+class FieldMapWorker():
+    """
+    Computes the FieldMaps shown by the canvases in a worker process, see NOTES
+    """
+
+    MAX_SEGMENT_COUNT   = 20000     # per map
+    PARENT_CHECK_PERIOD_SEC = 1.0   # whether the application is still running
+    SLOT_COUNT          = 3
+    BACK, READY, FRONT, IS_READY_NEW = 0, 1, 2, 3   # of slotState
+
+    def __init__(self,sensorGeometry,levels,mapCount=3,
+                 gridSizeX=FieldInterpolator.GRID_SIZE_X,gridSizeY=FieldInterpolator.GRID_SIZE_Y) -> None:
+        """
+        'gridSizeX', 'gridSizeY' are those of the finest FieldMapDetail
+        """
+        self.sensorGeometry = sensorGeometry    # MRSM_Controller.SensorGeometry
+        self.levels         = np.asarray(levels,dtype=float)
+        self.mapCount       = mapCount
+        self.gridSizeX      = gridSizeX
+        self.gridSizeY      = gridSizeY
+        self.computeSec     = 0.0               # of the latest result
+        sensorCount = len(sensorGeometry)
+
+        self.requestLayout = [
+            ('header',      (5,),                               np.float64),    # request sequence, holder rotation angle,
+                                                                                # grid size x, y, isoline level step
+            ('xy',          (sensorCount,2),                    np.float64),
+            ('values',      (sensorCount,3),                    np.float64),    # HORIZONTAL, VERTICAL, AXIAL
+            ('fieldViews',  (mapCount,),                        np.int32),      # FieldView.value of the maps
+        ]
+        self.resultLayout = [
+            ('header',      (11,),                              np.float64),    # request sequence, holder rotation angle, extent,
+                                                                                # grid size x, y, quiver size x, y, computation time
+            ('fieldViews',  (mapCount,),                        np.int32),
+            ('values',      (mapCount,sensorCount),             np.float64),
+            ('gridValues',  (mapCount,gridSizeY,gridSizeX),     np.float64),
+            ('segmentCounts', (mapCount,len(self.levels)),      np.int32),
+            ('segments',    (mapCount,FieldMapWorker.MAX_SEGMENT_COUNT,2,2), np.float32),
+            ('hasVectors',  (mapCount,),                        np.int32),
+            ('vectors',     (mapCount,4,gridSizeY,gridSizeX),   np.float64),    # x, y, u, v
+        ]
+
+        context = multiprocessing.get_context('fork')  # ValueError where not available
+        self.requestMemory = SharedMemory(create=True,size=layoutSize(self.requestLayout))
+        self.resultMemory = SharedMemory(create=True,size=FieldMapWorker.SLOT_COUNT*layoutSize(self.resultLayout))
+        self.request = sharedArrays(self.requestMemory.buf,self.requestLayout)
+        slotSize = layoutSize(self.resultLayout)
+        self.results = [sharedArrays(self.resultMemory.buf[slot*slotSize:(slot+1)*slotSize],self.resultLayout)
+                        for slot in range(FieldMapWorker.SLOT_COUNT)]
+        self.request['header'][:] = (0,np.nan,gridSizeX,gridSizeY,1)
+
+        self.lock           = context.Lock()
+        self.slotState      = context.RawArray('i',[0,1,2,0])  # back, ready, front slot, whether 'ready' is new
+        self.requestEvent   = context.Event()
+        self.stopEvent      = context.Event()
+        self.requestSequence = 0
+        self.parentPid      = os.getpid()
+        self.process = context.Process(target=self.run,name="MRSM_FieldMapWorker",daemon=True)
+
+    def start(self) -> None:
+        self.process.start()
+
+    def isAlive(self) -> bool:
+        return self.process.is_alive()
+
+    def attach(self,sensorGeometry,levels,mapCount,gridSizeX,gridSizeY) -> bool:
+        """
+        a worker started beforehand (see NOTES) takes the geometry of the magnetometer for its requests;
+        False if it was started for another holder or other maps
+        """
+        if (len(sensorGeometry),mapCount,gridSizeX,gridSizeY)!=(len(self.sensorGeometry),self.mapCount,self.gridSizeX,self.gridSizeY):
+            return False
+        if not np.array_equal(np.asarray(levels,dtype=float),self.levels):
+            return False
+        self.sensorGeometry = sensorGeometry
+        return True
+
+    def finalize(self) -> None:
+        self.stopEvent.set()
+        self.requestEvent.set()     # wake up the worker so that it can quit
+        if self.process.is_alive():
+            self.process.join(timeout=1.0)
+            if self.process.is_alive():
+                self.process.terminate()
+        # the views have to be released before the blocks are closed
+        self.request, self.results = None, None
+        for memory in (self.requestMemory,self.resultMemory):
+            memory.close()
+            memory.unlink()
+
+    # ---- Qt thread -------------------------------------------------------
+
+    def submit(self,componentValues,fieldViews,fieldMapDetail: FieldMapDetail=None) -> None:
+        """
+        requests the maps of the 'fieldViews' (one per map) of the (sensors x 3) 'componentValues',
+        in 'fieldMapDetail' (default: the finest), replaces a pending request
+        """
+        gridSizeX, gridSizeY, isolineLevelStep = ((self.gridSizeX,self.gridSizeY,1) if fieldMapDetail is None else
+                                                  (min(fieldMapDetail.gridSize,self.gridSizeX),min(fieldMapDetail.gridSize,self.gridSizeY),
+                                                   fieldMapDetail.isolineLevelStep))
+        with self.lock:
+            self.request['values'][:] = componentValues
+            self.request['fieldViews'][:] = [fieldView.value for fieldView in fieldViews]
+            self.request['xy'][:] = self.sensorGeometry.xy
+            self.requestSequence += 1
+            self.request['header'][:] = (self.requestSequence,self.sensorGeometry.holderRotationAngleDeg,
+                                         gridSizeX,gridSizeY,isolineLevelStep)
+        self.requestEvent.set()
+
+    def latestFieldMaps(self):
+        """
+        [FieldMap] (in the order of the requested views) of the newest result not shown yet, or None;
+        the arrays are views of the shared memory, valid until the next call
+        """
+        with self.lock:
+            if not self.slotState[FieldMapWorker.IS_READY_NEW]:
+                return None
+            self.slotState[FieldMapWorker.IS_READY_NEW] = 0
+            if self.results[self.slotState[FieldMapWorker.READY]]['header'][1]!=self.sensorGeometry.holderRotationAngleDeg:
+                return None     # computed for the former holder rotation, the shown maps stay valid
+            self.slotState[FieldMapWorker.FRONT], self.slotState[FieldMapWorker.READY] = (
+                                self.slotState[FieldMapWorker.READY], self.slotState[FieldMapWorker.FRONT])
+            result = self.results[self.slotState[FieldMapWorker.FRONT]]
+
+        header = result['header']
+        extent = tuple(header[2:6])
+        gridSizeX, gridSizeY, quiverSizeX, quiverSizeY = header[6:10].astype(int)
+        self.computeSec = header[10]
+        fieldMaps = []
+        for m in range(self.mapCount):
+            counts = result['segmentCounts'][m]
+            ends = np.cumsum(counts)
+            isolines = [(levelIndex,result['segments'][m,end-count:end])
+                        for levelIndex,(count,end) in enumerate(zip(counts,ends)) if count>0]
+            fieldMaps.append(FieldMap(result['values'][m],extent,result['gridValues'][m,0:gridSizeY,0:gridSizeX],isolines,
+                                      FieldView(result['fieldViews'][m]),
+                                      tuple(result['vectors'][m,:,0:quiverSizeY,0:quiverSizeX]) if result['hasVectors'][m] else None))
+        return fieldMaps
+
+    # ---- worker process --------------------------------------------------
+
+    def run(self) -> None:
+        debug_message("Field map worker process started")
+        # (the geometry is a copy of the one of the Qt thread, its positions are taken from the requests)
+        fieldInterpolator = FieldInterpolator(self.sensorGeometry,self.gridSizeX,self.gridSizeY)
+        lastSequence = 0
+        while True:
+            if not self.requestEvent.wait(FieldMapWorker.PARENT_CHECK_PERIOD_SEC):
+                if os.getppid()!=self.parentPid:
+                    break   # the application has quit
+                continue
+            if self.stopEvent.is_set():
+                break
+            self.requestEvent.clear()
+            with self.lock:
+                sequence, holderRotationAngleDeg, gridSizeX, gridSizeY, isolineLevelStep = self.request['header']
+                self.sensorGeometry.xy[:] = self.request['xy']
+                componentValues = self.request['values'].copy()
+                fieldViews = [FieldView(value) for value in self.request['fieldViews']]
+            if sequence==lastSequence:
+                continue
+            lastSequence = sequence
+            self.sensorGeometry.holderRotationAngleDeg = holderRotationAngleDeg
+            fieldInterpolator.setGridSize(int(gridSizeX),int(gridSizeY))
+
+            try:
+                startTime = time.perf_counter()
+                with self.lock:
+                    result = self.results[self.slotState[FieldMapWorker.BACK]]
+                self.writeResult(result,fieldInterpolator.fieldMaps(componentValues,self.levels,fieldViews,int(isolineLevelStep)),fieldViews)
+                result['header'][0:2] = (sequence,holderRotationAngleDeg)
+                result['header'][10] = time.perf_counter()-startTime
+            except Exception as e:
+                error_message(f"Field map worker: {e}")
+                continue
+
+            with self.lock:
+                self.slotState[FieldMapWorker.BACK], self.slotState[FieldMapWorker.READY] = (
+                                self.slotState[FieldMapWorker.READY], self.slotState[FieldMapWorker.BACK])
+                self.slotState[FieldMapWorker.IS_READY_NEW] = 1
+        debug_message("Field map worker process finished")
+
+    def writeResult(self,result,fieldMaps,fieldViews) -> None:
+        for m,fieldView in enumerate(fieldViews):
+            fieldMap = fieldMaps[fieldView]
+            gridSizeY, gridSizeX = fieldMap.gridValues.shape
+            result['fieldViews'][m] = fieldView.value
+            result['values'][m] = fieldMap.values
+            result['gridValues'][m,0:gridSizeY,0:gridSizeX] = fieldMap.gridValues
+            counts = result['segmentCounts'][m]
+            counts[:] = 0
+            offset = 0
+            for levelIndex,segments in fieldMap.isolines:
+                count = min(len(segments),FieldMapWorker.MAX_SEGMENT_COUNT-offset)
+                result['segments'][m,offset:offset+count] = segments[:count]
+                counts[levelIndex] = count
+                offset += count
+            result['hasVectors'][m] = fieldMap.vectors is not None
+            if fieldMap.vectors is not None:
+                quiverSizeY, quiverSizeX = fieldMap.vectors[0].shape
+                result['vectors'][m,:,0:quiverSizeY,0:quiverSizeX] = fieldMap.vectors
+        result['header'][2:6] = fieldMap.extent
+        result['header'][6:8] = (gridSizeX,gridSizeY)
+        if fieldMaps[FieldView.IN_PLANE_MAGNITUDE].vectors is not None:
+            result['header'][8:10] = fieldMaps[FieldView.IN_PLANE_MAGNITUDE].vectors[0].shape[::-1]
@@ -22,6 +22,8 @@ IsDeployedOnRaspberryPi     = True
 IsWaveShareDisplayEmulated  = not IsDeployedOnRaspberryPi
 IsRaspberryPi5Emulated      = not IsDeployedOnRaspberryPi
 IsMagneticSensorEmulated    = not IsDeployedOnRaspberryPi  
+IsI2CBusSimulated           = False  # only if IsMagneticSensorEmulated: the emulated sensors are read 
+                                     # through a simulated SMBus (MRSM_SimulatedSMBus), i.e. using the real I2C decode path
 
 IsQtMultimediaAvailable     = False  # IH240722 I had problems 
                                      # installing QtMultimedia on Raspberry OS,
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+
+#-------------------------------------------------------------------------------
+#
+#      The Magnetic Resonance Scanner Mockup Project
+#
+#
+#      M  R  S  M  _  M a p p i n g S e s s i o n  .  p  y
+#
+#
+#      Last update: 261018
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+#  N O T E S :
+#
+#   A mapping session collects the sweeps stored at the holder positions the
+#   operator steps through (axial position, rotation angle) into one point
+#   cloud in the Scanner coordinates (x, y of the sensors, z the axial
+#   position; the field in HORIZONTAL, VERTICAL, AXIAL components, so that
+#   the sweeps of different rotations can be merged). A sweep stored again at
+#   the same position replaces the former one.
+#
+#   The point cloud is interpolated to a regular volume grid (x, y over the
+#   bore disk of the outermost sensors, z over the axial range of the holder).
+#   The points lie in transversal planes, one per axial position, so the
+#   volume is built in two steps:
+#
+#       plane   the points of one axial position (all rotations merged; points
+#               measured twice are averaged) are interpolated to the (x, y)
+#               grid, as in MRSM_FieldInterpolation (Clough-Tocher, NaN outside
+#               the convex hull of the points)
+#       volume  every z of the grid is interpolated linearly between the two
+#               nearest planes; outside the measured axial range it is NaN,
+#               except within half of the axial grid spacing of a plane
+#
+#   A new sweep re-interpolates only its own plane, the volume (a weighted
+#   sum of two planes per z) is cheap, so the volume is up to date after
+#   every stored position.
+#
+#   The slices of the volume are taken along any axis, at the grid point
+#   nearest to the position; for the displays the values are those of a
+#   FieldView (a component, |B| or the in-plane magnitude).
+#
+#-------------------------------------------------------------------------------
+
+from enum import Enum
+from time import asctime
+
+import numpy as np
+from scipy.interpolate import CloughTocher2DInterpolator
+
+from MRSM_Utilities import debug_message, error_message
+from MRSM_FieldInterpolation import FieldView
+
+
+class SliceAxis(Enum):
+    """
+    the axis normal to a slice, in the Scanner coordinates
+    """
+    X = 1   # horizontal
+    Y = 2   # vertical
+    Z = 3   # axial
+
+
+def viewValues(componentValues: np.ndarray,fieldView: FieldView) -> np.ndarray:
+    """
+    the values of 'fieldView' from the (... x 3) 'componentValues' (HORIZONTAL, VERTICAL, AXIAL)
+    """
+    if fieldView==FieldView.MAGNITUDE:
+        return np.sqrt((componentValues**2).sum(axis=-1))
+    if fieldView==FieldView.IN_PLANE_MAGNITUDE:
+        return np.hypot(componentValues[...,0],componentValues[...,1])
+    return componentValues[...,fieldView.value-1]
+
+
+class MappingSession():
+    """
+    Sweeps of several holder positions, merged into a point cloud and interpolated to a volume, see NOTES
+    """
+
+    GRID_SIZE_XY            = 41
+    AXIAL_GRID_SPACING_MM   = 5.0
+    POINT_RESOLUTION_MM     = 0.01      # points nearer than this are the same point
+
+    def __init__(self,radiusMm,axialRangeMm,gridSizeXY=GRID_SIZE_XY,axialGridSpacingMm=AXIAL_GRID_SPACING_MM) -> None:
+        self.radiusMm       = radiusMm
+        self.axialRangeMm   = axialRangeMm
+        self.startTime      = asctime()
+        self.gridX          = np.linspace(-radiusMm,radiusMm,gridSizeXY)
+        self.gridY          = np.linspace(-radiusMm,radiusMm,gridSizeXY)
+        self.gridZ          = np.arange(axialRangeMm[0],axialRangeMm[1]+axialGridSpacingMm/2,axialGridSpacingMm)
+        self.axialGridSpacingMm = axialGridSpacingMm
+        self.planeGridXY    = np.column_stack([g.ravel() for g in np.meshgrid(self.gridX,self.gridY)])
+
+        self.sweeps         = {}    # (axial position, rotation angle) -> (xy (points x 2), field (points x 3))
+        self.planes         = {}    # axial position -> (gy x gx x 3) interpolated plane
+        self.volume         = np.full((len(self.gridZ),len(self.gridY),len(self.gridX),3),np.nan)
+        self.volumeUpdateCount = 0
+
+    def __len__(self):
+        return len(self.sweeps)
+
+    def pointCount(self) -> int:
+        return sum(len(xy) for xy,_ in self.sweeps.values())
+
+    def axialPositions(self) -> list:
+        return sorted(self.planes)
+
+    def addSweep(self,axialPositionMm,rotationAngleDeg,xy: np.ndarray,field: np.ndarray) -> None:
+        """
+        adds the (sensors x 3) 'field' (Scanner coordinates, NaN for missing sensors) at the
+        sensor positions 'xy' [mm] of the holder position, and updates the volume
+        """
+        field = np.asarray(field,dtype=float)
+        isAvailable = ~np.isnan(field).any(axis=1)
+        axialPositionMm = float(axialPositionMm)
+        self.sweeps[(axialPositionMm,float(rotationAngleDeg))] = (np.array(xy,dtype=float)[isAvailable],field[isAvailable].copy())
+        self.updatePlane(axialPositionMm)
+        self.updateVolume()
+        debug_message(f"Mapping session: {len(self)} positions, {self.pointCount()} points")
+
+    def points(self) -> tuple:
+        """
+        the point cloud: (points x 3) positions x, y, z [mm] and (points x 3) field
+        """
+        if not self.sweeps:
+            return np.zeros((0,3)), np.zeros((0,3))
+        positions = [np.column_stack((xy,np.full(len(xy),z))) for (z,_),(xy,_) in self.sweeps.items()]
+        return np.concatenate(positions), np.concatenate([field for _,field in self.sweeps.values()])
+
+    def updatePlane(self,axialPositionMm) -> None:
+        sweeps = [sweep for (z,_),sweep in self.sweeps.items() if z==axialPositionMm]
+        xy = np.concatenate([xy for xy,_ in sweeps])
+        field = np.concatenate([field for _,field in sweeps])
+
+        # the points measured by several sweeps (e.g. in the holder center) are averaged
+        keys = np.round(xy/MappingSession.POINT_RESOLUTION_MM).astype(np.int64)
+        keys, pointIndex = np.unique(keys,axis=0,return_inverse=True)
+        pointIndex = pointIndex.ravel()
+        counts = np.bincount(pointIndex,minlength=len(keys))
+        xy = np.column_stack([np.bincount(pointIndex,xy[:,k],len(keys)) for k in range(2)])/counts[:,None]
+        field = np.column_stack([np.bincount(pointIndex,field[:,k],len(keys)) for k in range(3)])/counts[:,None]
+
+        try:
+            plane = CloughTocher2DInterpolator(xy,field,fill_value=np.nan)(self.planeGridXY)
+        except Exception:
+            # too few (or collinear) points to interpolate
+            plane = np.full((len(self.planeGridXY),3),np.nan)
+        self.planes[axialPositionMm] = plane.reshape(len(self.gridY),len(self.gridX),3)
+
+    def updateVolume(self) -> None:
+        z = np.array(self.axialPositions())
+        planes = np.stack([self.planes[position] for position in z])
+        self.volume[:] = np.nan
+
+        # between the planes: linear interpolation of the two nearest ones
+        isInside = (self.gridZ>=z[0]) & (self.gridZ<=z[-1])
+        if len(z)>1 and isInside.any():
+            upper = np.clip(np.searchsorted(z,self.gridZ[isInside],side='right'),1,len(z)-1)
+            t = ((self.gridZ[isInside]-z[upper-1])/(z[upper]-z[upper-1]))[:,None,None,None]
+            self.volume[isInside] = (1-t)*planes[upper-1]+t*planes[upper]
+
+        # near the ends (or a single plane): the nearest plane
+        nearest = np.abs(self.gridZ[:,None]-z[None,:]).argmin(axis=1)
+        isNear = ~(isInside & (len(z)>1)) & (np.abs(self.gridZ-z[nearest])<=self.axialGridSpacingMm/2)
+        self.volume[isNear] = planes[nearest[isNear]]
+        self.volumeUpdateCount += 1
+
+    def slice(self,sliceAxis: SliceAxis,positionMm,fieldView: FieldView) -> tuple:
+        """
+        (extent, values) of the slice of the volume normal to 'sliceAxis' nearest to 'positionMm':
+        'values' is (rows x columns), rows along the vertical axis of the slice, 'extent'
+        (x0, x1, y0, y1) the range of its horizontal and vertical axis [mm]:
+        Z: x, y (the transversal plane);  X: z, y;  Y: z, x
+        """
+        grids = {SliceAxis.X: self.gridX, SliceAxis.Y: self.gridY, SliceAxis.Z: self.gridZ}
+        index = int(np.abs(grids[sliceAxis]-positionMm).argmin())
+        if sliceAxis==SliceAxis.Z:
+            values = self.volume[index]
+            extent = (self.gridX[0],self.gridX[-1],self.gridY[0],self.gridY[-1])
+        elif sliceAxis==SliceAxis.X:
+            values = self.volume[:,:,index].transpose(1,0,2)
+            extent = (self.gridZ[0],self.gridZ[-1],self.gridY[0],self.gridY[-1])
+        else:
+            values = self.volume[:,index,:].transpose(1,0,2)
+            extent = (self.gridZ[0],self.gridZ[-1],self.gridX[0],self.gridX[-1])
+        return extent, viewValues(values,fieldView)
+
+    def asDict(self) -> dict:
+        """
+        the sweeps of the session, for the export
+        """
+        return {
+            "sessionStart":     self.startTime,
+            "positionCount":    len(self),
+            "pointCount":       self.pointCount(),
+            "sweeps":           [{"holderAxialPositionMM":    z,
+                                  "holderRotationAngleDeg":   angle,
+                                  "x":                        xy[:,0].tolist(),
+                                  "y":                        xy[:,1].tolist(),
+                                  "field_Horizontal":         field[:,0].tolist(),
+                                  "field_Vertical":           field[:,1].tolist(),
+                                  "field_Axial":              field[:,2].tolist()}
+                                 for (z,angle),(xy,field) in sorted(self.sweeps.items())],
+        }
+
+    def saveVolume(self,filename) -> None:
+        """
+        the volume with its grid, as a NumPy .npz file
+        """
+        np.savez_compressed(filename,gridX=self.gridX,gridY=self.gridY,gridZ=self.gridZ,volume=self.volume)
@@ -69,6 +69,7 @@ Demo application to run on the Raspberry Pi MRSM controller:  Display presentati
 
 from enum import Enum
 from functools import partial, cmp_to_key
+from math import isnan
 from typing import Any
 
 from MRSM_Globals import (
@@ -82,7 +83,7 @@ from MRSM_Globals import (
 )
 
 from MRSM_Globals import __version__
-from MRSM_Utilities import error_message, debug_message
+from MRSM_Utilities import error_message, debug_message, DeadlineMonitor, FrameBudgetGovernor
 
 from PyQt6.QtGui import (
     QBrush,
@@ -143,6 +144,9 @@ if IsQtMultimediaAvailable:
 
 
 from MRSM_Controller import MRSM_Controller,MRSM_Magnetometer
+from MRSM_FaultInjection import FaultInjector
+from MRSM_FieldModel import CylindricalHarmonicModel
+from MRSM_FieldImage import VolumeSliceCanvas
 from MRSM_ImageBase import ImageBase, Organ, ImagingPlane
 from MRSM_Stylesheet import MRSM_Stylesheet
 from MRSM_TextContent import Language, LanguageAbbrev, MRSM_Texts
@@ -1175,6 +1179,9 @@ class MRSM_Presentation():
         IDLE_INACTIVITY_DURATION_SEC = int(1e6)  # IH241106 disable idle timer  (should be sys.maxint) 
                                                  # IH241108 int is here because 1e4 would default to float
         STATUS_UPDATE_PERIOD_MSEC = 1000
+        # the refresh is stretched to hold the CPU share, see FrameBudgetGovernor
+        FRAME_BUDGET_MSEC         = 50
+        MAX_CPU_SHARE             = 0.2
 
         class TemperatureReading(QWidget):
             def __init__(self, sensorLabel: str) -> None:                
@@ -1229,6 +1236,9 @@ class MRSM_Presentation():
                 self.lReadingValueX.setText(str(readingX))
                 self.lReadingValueY.setText(str(readingY))
                 self.lReadingValueZ.setText(str(readingZ))
+                if isinstance(readingX,str):    # '---', the sensor is missing
+                    self.hbBarAll.setValue(0.0)
+                    return
                 self.hbBarAll.setValue(
                     (float(readingX)*float(readingX) +
                      float(readingY)*float(readingY) +
@@ -1397,10 +1407,19 @@ class MRSM_Presentation():
             self.groupLayout_Others.setContentsMargins(20,10,20,10)
             self.layoutServiceWorkdesk.addWidget(self.groupBox_Others)
 
+            self.lAcquisitionStatistics = QLabel("---")
+            self.groupLayout_Others.addWidget(self.lAcquisitionStatistics)
+
+            # status updates which missed their deadline (this panel and the Magnetometer panel)
+            self.lDeadlineStatistics = QLabel("---")
+            self.groupLayout_Others.addWidget(self.lDeadlineStatistics)
+
 
             #IH241108 added
             self.status_update_timer = QTimer()
             self.status_update_timer.timeout.connect(self.on_status_update_timeout)
+            self.deadlineMonitor = DeadlineMonitor(self.STATUS_UPDATE_PERIOD_MSEC/1000)
+            self.frameGovernor = FrameBudgetGovernor(self.STATUS_UPDATE_PERIOD_MSEC/1000,self.FRAME_BUDGET_MSEC/1000,self.MAX_CPU_SHARE)
             
             self.MgM_update_all_readings()
             self.deactivate()
@@ -1410,18 +1429,24 @@ class MRSM_Presentation():
                 w.show()      
             self.parent.show()
             self.reset_idle_timer()  
+            self.parent.hardwareController.magnetometerAcquisition.resume()
             self.status_update_timer.start(self.STATUS_UPDATE_PERIOD_MSEC)
     
         def deactivate(self):
             for w in self.serviceWidgets:
                 w.hide()
             self.status_update_timer.stop()                
+            self.deadlineMonitor.pause()
+            self.frameGovernor.pause()
+            self.parent.hardwareController.magnetometerAcquisition.pause()
 
         def reset_idle_timer(self):
             self.parent.idle_timer.stop()
             self.parent.idle_timer.start(self.IDLE_INACTIVITY_DURATION_SEC*1000)
 
         def on_status_update_timeout(self):
+            self.deadlineMonitor.begin()
+            self.frameGovernor.begin()
             #currentAllValuesX = 
             # self.parent.hardwareController.magnetometer.getReading(
             #    self.MgmSensorReading1.mbSensorSelector.currentText,    
@@ -1429,30 +1454,62 @@ class MRSM_Presentation():
             # debug_message(f"Service Status Update:") 
             # debug_message(  f'TEMPERATURE[°C], (sensor 4): {self.parent.hardwareController.magnetometer.getTemperatureReadingDegC("4"):.2f}')
             self.MgM_update_all_readings()    
-            self.status_update_timer.start(self.STATUS_UPDATE_PERIOD_MSEC)   
+            self.frameGovernor.mark('readings')
+            self.frameGovernor.end()
+            self.deadlineMonitor.end()
+            # the next tick one (adapted) period after the begin of this one
+            intervalMsec = self.frameGovernor.nextIntervalMsec()
+            self.deadlineMonitor.periodSec = intervalMsec/1000
+            self.status_update_timer.start(intervalMsec)   
 
         def MgM_update_all_readings(self):
+
+            # the readings are sampled by the acquisition thread, here we only take the latest sweep
+            frame = self.parent.hardwareController.magnetometerAcquisition.latestFrame()
+            if frame is None:
+                return
+            sensorIndex = {s: i for i,s in enumerate(frame.sensorNames)}
+            isInFrame = frame.availableMask()
                     
             for msr in [
                     self.MgmSensorReading1,
                     self.MgmSensorReading2,
                     self.MgmSensorReading3]:
                 
-                msr.updateReading(
-                    self.parent.hardwareController.magnetometer.getReading(
-                    msr.mbSensorSelector.currentText(),    
-                    MRSM_Magnetometer.MgMAxis.X),
-                    self.parent.hardwareController.magnetometer.getReading(
-                    msr.mbSensorSelector.currentText(),    
-                    MRSM_Magnetometer.MgMAxis.Y),            
-                    self.parent.hardwareController.magnetometer.getReading(
-                    msr.mbSensorSelector.currentText(),    
-                    MRSM_Magnetometer.MgMAxis.Z),
-                    )
-            for sensorName in self.parent.hardwareController.magnetometer.availableSensors:
-                self.tempReadings[sensorName].updateReading(
-                    self.parent.hardwareController.magnetometer.getTemperatureReadingDegC(sensorName)
-                )
+                i = sensorIndex.get(msr.mbSensorSelector.currentText())
+                if i is None or not isInFrame[i]:
+                    msr.updateReading('---','---','---')    # the sensor is (currently) missing
+                    continue
+                readingX, readingY, readingZ = frame.rawReadings()[i].astype(int)
+                msr.updateReading(readingX, readingY, readingZ)
+            temperatures = frame.temperatures()
+            availableSensors = self.parent.hardwareController.magnetometer.availableSensors
+            for sensorName in self.tempReadings:
+                self.tempReadings[sensorName].setEnabled(sensorName in availableSensors)
+            for sensorName in availableSensors:
+                if not isnan(temperatures[sensorIndex[sensorName]]):   # NaN if not read yet
+                    self.tempReadings[sensorName].updateReading(temperatures[sensorIndex[sensorName]])
+
+            # achieved sweep rate and jitter of the acquisition channels
+            statisticsText = []
+            for channel,(rateHz,jitterSec) in self.parent.hardwareController.magnetometerAcquisition.scheduler.getChannelStatistics().items():
+                if rateHz is None:
+                    statisticsText += [f'{channel.name}: ---']
+                else:
+                    statisticsText += [f'{channel.name}: {rateHz:.2f} Hz, jitter {jitterSec*1000:.1f} ms']
+            self.lAcquisitionStatistics.setText('\n'.join(statisticsText))
+
+            deadlineText = [f'Deadline {self.deadlineMonitor.deadlineSec*1000:.0f} ms',
+                            f'Service: {self.deadlineMonitor.summary()}',
+                            f'   {self.frameGovernor.summary()}']
+            if hasattr(self.parent,'showMagnetometer'):
+                deadlineText += [f'Magnetometer: {self.parent.showMagnetometer.deadlineMonitor.summary()}',
+                                 f'   {self.parent.showMagnetometer.frameGovernor.summary()}']
+            signalEmulator = self.parent.hardwareController.magnetometer.signalEmulator
+            if isinstance(signalEmulator,FaultInjector):
+                deadlineText += [f'Injected: {signalEmulator.dropoutCount} dropouts, {signalEmulator.stallCount} stalls '
+                                 f'in {signalEmulator.transactionCount} transactions']
+            self.lDeadlineStatistics.setText('\n'.join(deadlineText))
 
         def on_bAudioPlaytest_clicked(self):
             self.parent.hardwareController.audioPlayer.playTest(hasToplayIndefinitely=self.playTestInfinite)
@@ -1490,6 +1547,10 @@ class MRSM_Presentation():
         IDLE_INACTIVITY_DURATION_SEC = int(1e6)  # IH241106 disable idle timer  (should be sys.maxint) 
                                                  # IH241108 int is here because 1e4 would default to float
         STATUS_UPDATE_PERIOD_MSEC = 200
+        # the refresh is stretched and the field maps made coarser to hold these, see FrameBudgetGovernor
+        FRAME_BUDGET_MSEC         = 60
+        MAX_CPU_SHARE             = 0.5
+        MAX_STATUS_UPDATE_PERIOD_MSEC = 1000
 
         def __init__(self,parent) -> None:
 
@@ -1512,21 +1573,36 @@ class MRSM_Presentation():
             #IH241108 added
             #IH241108 added optionalization
             if self.parent.hasToUseMagFieldVisualization:
-                from MRSM_FieldVisualizer import FieldPlotCanvas
+                if self.parent.hasToUseLightweightRenderer:
+                    from MRSM_FieldImage import FieldImageCanvas as FieldPlotCanvas
+                else:
+                    from MRSM_FieldVisualizer import FieldPlotCanvas
+                from MRSM_FieldInterpolation import FieldInterpolator, FieldView, FIELD_MAP_DETAILS
+                from MRSM_FieldImage import FieldColorbar
+
+                # all canvases show the same sensors, they share the interpolation operators
+                sensorGeometry = self.parent.hardwareController.magnetometer.MgMGeometry
+                self.fieldInterpolator = FieldInterpolator(sensorGeometry,FieldPlotCanvas.gridSizeX,FieldPlotCanvas.gridSizeY)
 
-                self.fieldPlotCanvas_Horizontal = FieldPlotCanvas(self.parent.hardwareController.magnetometer.MgMGeometry,
+                # a click on a canvas switches to its next view (|B|, in-plane magnitude and vectors, ...)
+                self.fieldPlotCanvas_Horizontal = FieldPlotCanvas(sensorGeometry,
                                                     figureHeight=200,figureWidth=220,dpi=100,title='HORIZONTAL',
-                                                    hasToIncludeColorbar=False)
-                self.fieldPlotCanvas_Vertical   = FieldPlotCanvas(self.parent.hardwareController.magnetometer.MgMGeometry,
+                                                    hasToIncludeColorbar=False,fieldInterpolator=self.fieldInterpolator,
+                                                    fieldView=FieldView.HORIZONTAL)
+                self.fieldPlotCanvas_Vertical   = FieldPlotCanvas(sensorGeometry,
                                                     figureHeight=200,figureWidth=220,dpi=100,title='VERTICAL',
-                                                    hasToIncludeColorbar=False)
-                self.fieldPlotCanvas_Axial      = FieldPlotCanvas(self.parent.hardwareController.magnetometer.MgMGeometry,
+                                                    hasToIncludeColorbar=False,fieldInterpolator=self.fieldInterpolator,
+                                                    fieldView=FieldView.VERTICAL)
+                self.fieldPlotCanvas_Axial      = FieldPlotCanvas(sensorGeometry,
                                                     figureHeight=200,figureWidth=220,dpi=100,title='AXIAL',
-                                                    hasToIncludeColorbar=False)
-                #IH241114 HACK we add another canvas just to show the colorbar
-                self.fieldPlotCanvas_Colorbar    = FieldPlotCanvas(self.parent.hardwareController.magnetometer.MgMGeometry,
-                                                    figureHeight=200,figureWidth=10,dpi=100,
-                                                    hasToIncludeColorbar=True)
+                                                    hasToIncludeColorbar=False,fieldInterpolator=self.fieldInterpolator,
+                                                    fieldView=FieldView.AXIAL)
+                self.fieldPlotCanvases = [self.fieldPlotCanvas_Horizontal,self.fieldPlotCanvas_Vertical,self.fieldPlotCanvas_Axial]
+                # lowered and raised again by the frame-budget governor
+                self.fieldMapDetails = FIELD_MAP_DETAILS
+                self.fieldMapDetail = self.fieldMapDetails[0]
+                # the levels are fixed, the colorbar is rendered once
+                self.fieldPlotCanvas_Colorbar    = FieldColorbar(self.fieldPlotCanvas_Horizontal.levels)
 
                 #IH241113 TODO adapt grid coordinates for RPI display
                 self.grid.addWidget(self.fieldPlotCanvas_Horizontal,    0,  3,      5, 7) 
@@ -1540,6 +1616,27 @@ class MRSM_Presentation():
                 self.serviceMagnetometerWidgets += [self.fieldPlotCanvas_Axial]
                 self.serviceMagnetometerWidgets += [self.fieldPlotCanvas_Colorbar]
 
+                # the field maps are computed in a worker process, preferably the one forked by MRSM_Demo
+                #  before any thread was started (see MRSM_FieldWorker)
+                self.fieldMapWorker = None
+                if self.parent.hasToUseFieldMapWorker:
+                    from MRSM_FieldWorker import FieldMapWorker
+                    fieldMapWorker, self.parent.fieldMapWorker = self.parent.fieldMapWorker, None   # owned by the panel now
+                    if fieldMapWorker is not None and not fieldMapWorker.attach(sensorGeometry,self.fieldPlotCanvas_Horizontal.levels,
+                                                    len(self.fieldPlotCanvases),FieldPlotCanvas.gridSizeX,FieldPlotCanvas.gridSizeY):
+                        error_message('The field map worker does not fit the holder or the field maps, it is started again')
+                        fieldMapWorker.finalize()
+                        fieldMapWorker = None
+                    try:
+                        if fieldMapWorker is None:
+                            # forked with the GUI threads running, see MRSM_FieldWorker
+                            fieldMapWorker = FieldMapWorker(sensorGeometry,self.fieldPlotCanvas_Horizontal.levels,
+                                                    len(self.fieldPlotCanvases),FieldPlotCanvas.gridSizeX,FieldPlotCanvas.gridSizeY)
+                            fieldMapWorker.start()
+                        self.fieldMapWorker = fieldMapWorker
+                    except (ValueError,OSError) as e:
+                        error_message(f'Field map worker not available ({e}), the field maps are computed in the GUI thread')
+
 
                 self.plotLabel1 = QLabel("Components of the B<sub>0</sub> in the transversal plane (in relative units, cranial view)",
                                         self.parent.MRSM_Window,alignment=Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignTop)
@@ -1584,7 +1681,7 @@ class MRSM_Presentation():
             self.holderAxialPositionSpinBox = QSpinBox(parent=self.parent.MRSM_Window,alignment=Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignCenter)
             self.holderAxialPositionSpinBox.move(holderAxialPositionSpinBox_x,holderAxialPositionSpinBox_y) 
             self.holderAxialPositionSpinBox.resize(spinBox_width,spinBox_height)
-            self.holderAxialPositionSpinBox.setRange(0,150)  # in degrees
+            self.holderAxialPositionSpinBox.setRange(*(int(p) for p in MRSM_Magnetometer.HOLDER_AXIAL_RANGE_MM))  # in millimeters
             self.holderAxialPositionSpinBox.setSingleStep(10) 
             self.holderAxialPositionSpinBox.valueChanged.connect(self.holderAxialPositionSpinBox_valueChanged)
             self.serviceMagnetometerWidgets += [self.holderAxialPositionSpinBox]
@@ -1595,6 +1692,8 @@ class MRSM_Presentation():
             self.holderAxialPositionLabel.resize(spinBox_width,17)
             self.serviceMagnetometerWidgets += [self.holderAxialPositionLabel]
 
+            # the holder position of the replayed sweeps set last (see followReplayedHolderPosition)
+            self.replayedHolderPosition = None
           
             self.bStore = self.parent.MRSM_PushButton(self.parent.lcls('STORE'),self.parent.MRSM_Window)
             self.bStore.move(1315,200) 
@@ -1603,12 +1702,43 @@ class MRSM_Presentation():
             # self.grid.addWidget(self.bStore,0,28,8,10)
             self.serviceMagnetometerWidgets += [self.bStore]
 
-            
+            # status updates which missed their deadline
+            self.deadlineStatisticsLabel = QLabel("---",self.parent.MRSM_Window,alignment=Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignCenter)
+            self.deadlineStatisticsLabel.move(holderAxialPositionSpinBox_x,280)
+            self.deadlineStatisticsLabel.resize(spinBox_width,36)
+            self.deadlineStatisticsLabel.setWordWrap(True)
+            self.serviceMagnetometerWidgets += [self.deadlineStatisticsLabel]
+
+            # homogeneity of the cylindrical-harmonic model fitted to every sweep
+            self.fieldModel = CylindricalHarmonicModel(self.parent.hardwareController.magnetometer.MgMGeometry)
+            self.homogeneityLabel = QLabel("---",self.parent.MRSM_Window,alignment=Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignTop)
+            self.homogeneityLabel.move(5,40)
+            self.homogeneityLabel.resize(140,60)
+            self.homogeneityLabel.setWordWrap(True)
+            self.serviceMagnetometerWidgets += [self.homogeneityLabel]
+
+            # mapping session: while MAP is on, STORE adds the sweep at the holder position to the bore map,
+            # the slice view shows the map assembled so far (a click switches the slice axis)
+            self.bMapping = self.parent.MRSM_PushButton(self.parent.lcls('MAP'),self.parent.MRSM_Window)
+            self.bMapping.move(25,105)
+            self.bMapping.setCheckable(True)
+            self.bMapping.toggled.connect(self.bMapping_toggled)
+            self.bMapping.setObjectName("bMapping")  # this is for stylesheet reference
+            self.serviceMagnetometerWidgets += [self.bMapping]
+
+            self.volumeSliceCanvas = VolumeSliceCanvas(parent=self.parent.MRSM_Window)
+            self.volumeSliceCanvas.move(5,165)
+            self.volumeSliceCanvas.resize(140,150)
+            self.serviceMagnetometerWidgets += [self.volumeSliceCanvas]
 
 
             #IH241108 added
             self.status_update_timer = QTimer()
             self.status_update_timer.timeout.connect(self.on_status_update_timeout)
+            self.deadlineMonitor = DeadlineMonitor(self.STATUS_UPDATE_PERIOD_MSEC/1000)
+            self.frameGovernor = FrameBudgetGovernor(self.STATUS_UPDATE_PERIOD_MSEC/1000,self.FRAME_BUDGET_MSEC/1000,self.MAX_CPU_SHARE,
+                                    self.MAX_STATUS_UPDATE_PERIOD_MSEC/1000,
+                                    len(self.fieldMapDetails) if self.parent.hasToUseMagFieldVisualization else 1)
             
             self.deactivate()
 
@@ -1619,9 +1749,19 @@ class MRSM_Presentation():
         def holderAxialPositionSpinBox_valueChanged(self,value):
             self.setHolderAxialPosition(value)
 
+        def bMapping_toggled(self,isChecked):
+            magnetometer = self.parent.hardwareController.magnetometer
+            if isChecked:
+                self.volumeSliceCanvas.setMappingSession(magnetometer.startMappingSession())
+            else:
+                magnetometer.stopMappingSession()
+                self.volumeSliceCanvas.setMappingSession(None)
+
         def bStore_clicked(self):
+            magnetometer = self.parent.hardwareController.magnetometer
             try:
-                self.parent.hardwareController.magnetometer.storeCurrentReadings()
+                magnetometer.storeCurrentReadings(
+                    self.parent.hardwareController.magnetometerAcquisition.latestFrame())
             except JSONDataExporter.FileExportException as e:                
                 mDialog = self.parent.MessageDialog(
                     messageText=f'Cannot write:  <p style="font-family: Courier ">{e.filename}</p>',
@@ -1630,6 +1770,10 @@ class MRSM_Presentation():
                 if mDialog.exec():  # IH241120 this could be simplified, but is ready for future modification
                     pass
             else:
+                if magnetometer.mappingSession is not None:
+                    # no dialog, the operator steps on to the next position
+                    self.volumeSliceCanvas.updateSlice()
+                    return
                 mDialog = self.parent.MessageDialog(
                     messageText=f'Stored: <p style="font-family: Courier ">{self.parent.hardwareController.magnetometer.dataExporter.dirfilename}</p>',
                     dialogObjectName="messageDialogWriteOK",
@@ -1646,33 +1790,89 @@ class MRSM_Presentation():
                 w.show()      
             self.parent.show()
             self.reset_idle_timer()  
+            self.parent.hardwareController.magnetometerAcquisition.resume()
             self.status_update_timer.start(self.STATUS_UPDATE_PERIOD_MSEC)
     
         def deactivate(self):
             for w in self.serviceMagnetometerWidgets:
                 w.hide()
             self.status_update_timer.stop()                
+            self.deadlineMonitor.pause()
+            self.frameGovernor.pause()
+            self.parent.hardwareController.magnetometerAcquisition.pause()
 
         def reset_idle_timer(self):
             self.parent.idle_timer.stop()
             self.parent.idle_timer.start(self.IDLE_INACTIVITY_DURATION_SEC*1000)
 
         def on_status_update_timeout(self):
+            self.deadlineMonitor.begin()
+            self.frameGovernor.begin()
+            # the latest sweep of the acquisition thread is shared by the model and all canvases,
+            # aligned to one instant, so that they show a snapshot of a changing field
+            magnetometer = self.parent.hardwareController.magnetometer
+            frame = self.parent.hardwareController.magnetometerAcquisition.latestFrame(hasToAlign=True)
+            if frame is not None and frame.holderRotationAngleDeg is not None:
+                self.followReplayedHolderPosition(frame)
+            # all components from one transformation of the sweep (the rows of the frames are those of the geometry)
+            field = None if frame is None else magnetometer.getFieldInScannerCoordinates(frame)
+            self.frameGovernor.mark('acquisition')
+            if field is not None:
+                coefficients = self.fieldModel.fit(field)
+                self.homogeneityLabel.setText(f'Homogeneity of |B|\n(\u2300 {2*self.fieldModel.referenceRadiusMm:.0f} mm, model)\n'
+                                              f'{self.fieldModel.homogeneityPpm(coefficients):,.0f} ppm')
+            self.frameGovernor.mark('model')
+
             #IH241108 added optionalization
             if self.parent.hasToUseMagFieldVisualization:
-                self.fieldPlotCanvas_Horizontal.UpdatePlot(self.parent.hardwareController.magnetometer
-                    .getNormalizedReadingForAllSensorsInScannerCoordinates(MRSM_Magnetometer.MgMOrientation.HORIZONTAL))
-                self.fieldPlotCanvas_Vertical.UpdatePlot(self.parent.hardwareController.magnetometer
-                    .getNormalizedReadingForAllSensorsInScannerCoordinates(MRSM_Magnetometer.MgMOrientation.VERTICAL))
-                self.fieldPlotCanvas_Axial.UpdatePlot(self.parent.hardwareController.magnetometer
-                    .getNormalizedReadingForAllSensorsInScannerCoordinates(MRSM_Magnetometer.MgMOrientation.AXIAL))
-                
-                self.fieldPlotCanvas_Colorbar.UpdatePlot(self.parent.hardwareController.magnetometer
-                    .getNormalizedReadingForAllSensorsInScannerCoordinates(MRSM_Magnetometer.MgMOrientation.AXIAL))
+                # the canvases painted since the previous tick
+                self.frameGovernor.addCost('draw',sum(getattr(canvas,'paintDurationSec',0.0) for canvas in self.fieldPlotCanvases))
+                if self.fieldMapWorker is not None and not self.fieldMapWorker.isAlive():
+                    error_message(f'Field map worker has quit (exit code {self.fieldMapWorker.process.exitcode}), the field maps are computed in the GUI thread')
+                    self.fieldMapWorker.finalize()
+                    self.fieldMapWorker = None
+                if self.fieldMapWorker is not None:
+                    # the maps of the request of the previous tick
+                    fieldMaps = self.fieldMapWorker.latestFieldMaps()
+                    if fieldMaps is not None:
+                        self.frameGovernor.addCost('interpolation',self.fieldMapWorker.computeSec)
+                        for canvas,fieldMap in zip(self.fieldPlotCanvases,fieldMaps):
+                            canvas.showFieldMap(fieldMap)
+                        self.frameGovernor.mark('draw')
+                if field is not None:
+                    # all views from one interpolation
+                    fieldViews = [canvas.fieldView for canvas in self.fieldPlotCanvases]
+                    if self.fieldMapWorker is not None:
+                        self.fieldMapWorker.submit(field,fieldViews,self.fieldMapDetail)
+                        self.frameGovernor.mark('interpolation')
+                    else:
+                        fieldMaps = self.fieldInterpolator.fieldMaps(field,self.fieldPlotCanvas_Horizontal.levels,fieldViews,
+                                                                     self.fieldMapDetail.isolineLevelStep)
+                        self.frameGovernor.mark('interpolation')
+                        for canvas in self.fieldPlotCanvases:
+                            canvas.showFieldMap(fieldMaps[canvas.fieldView])
+                        self.frameGovernor.mark('draw')
             
             # debug_message(f"Status Update:") 
-            self.status_update_timer.start(self.STATUS_UPDATE_PERIOD_MSEC)            
+            self.frameGovernor.end()
+            if self.parent.hasToUseMagFieldVisualization and self.fieldMapDetail is not self.fieldMapDetails[self.frameGovernor.detailLevel]:
+                self.setFieldMapDetail(self.fieldMapDetails[self.frameGovernor.detailLevel])
+            self.deadlineMonitor.end()
+            self.deadlineStatisticsLabel.setText(f'Missed deadlines: {self.deadlineMonitor.missCount}/{self.deadlineMonitor.tickCount}\n'
+                                                 f'Refresh {self.frameGovernor.periodSec*1000:.0f} ms, detail {self.frameGovernor.detailLevel}')
+            # the next tick one (adapted) period after the begin of this one
+            intervalMsec = self.frameGovernor.nextIntervalMsec()
+            self.deadlineMonitor.periodSec = intervalMsec/1000
+            self.status_update_timer.start(intervalMsec)            
         
+        def setFieldMapDetail(self,fieldMapDetail):
+            """
+            the resolution of the following field maps (with the worker, from its next request)
+            """
+            self.fieldMapDetail = fieldMapDetail
+            self.fieldInterpolator.setGridSize(fieldMapDetail.gridSize,fieldMapDetail.gridSize)
+            for canvas in self.fieldPlotCanvases:
+                canvas.hasToShowIsolineLabels = fieldMapDetail.hasIsolineLabels
 
         def setHolderAxialRotationAngle(self,rotationAngleDeg):
             self.parent.hardwareController.magnetometer.setHolderAxialRotationAngle(rotationAngleDeg)
@@ -1681,11 +1881,34 @@ class MRSM_Presentation():
                 self.fieldPlotCanvas_Horizontal.updateScatteredPointPositions()
                 self.fieldPlotCanvas_Vertical.updateScatteredPointPositions()
                 self.fieldPlotCanvas_Axial.updateScatteredPointPositions()
-                self.fieldPlotCanvas_Colorbar.updateScatteredPointPositions()
          
 
         def setHolderAxialPosition(self,axialPositionMm):
             self.parent.hardwareController.magnetometer.setHolderAxialPosition(axialPositionMm)
+            self.volumeSliceCanvas.setAxialPosition(axialPositionMm)
+
+        def followReplayedHolderPosition(self,frame):
+            """
+            the holder follows the replayed recording; it is set only where the recorded position
+            changes, so that the holder can still be moved by the spin boxes in between
+            """
+            previous = self.replayedHolderPosition
+            self.replayedHolderPosition = (frame.holderRotationAngleDeg,frame.holderAxialPositionMm)
+            if previous is None or frame.holderRotationAngleDeg!=previous[0]:
+                self.showSpinBoxValue(self.holderRotationAngleSpinBox,frame.holderRotationAngleDeg)
+                self.setHolderAxialRotationAngle(frame.holderRotationAngleDeg)
+            if previous is None or frame.holderAxialPositionMm!=previous[1]:
+                self.showSpinBoxValue(self.holderAxialPositionSpinBox,frame.holderAxialPositionMm)
+                self.setHolderAxialPosition(frame.holderAxialPositionMm)
+
+        @staticmethod
+        def showSpinBoxValue(spinBox,value):
+            """
+            shows the (rounded) 'value' without emitting valueChanged, the caller sets the exact value
+            """
+            spinBox.blockSignals(True)
+            spinBox.setValue(round(value))
+            spinBox.blockSignals(False)
            
 
     def ShowFullScreen(self):
@@ -1706,11 +1929,17 @@ class MRSM_Presentation():
             hasToUseMagFieldVisualization: bool=False, 
             hasToUseSeasonalFeatures: bool=False,
             hasToStartWithService: bool=False,
+            hasToUseLightweightRenderer: bool=False,
+            hasToUseFieldMapWorker: bool=True,
+            fieldMapWorker=None,
             ):
         self.language = language
         self.MRSM_Window = QWidget()
         self.hardwareController = hardwareController
         self.hasToUseMagFieldVisualization = hasToUseMagFieldVisualization
+        self.hasToUseLightweightRenderer = hasToUseLightweightRenderer      # the field maps without matplotlib
+        self.hasToUseFieldMapWorker = hasToUseFieldMapWorker                # the field maps computed in another process
+        self.fieldMapWorker = fieldMapWorker    # FieldMapWorker started beforehand (see MRSM_Demo), taken by the magnetometer panel
         self.hasToUseSeasonalFeatures = hasToUseSeasonalFeatures
             
         #   This implementation targets the 
@@ -1746,7 +1975,7 @@ class MRSM_Presentation():
             self.showDescription = self.ShowDescription(self)
         self.showService = self.ShowService(self)
         
-        if self.hasToUseMagFieldVisualization:
+        if self.hasToUseMagFieldVisualization and not self.hasToUseLightweightRenderer:
             from MRSM_FieldVisualizer import FieldPlotCanvas
         self.showMagnetometer = self.ShowMagnetometer(self)        
         
@@ -1820,6 +2049,15 @@ class MRSM_Presentation():
         """
         QApplication.quit()
      
+    def finalize(self):
+        if self.hasToUseMagFieldVisualization and self.showMagnetometer.fieldMapWorker is not None:
+            self.showMagnetometer.fieldMapWorker.finalize()
+            self.showMagnetometer.fieldMapWorker = None
+        if self.fieldMapWorker is not None:
+            # not taken by the panel
+            self.fieldMapWorker.finalize()
+            self.fieldMapWorker = None
+
     def show(self):
         if IsWaveShareDisplayEmulated:
             self.MRSM_Window.show()
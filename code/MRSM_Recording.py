@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+
+#-------------------------------------------------------------------------------
+#
+#      The Magnetic Resonance Scanner Mockup Project
+#
+#
+#      M  R  S  M  _  R e c o r d i n g  .  p  y
+#
+#
+#      Last update: 261018
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+#  N O T E S :
+#
+#   Recording of the raw magnetometer sweeps, and replay of a recording
+#   in place of the signal emulator (at real speed, N times faster, or as
+#   fast as possible), so that field-map problems can be reproduced and the
+#   visualization and export paths profiled without the scanner.
+#
+#   File format (little endian):
+#       8 bytes     b'MRSMREC1'
+#       4 bytes     length of the header
+#       header      JSON: {"MRSM_version": .., "datestamp": .., "sensorNames": [..]}
+#       records     one per sweep, see recordDtype():
+#                       timestamp               float64, wall clock start of the sweep
+#                       holderRotationAngleDeg  float32
+#                       holderAxialPositionMm   float32
+#                       isRead                  uint8 per sensor, 0 if missing in the sweep
+#                       sampleTimesNs           int64 per sensor (time.monotonic_ns)
+#                       registers               8 bytes per sensor, A31301 output registers 0x1C..0x23
+#
+#   The registers are stored before calibration. A temperature which was not
+#   read yet is stored as 25 degC.
+#
+#   On replay, the holder follows the recording: the frames carry the recorded
+#   holder rotation angle and axial position (see MagnetometerFrame), the
+#   Magnetometer panel sets the holder from them in the GUI thread.
+#
+#   As fast as possible, the replay steps to the next recorded sweep when a
+#   sensor's field is read a second time; temperature reads are served from
+#   the current sweep and do not step.
+#
+#   For a throughput benchmark of the decode and field-map path, run
+#       python code/MRSM_Recording.py recording.mrsmrec
+#   The replay through the acquisition scheduler is checked by
+#       python code/MRSM_Recording.py --test
+#
+#-------------------------------------------------------------------------------
+
+import json
+import struct
+import threading
+from time import time, asctime, perf_counter
+
+import numpy as np
+
+from MRSM_Utilities import debug_message, error_message
+
+
+RECORDING_MAGIC = b'MRSMREC1'
+
+
+def recordDtype(sensorCount) -> np.dtype:
+    return np.dtype([
+        ('timestamp',               '<f8'),
+        ('holderRotationAngleDeg',  '<f4'),
+        ('holderAxialPositionMm',   '<f4'),
+        ('isRead',                  'u1',  (sensorCount,)),
+        ('sampleTimesNs',           '<i8', (sensorCount,)),
+        ('registers',               'u1',  (sensorCount,8)),
+    ])
+
+
+def readRecording(filename) -> tuple:
+    """
+    returns (header dict, records array)
+    """
+    with open(filename,'rb') as file:
+        if file.read(len(RECORDING_MAGIC))!=RECORDING_MAGIC:
+            raise ValueError(f"{filename} is not an MRSM recording")
+        headerLength, = struct.unpack('<I',file.read(4))
+        header = json.loads(file.read(headerLength).decode('utf-8'))
+        records = np.fromfile(file,dtype=recordDtype(len(header['sensorNames'])))
+    return header, records
+
+
+class SweepRecorder():
+    """
+    Appends raw sweeps to a recording file
+    """
+
+    def __init__(self,filename,sensorNames,version='') -> None:
+        self.filename       = filename
+        self.sensorNames    = tuple(sensorNames)
+        self.record         = np.zeros(1,dtype=recordDtype(len(self.sensorNames)))
+        self.recordCount    = 0
+        self.lock           = threading.Lock()     # record() runs in the acquisition thread
+        header = json.dumps({'MRSM_version': version, 'datestamp': asctime(),
+                             'sensorNames': list(self.sensorNames)}).encode('utf-8')
+        self.file = open(filename,'wb')
+        self.file.write(RECORDING_MAGIC)
+        self.file.write(struct.pack('<I',len(header)))
+        self.file.write(header)
+        debug_message(f"Recording to {filename}")
+
+    def write(self,timestamp,registers,isRead,sampleTimesNs,holderRotationAngleDeg,holderAxialPositionMm) -> None:
+        with self.lock:
+            if self.file is None:
+                return
+            r = self.record[0]
+            r['timestamp']              = timestamp
+            r['holderRotationAngleDeg'] = holderRotationAngleDeg
+            r['holderAxialPositionMm']  = holderAxialPositionMm
+            r['isRead']                 = isRead
+            r['sampleTimesNs']          = sampleTimesNs
+            r['registers']              = registers
+            self.record.tofile(self.file)
+            self.recordCount += 1
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                debug_message(f"Recorded {self.recordCount} sweeps to {self.filename}")
+
+
+class SweepReplaySource():
+    """
+    Plays a recording back in place of the signal emulator (same interface as A31301_FieldEmulator);
+    'speed' is the playback speed factor, None for as fast as possible (one recorded sweep per sweep)
+    """
+
+    def __init__(self,magnetometer,filename,speed=1.0,hasToLoop=True) -> None:
+        self.magnetometer   = magnetometer
+        self.speed          = speed
+        self.hasToLoop      = hasToLoop
+        header, records     = readRecording(filename)
+        if len(records)==0:
+            raise ValueError(f"{filename} contains no sweeps")
+
+        recordedNames = header['sensorNames']
+        unknownSensors = set(recordedNames)-set(magnetometer.MgMGeometry)
+        if unknownSensors:
+            error_message(f"Replay {filename}: sensors {sorted(unknownSensors)} are not in the holder, ignored")
+        self.recordedIndex = {s: i for i,s in enumerate(recordedNames) if s in magnetometer.MgMGeometry}
+
+        # all sweeps are decoded at once
+        sweepCount, sensorCount = len(records), len(recordedNames)
+        registers = records['registers'].reshape(-1,8)
+        self.readings = magnetometer.decodeRawFieldBlocks(registers[:,2:8]).reshape(sweepCount,sensorCount,3).astype(float)
+        self.temperatures = magnetometer.decodeTemperatureBlocks(registers[:,0:2]).reshape(sweepCount,sensorCount)
+        isRead = records['isRead'].astype(bool)
+        self.readings[~isRead] = np.nan
+        self.temperatures[~isRead] = np.nan
+
+        self.holderRotationAnglesDeg    = records['holderRotationAngleDeg'].astype(float)
+        self.holderAxialPositionsMm     = records['holderAxialPositionMm'].astype(float)
+        self.relativeTimes              = records['timestamp']-records['timestamp'][0]
+        # the loop restarts one (mean) sweep period after the last sweep
+        self.durationSec = self.relativeTimes[-1] + (self.relativeTimes[-1]/(sweepCount-1) if sweepCount>1 else 1.0)
+
+        self.presentSensors = set(s for s,i in self.recordedIndex.items() if isRead[:,i].any())
+        self.startTime      = time()
+        self.sweepIndex     = 0
+        self.currentIndex   = 0         # the recorded sweep served last
+        self.servedSensors  = set()     # sensors already served from 'sweepIndex' (as fast as possible mode)
+        debug_message(f"Replaying {sweepCount} sweeps ({self.relativeTimes[-1]:.1f} sec) from {filename}")
+
+    def isSensorPresent(self,sensorPos) -> bool:
+        return sensorPos in self.presentSensors
+
+    def currentSweepIndex(self,sensorNames) -> int:
+        sweepCount = len(self.relativeTimes)
+        if self.speed is None:
+            # a new sweep starts when a sensor is requested again
+            if self.servedSensors.intersection(sensorNames):
+                self.sweepIndex += 1
+                self.servedSensors = set()
+            self.servedSensors.update(sensorNames)
+            index = self.sweepIndex % sweepCount if self.hasToLoop else min(self.sweepIndex,sweepCount-1)
+        else:
+            elapsedSec = (time()-self.startTime)*self.speed
+            if self.hasToLoop:
+                elapsedSec = elapsedSec % self.durationSec
+            index = max(0,int(np.searchsorted(self.relativeTimes,elapsedSec,side='right'))-1)
+
+        self.currentIndex = index
+        return index
+
+    def holderPosition(self) -> tuple:
+        """
+        (holder rotation angle, axial position) of the sweep served last; the magnetometer
+        publishes them in its frames, the holder is set from there in the GUI thread
+        """
+        return (float(self.holderRotationAnglesDeg[self.currentIndex]),float(self.holderAxialPositionsMm[self.currentIndex]))
+
+    def recordedSweep(self,sensorNames,index) -> np.ndarray:
+        """
+        (sensors x 4) array of raw X, Y, Z readings and temperatures in degC of the recorded sweep 'index',
+        as in MagnetometerFrame; NaN rows for sensors which are not in the recorded sweep
+        """
+        sweep = np.full((len(sensorNames),4),np.nan)
+        for row,s in enumerate(sensorNames):
+            i = self.recordedIndex.get(s)
+            if i is not None:
+                sweep[row,0:3] = self.readings[index,i]
+                sweep[row,3] = self.temperatures[index,i]
+        return sweep
+
+    def getSweep(self,sensorNames,t=None) -> np.ndarray:
+        """
+        the field reads (getSweep, getReadingFrame) step through the recording (see currentSweepIndex)
+        """
+        return self.recordedSweep(sensorNames,self.currentSweepIndex(sensorNames))
+
+    def getReadingFrame(self,sensorPos) -> tuple:
+        readingX, readingY, readingZ, temperature = self.getSweep((sensorPos,))[0]
+        return (temperature, readingX, readingY, readingZ)
+
+    def getTemperatureReadingDegC(self,sensorPos) -> float:
+        # from the sweep served last, a temperature read does not start a new sweep
+        return self.recordedSweep((sensorPos,),self.currentIndex)[0,3]
+
+    def getReading(self,sensorPos,axis,stopTime:bool=False) -> float:
+        return self.recordedSweep((sensorPos,),self.currentIndex)[0,axis.value-1]
+
+
+def benchmark(filename):
+    """
+    replays a recording as fast as possible through the decode and field-map path of MRSM_Magnetometer
+    """
+    from MRSM_Controller import MRSM_Magnetometer
+
+    magnetometer = MRSM_Magnetometer(replayFile=filename,replaySpeed=None)
+    sweepCount = len(magnetometer.signalEmulator.relativeTimes)
+    startTime = perf_counter()
+    for _ in range(sweepCount):
+        frame = magnetometer.acquireFrame()
+        if frame.holderRotationAngleDeg!=magnetometer.holderRotationAngleDeg:
+            magnetometer.setHolderAxialRotationAngle(frame.holderRotationAngleDeg)
+        magnetometer.getNormalizedReadingForAllOrientations(frame)
+    elapsedSec = perf_counter()-startTime
+    print(f"{sweepCount} sweeps in {elapsedSec:.3f} sec: {sweepCount/elapsedSec:.0f} sweeps/sec")
+
+def selfTest(filename='MRSM_selftest.mrsmrec',sweepCount=20):
+    """
+    replays a recording as fast as possible through the acquisition scheduler, with a temperature
+    sweep in every tick (interleaved with the field reads): every recorded sweep is served once, in order,
+    also through the fault injection
+    """
+    import os
+    from MRSM_Controller import MRSM_Magnetometer, MagnetometerFrame
+    from MRSM_Acquisition import AcquisitionChannel, AcquisitionScheduler, FrameRingBuffer
+    from MRSM_FaultInjection import FaultInjector
+
+    sensorNames = MRSM_Magnetometer.builtinSensorGeometry().sensorNames
+    recorder = SweepRecorder(filename,sensorNames)
+    for sweep in range(sweepCount):
+        data = np.zeros((len(sensorNames),4))
+        data[:,MagnetometerFrame.X] = sweep     # the reading tells the sweep
+        data[:,MagnetometerFrame.T] = 25.0
+        recorder.write(float(sweep),MRSM_Magnetometer.encodeOutputBlocks(data),np.ones(len(sensorNames),dtype=bool),
+                       np.zeros(len(sensorNames),dtype=np.int64),0.0,0.0)
+    recorder.close()
+
+    try:
+        for hasFaultInjection in (False,True):
+            magnetometer = MRSM_Magnetometer(replayFile=filename,replaySpeed=None)
+            if hasFaultInjection:
+                magnetometer.signalEmulator = FaultInjector(magnetometer.signalEmulator)
+            ringBuffer = FrameRingBuffer(magnetometer.MgMGeometry.keys(),MagnetometerFrame,capacity=sweepCount)
+            scheduler = AcquisitionScheduler(magnetometer,ringBuffer,busTimeBudgetSec=1.0,channelConfig={
+                AcquisitionChannel.FIELD:       {'periodSec': 0.0, 'priority': 0},
+                AcquisitionChannel.TEMPERATURE: {'periodSec': 0.0, 'priority': 1}})
+            servedSweeps = []
+            for _ in range(sweepCount):
+                scheduler.runTick()
+                frame = ringBuffer.latest()
+                servedSweeps.append(int(np.nanmax(frame.rawReadings()[:,0])))
+            assert servedSweeps==list(range(sweepCount)), servedSweeps
+    finally:
+        os.remove(filename)
+    print("MRSM_Recording self test passed")
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:]==['--test']:
+        selfTest()
+    else:
+        benchmark(sys.argv[1])
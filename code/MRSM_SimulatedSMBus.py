@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+
+#-------------------------------------------------------------------------------
+#
+#      The Magnetic Resonance Scanner Mockup Project
+#
+#
+#      M  R  S  M  _  S i m u l a t e d  S M B u s  .  p  y
+#
+#
+#      Last update: 261018
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+#  N O T E S :
+#
+#   Stand-in for smbus2.SMBus, so that the acquisition path (including the
+#   byte-level decoding of the A31301 registers) can be run and timed without
+#   the Raspberry Pi. Set IsI2CBusSimulated in MRSM_Globals to use it.
+#
+#   Every simulated device is a 256-byte register map. A device can have a
+#   'registerSource' callback, which is called before every read, to refresh
+#   the output registers (e.g. from the signal emulator).
+#
+#   Timing model: every transaction costs 'transactionOverheadSec' plus 9 clock
+#   cycles per transferred byte (8 data bits + ACK) at 'clockHz'.
+#   Errors: NACKs are raised as OSError 121 (Remote I/O error), like smbus2 does,
+#   bit errors flip single bits of the returned data.
+#
+#   For a quick benchmark (off the Pi, set IsDeployedOnRaspberryPi = False
+#   in MRSM_Globals first), run
+#       python code/MRSM_SimulatedSMBus.py
+#
+#-------------------------------------------------------------------------------
+
+import errno
+import random
+from time import sleep, perf_counter
+
+
+I2C_M_RD = 0x0001   # i2c_msg flag of a read message (see linux/i2c.h)
+
+
+class SimulatedSMBus():
+    """
+    Simulated I2C bus with A31301-like devices and TCA9548A-style multiplexers
+    """
+
+    def __init__(self,bus=1,
+                 clockHz=400000,
+                 transactionOverheadSec=50e-6,
+                 nackRate=0.0,
+                 bitErrorRate=0.0,
+                 seed=None) -> None:
+        self.bus                    = bus
+        self.clockHz                = clockHz
+        self.transactionOverheadSec = transactionOverheadSec
+        self.nackRate               = nackRate          # probability of a NACK per transaction
+        self.bitErrorRate           = bitErrorRate      # probability of a flipped bit per returned bit
+        self.random                 = random.Random(seed)
+
+        self.devices        = {}    # (muxAddress, muxChannel, address) -> device, (None, None, address) if direct
+        self.multiplexers   = {}    # muxAddress -> selected channel bit mask
+
+        # statistics
+        self.transactionCount   = 0
+        self.byteCount          = 0
+        self.nackCount          = 0
+        self.busTimeSec         = 0.0
+
+    class Device():
+        def __init__(self,registers=None,registerSource=None) -> None:
+            self.registers = bytearray(256)
+            if registers is not None:
+                self.registers[0:len(registers)] = bytes(registers)
+            self.registerSource = registerSource    # called as registerSource(device) before a read
+            self.pointer = 0                        # register pointer for reads without register address
+
+    def addDevice(self,address,registers=None,registerSource=None,muxAddress=None,muxChannel=None) -> Device:
+        device = SimulatedSMBus.Device(registers,registerSource)
+        self.devices[(muxAddress,muxChannel,address)] = device
+        return device
+
+    def removeDevice(self,address,muxAddress=None,muxChannel=None) -> None:
+        self.devices.pop((muxAddress,muxChannel,address),None)
+
+    def addMultiplexer(self,muxAddress) -> None:
+        self.multiplexers[muxAddress] = 0
+
+    def close(self) -> None:
+        pass
+
+    # ---- internals -------------------------------------------------------
+
+    def transfer(self,address,byteCount) -> None:
+        """
+        accounts for (and waits) the bus time of one transaction, raises a NACK if the device does not respond
+        """
+        busTimeSec = self.transactionOverheadSec + (1+byteCount)*9/self.clockHz   # +1 for the address byte
+        self.transactionCount += 1
+        self.byteCount += byteCount
+        self.busTimeSec += busTimeSec
+        if busTimeSec>0:
+            sleep(busTimeSec)
+        if (address not in self.multiplexers and self.findDevice(address) is None) or self.random.random()<self.nackRate:
+            self.nackCount += 1
+            raise OSError(errno.EREMOTEIO,"Remote I/O error")
+
+    def findDevice(self,address) -> Device:
+        device = self.devices.get((None,None,address))
+        if device is not None:
+            return device
+        for muxAddress,channelMask in self.multiplexers.items():
+            for channel in range(8):
+                if channelMask & (1<<channel):
+                    device = self.devices.get((muxAddress,channel,address))
+                    if device is not None:
+                        return device
+        return None
+
+    def readRegisters(self,address,register,length) -> list:
+        device = self.findDevice(address)
+        if device.registerSource is not None:
+            device.registerSource(device)
+        data = list(device.registers[register:register+length])
+        device.pointer = (register+length) % 256
+        if self.bitErrorRate>0:
+            for i in range(len(data)):
+                for bit in range(8):
+                    if self.random.random()<self.bitErrorRate:
+                        data[i] ^= (1<<bit)
+        return data
+
+    # ---- smbus2.SMBus interface -----------------------------------------
+
+    def read_byte(self,i2c_addr,force=None) -> int:
+        self.transfer(i2c_addr,1)
+        if i2c_addr in self.multiplexers:
+            return self.multiplexers[i2c_addr]
+        device = self.findDevice(i2c_addr)
+        return self.readRegisters(i2c_addr,device.pointer,1)[0]
+
+    def write_byte(self,i2c_addr,value,force=None) -> None:
+        self.transfer(i2c_addr,1)
+        if i2c_addr in self.multiplexers:
+            self.multiplexers[i2c_addr] = value & 0xFF
+        else:
+            self.findDevice(i2c_addr).pointer = value & 0xFF
+
+    def read_byte_data(self,i2c_addr,register,force=None) -> int:
+        self.transfer(i2c_addr,2)
+        return self.readRegisters(i2c_addr,register,1)[0]
+
+    def write_byte_data(self,i2c_addr,register,value,force=None) -> None:
+        self.transfer(i2c_addr,2)
+        self.findDevice(i2c_addr).registers[register] = value & 0xFF
+
+    def read_i2c_block_data(self,i2c_addr,register,length,force=None) -> list:
+        self.transfer(i2c_addr,1+length)
+        return self.readRegisters(i2c_addr,register,length)
+
+    def write_i2c_block_data(self,i2c_addr,register,data,force=None) -> None:
+        self.transfer(i2c_addr,1+len(data))
+        device = self.findDevice(i2c_addr)
+        device.registers[register:register+len(data)] = bytes(data)
+
+    def i2c_rdwr(self,*i2c_msgs) -> None:
+        """
+        combined transaction, e.g. i2c_msg.write(address,[register]) followed by i2c_msg.read(address,length)
+        """
+        self.transfer(i2c_msgs[0].addr,sum(m.len for m in i2c_msgs))
+        for m in i2c_msgs:
+            device = self.findDevice(m.addr)
+            if device is None:
+                self.nackCount += 1
+                raise OSError(errno.EREMOTEIO,"Remote I/O error")
+            if m.flags & I2C_M_RD:
+                data = self.readRegisters(m.addr,device.pointer,m.len)
+                for i,b in enumerate(data):
+                    m.buf[i] = bytes([b])
+            else:
+                written = [m.buf[i][0] for i in range(m.len)]
+                if len(written)>0:
+                    # the register address, then the data from that register on (the pointer advances past them)
+                    register, data = written[0], written[1:]
+                    device.registers[register:register+len(data)] = bytes(data)
+                    device.pointer = (register+len(data)) % 256
+
+    # ---- A31301 register encoding ---------------------------------------
+
+    @staticmethod
+    def encode15bitSignedInt(v) -> tuple:
+        """
+        inverse of MRSM_Magnetometer.convert_15bitSignedInt_to_int, returns (msb, lsb)
+        """
+        v = int(v) & 0x7FFF
+        return (v>>8, v & 0xFF)
+
+    @staticmethod
+    def encode12bitSignedInt(v) -> tuple:
+        """
+        inverse of MRSM_Magnetometer.convert_12bitSignedInt_to_int, returns (msb, lsb)
+        """
+        v = int(v) & 0x0FFF
+        return (v>>8, v & 0xFF)
+
+    @staticmethod
+    def encodeA31301OutputRegisters(registers,temperatureDegC,readingX,readingY,readingZ) -> None:
+        """
+        writes the A31301 output registers 0x1C..0x23
+        """
+        # for the temperature formula, see A31303 Datasheet, p.13
+        registers[0x1c:0x1e] = bytes(SimulatedSMBus.encode12bitSignedInt(round((temperatureDegC-25)*8.052)))
+        registers[0x1e:0x20] = bytes(SimulatedSMBus.encode15bitSignedInt(readingX))
+        registers[0x20:0x22] = bytes(SimulatedSMBus.encode15bitSignedInt(readingY))
+        registers[0x22:0x24] = bytes(SimulatedSMBus.encode15bitSignedInt(readingZ))
+
+
+def benchmark(sweeps=100):
+    """
+    times the real acquisition and decode path of MRSM_Magnetometer on a simulated bus
+    """
+    import numpy as np
+    from MRSM_Controller import MRSM_Magnetometer
+
+    # decode round trip over the whole value range
+    for v in range(-MRSM_Magnetometer.A31301_maxReadingRange-1,MRSM_Magnetometer.A31301_maxReadingRange+1):
+        assert MRSM_Magnetometer.convert_15bitSignedInt_to_int(*SimulatedSMBus.encode15bitSignedInt(v))==v
+    for v in range(-2048,2048):
+        assert MRSM_Magnetometer.convert_12bitSignedInt_to_int(*SimulatedSMBus.encode12bitSignedInt(v))==v
+
+    # the vectorized decoding must give the same values as the scalar one
+    values = np.arange(-MRSM_Magnetometer.A31301_maxReadingRange-1,MRSM_Magnetometer.A31301_maxReadingRange+1)
+    blocks = np.array([SimulatedSMBus.encode15bitSignedInt(v)*3 for v in values],dtype=np.uint8)
+    assert (MRSM_Magnetometer.decodeRawFieldBlocks(blocks)==values[:,None]).all()
+    blocks = np.array([SimulatedSMBus.encode12bitSignedInt(v) for v in range(-2048,2048)],dtype=np.uint8)
+    assert np.allclose(MRSM_Magnetometer.decodeTemperatureBlocks(blocks),
+                       [MRSM_Magnetometer.convertTemperatureReadout(msb,lsb) for msb,lsb in blocks.tolist()])
+    # ... also if the bits above the value are set (bit 15 of the field registers is reserved)
+    words = np.arange(0,0x10000,7)
+    blocks = np.column_stack((words>>8,words&0xFF)).astype(np.uint8)
+    assert (MRSM_Magnetometer.decodeRawFieldBlocks(np.tile(blocks,3))[:,0]==
+            [MRSM_Magnetometer.convert_15bitSignedInt_to_int(msb,lsb) for msb,lsb in blocks.tolist()]).all()
+    assert np.allclose(MRSM_Magnetometer.decodeTemperatureBlocks(blocks),
+                       [MRSM_Magnetometer.convertTemperatureReadout(msb,lsb) for msb,lsb in blocks.tolist()])
+
+    bus = SimulatedSMBus(clockHz=400000,seed=1)
+    addresses = range(96,111)
+    for address in addresses:
+        device = bus.addDevice(address)
+        SimulatedSMBus.encodeA31301OutputRegisters(device.registers,25.0,1000,-2000,3000)
+
+    # combined write: the data from the addressed register on, then a combined read of them back
+    from smbus2 import i2c_msg
+    bus.i2c_rdwr(i2c_msg.write(addresses[0],[0x10,0xAB,0xCD]))
+    assert bus.devices[(None,None,addresses[0])].registers[0x10:0x12]==bytes([0xAB,0xCD])
+    assert bus.devices[(None,None,addresses[0])].pointer==0x12
+    readBack = i2c_msg.read(addresses[0],2)
+    bus.i2c_rdwr(i2c_msg.write(addresses[0],[0x10]),readBack)
+    assert list(readBack)==[0xAB,0xCD]
+
+    startTime = perf_counter()
+    for _ in range(sweeps):
+        for address in addresses:
+            block = bus.read_i2c_block_data(address,0x1c,8)
+            assert MRSM_Magnetometer.convertOutputBlock(block)[1:]==(1000,-2000,3000)
+    elapsedSec = perf_counter()-startTime
+    print(f"{sweeps} sweeps of {len(addresses)} sensors: "
+          f"{elapsedSec/sweeps*1000:.2f} ms per sweep (simulated bus time {bus.busTimeSec/sweeps*1000:.2f} ms), "
+          f"{bus.transactionCount} transactions")
+
+    # decoding only, per sensor vs. whole sweep at once
+    blocks = np.array([bus.devices[(None,None,address)].registers[0x1c:0x24] for address in addresses],dtype=np.uint8)
+    startTime = perf_counter()
+    for _ in range(sweeps):
+        for block in blocks.tolist():
+            MRSM_Magnetometer.convertOutputBlock(block)
+    scalarSec = (perf_counter()-startTime)/sweeps
+    startTime = perf_counter()
+    for _ in range(sweeps):
+        MRSM_Magnetometer.decodeOutputBlocks(blocks)
+    vectorizedSec = (perf_counter()-startTime)/sweeps
+    print(f"decoding of one sweep: {scalarSec*1e6:.1f} us sensor by sensor, {vectorizedSec*1e6:.1f} us vectorized")
+
+if __name__ == '__main__':
+    benchmark()
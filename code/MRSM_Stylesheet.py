@@ -62,7 +62,8 @@ QPushButton#bTransversal:disabled
 }
 
 QPushButton#bStore:pressed,
-QPushButton#bPlayTest:pressed
+QPushButton#bPlayTest:pressed,
+QPushButton#bMapping:checked
 { 
     background-color: lightgreen;
 }
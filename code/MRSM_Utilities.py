@@ -69,3 +69,167 @@ class TimerIterator(QTimer):
         else:
             self.value_changed.emit(value)
 
+
+class DeadlineMonitor():
+    """
+    Counts the ticks of a periodic (QTimer) handler which missed their deadline,
+    i.e. were started late or took too long; call begin() and end() around the handler.
+    The timer is expected to be restarted at the end of the handler, so a tick
+    is due 'periodSec' after the end of the previous one.
+    """
+
+    def __init__(self,periodSec,deadlineSec=0.2) -> None:
+        self.periodSec      = periodSec
+        self.deadlineSec    = deadlineSec
+        self.reset()
+
+    def reset(self) -> None:
+        self.tickCount      = 0
+        self.missCount      = 0
+        self.worstSec       = 0.0       # worst lateness + duration
+        self.beginTime      = None
+        self.lastEndTime    = None
+
+    def begin(self) -> None:
+        self.beginTime = time.perf_counter()
+
+    def end(self) -> None:
+        endTime = time.perf_counter()
+        if self.beginTime is None:
+            return
+        latenessSec = 0.0 if self.lastEndTime is None else max(0.0,self.beginTime-self.lastEndTime-self.periodSec)
+        delaySec = latenessSec + (endTime-self.beginTime)
+        self.tickCount += 1
+        if delaySec>self.deadlineSec:
+            self.missCount += 1
+        self.worstSec = max(self.worstSec,delaySec)
+        self.lastEndTime = endTime
+        self.beginTime = None
+
+    def pause(self) -> None:
+        """
+        the handler is not due while the timer is stopped
+        """
+        self.lastEndTime = None
+
+    def summary(self) -> str:
+        return f'{self.missCount}/{self.tickCount} missed, worst {self.worstSec*1000:.0f} ms'
+
+
+class FrameBudgetGovernor():
+    """
+    Adapts a periodic (QTimer) refresh to its measured cost: call begin(), mark() after each phase
+    (and addCost() for work done elsewhere, e.g. by a worker process or in paintEvent), end(),
+    then restart the timer with nextIntervalMsec().
+
+    The refresh period is stretched (from 'periodSec' up to 'maxPeriodSec') so that the cost
+    takes at most 'maxCpuShare' of it; the next tick is due one period after the begin of
+    the previous one (the rate does not drift with the cost), but never sooner than the
+    handler leaves the Qt thread idle for the same share (touch events are served in between).
+    When the cost stays over 'frameBudgetSec', the detail level is raised (0 is the finest,
+    up to 'detailCount'-1), when it stays well under, it is lowered again; the caller maps
+    the level to its own settings. Costs are smoothed, and a few ticks after a change of
+    the detail are left out (e.g. new interpolation operators).
+    """
+
+    SMOOTHING               = 0.3   # of the exponential average of the costs
+    COARSER_AFTER_TICKS     = 2     # consecutive ticks over the budget
+    FINER_AFTER_TICKS       = 10    # consecutive ticks under FINER_BUDGET_SHARE of the budget
+    FINER_BUDGET_SHARE      = 0.4
+    SETTLE_TICKS            = 2     # left out after a change of the detail
+    MIN_INTERVAL_SEC        = 0.01
+
+    def __init__(self,periodSec,frameBudgetSec,maxCpuShare=0.5,maxPeriodSec=None,detailCount=1) -> None:
+        self.nominalPeriodSec   = periodSec
+        self.frameBudgetSec     = frameBudgetSec
+        self.maxCpuShare        = maxCpuShare
+        self.maxPeriodSec       = 5*periodSec if maxPeriodSec is None else maxPeriodSec
+        self.detailCount        = detailCount
+        self.detailLevel        = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self.periodSec          = self.nominalPeriodSec
+        self.phaseCostSec       = {}        # smoothed, per phase
+        self.costSec            = None      # smoothed, all phases
+        self.overCount          = 0
+        self.underCount         = 0
+        self.settleCount        = 0
+        self.detailChangeCount  = 0
+        self.beginTime          = None
+        self.lastMarkTime       = None
+        self.handlerSec         = 0.0       # of the latest tick, in the Qt thread
+        self.tickCosts          = {}
+
+    def begin(self) -> None:
+        self.beginTime = self.lastMarkTime = time.perf_counter()
+        self.tickCosts = {}
+
+    def mark(self,phase: str) -> None:
+        """
+        the time since the previous mark (or begin) is the cost of 'phase'
+        """
+        now = time.perf_counter()
+        if self.lastMarkTime is not None:
+            self.addCost(phase,now-self.lastMarkTime)
+        self.lastMarkTime = now
+
+    def addCost(self,phase: str,costSec) -> None:
+        self.tickCosts[phase] = self.tickCosts.get(phase,0.0)+costSec
+
+    def end(self) -> None:
+        if self.beginTime is None:
+            return
+        self.handlerSec = time.perf_counter()-self.beginTime
+        self.beginTime = None
+        if self.settleCount>0:
+            self.settleCount -= 1
+            return
+
+        a = FrameBudgetGovernor.SMOOTHING
+        for phase,costSec in self.tickCosts.items():
+            self.phaseCostSec[phase] = costSec if phase not in self.phaseCostSec else (1-a)*self.phaseCostSec[phase]+a*costSec
+        costSec = sum(self.tickCosts.values())
+        self.costSec = costSec if self.costSec is None else (1-a)*self.costSec+a*costSec
+
+        self.periodSec = min(self.maxPeriodSec,max(self.nominalPeriodSec,self.costSec/self.maxCpuShare))
+
+        if self.costSec>self.frameBudgetSec:
+            self.overCount, self.underCount = self.overCount+1, 0
+            if self.overCount>=FrameBudgetGovernor.COARSER_AFTER_TICKS and self.detailLevel<self.detailCount-1:
+                self.setDetailLevel(self.detailLevel+1)
+        elif self.costSec<FrameBudgetGovernor.FINER_BUDGET_SHARE*self.frameBudgetSec:
+            self.overCount, self.underCount = 0, self.underCount+1
+            if self.underCount>=FrameBudgetGovernor.FINER_AFTER_TICKS and self.detailLevel>0:
+                self.setDetailLevel(self.detailLevel-1)
+        else:
+            self.overCount, self.underCount = 0, 0
+
+    def setDetailLevel(self,detailLevel) -> None:
+        self.detailLevel = detailLevel
+        self.detailChangeCount += 1
+        self.overCount, self.underCount = 0, 0
+        self.costSec = None
+        self.phaseCostSec = {}
+        self.settleCount = FrameBudgetGovernor.SETTLE_TICKS
+        debug_message(f"Frame budget governor: detail level {detailLevel}")
+
+    def nextIntervalMsec(self) -> int:
+        """
+        the timer interval from now (the end of the handler) to the next tick
+        """
+        idleSec = self.handlerSec*(1-self.maxCpuShare)/self.maxCpuShare
+        intervalSec = max(FrameBudgetGovernor.MIN_INTERVAL_SEC,idleSec,self.periodSec-self.handlerSec)
+        return int(round(intervalSec*1000))
+
+    def pause(self) -> None:
+        """
+        the handler is not due while the timer is stopped
+        """
+        self.beginTime = None
+
+    def summary(self) -> str:
+        if self.costSec is None:
+            return f'period {self.periodSec*1000:.0f} ms, detail {self.detailLevel}'
+        phases = ', '.join(f'{phase} {costSec*1000:.1f}' for phase,costSec in self.phaseCostSec.items())
+        return f'period {self.periodSec*1000:.0f} ms, detail {self.detailLevel}, cost {self.costSec*1000:.1f} ms ({phases})'